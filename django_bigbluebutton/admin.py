@@ -7,7 +7,7 @@ from django.utils.html import format_html
 
 from .forms import MeetingCreateLinkForm
 from .settings import UPDATE_RUNNING_ON_EACH_CALL
-from .models import Meeting, MeetingLog, MeetingRecord
+from .models import Meeting, MeetingLog, MeetingRecord, SyncState, WebhookEvent
 
 
 @admin.register(Meeting)
@@ -16,7 +16,7 @@ class MeetingAdmin(admin.ModelAdmin):
     search_fields = ['name', 'meeting_id']
     list_display = (
         'id', 'name', 'meeting_id', 'created_at',
-        'is_running', 'meeting_actions'
+        'is_running', 'server', 'meeting_actions'
     )
     actions = ["update_running_meetings"] if not UPDATE_RUNNING_ON_EACH_CALL else []
     list_per_page = 30
@@ -164,3 +164,5 @@ class MeetingAdmin(admin.ModelAdmin):
 
 admin.site.register(MeetingLog)
 admin.site.register(MeetingRecord)
+admin.site.register(SyncState)
+admin.site.register(WebhookEvent)
@@ -7,5 +7,6 @@ router = DefaultRouter()
 router.register("meeting", MeetingViewSet, "meeting_vs")
 
 urlpatterns = [
+    path('metrics/', metrics_view, name='metrics'),
     path('', include(router.urls)),
 ]
@@ -1,13 +1,16 @@
-import datetime
-import json
+import hmac
 import logging
-import urllib.parse
 
+from django.http import HttpResponse, Http404
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
-from ..models import Meeting, MeetingLog
+from .. import metrics
+from ..settings import BBB_METRICS_TOKEN, BBB_WEBHOOK_ASYNC
+from ..models import Meeting
+from ..queues import get_queue, to_payload
+from ..webhooks import parse_events, process_events
 from .serializers import MeetingSerializer
 
 
@@ -42,77 +45,31 @@ class MeetingViewSet(ModelViewSet):
                   }
                }
             ]&timestamp=1607608642905&domain=meeting.cpol.co
+
+        If BBB_WEBHOOK_ASYNC is enabled, events are only queued here,
+        and processed by `manage.py bbb_webhook_worker`.
         """
-        print('here')
-        event_data = request.data.get('event', '')
-        current_datetime = datetime.datetime.now()
+        if BBB_WEBHOOK_ASYNC:
+            get_queue().put(to_payload(request.data))
+            return Response({}, status=202)
 
         try:
-            tmp = urllib.parse.unquote(event_data)
-            event_data = json.loads(tmp)
-            print(event_data)
-            for e in event_data:
-                e = e['data']
-                event_id = e['id']
-                if event_id in ['user-joined', 'user-left']:
-                    try:
-                        attributes = e['attributes']
-                        meeting_id = attributes['meeting']['external-meeting-id']
-                        user_id = attributes['user']['external-user-id']
-
-                        try:
-                            user_id_valid = int(user_id)
-                        except:
-                            user_id_valid = None
-
-                        if not user_id_valid:
-                            continue
-
-                        from django_bigbluebutton.models import Meeting
-                        meeting = Meeting.objects.filter(meeting_id=meeting_id).first()
-                        if not meeting:
-                            continue
-
-                        # When user-joined/left is received
-                        # By default we should set current date
-                        # To all logs of this user which are null yet
-                        MeetingLog.objects.filter(
-                            meeting=meeting,
-                            user_id=user_id_valid,
-                            left_date__isnull=True
-                        ).update(
-                            left_date=current_datetime
-                        )
+            process_events(parse_events(to_payload(request.data)))
+        except Exception as e:
+            logging.error('[-] Unable to process webhook events, {}'.format(str(e)))
 
-                        if event_id == 'user-joined':
-                            MeetingLog.objects.create(
-                                meeting=meeting,
-                                user_id=user_id_valid
-                            )
-                    except Exception as e:
-                        logging.error(str(e))
-                elif event_id == 'meeting-ended':
-                    try:
-                        attributes = e['attributes']
-                        meeting_id = attributes['meeting']['external-meeting-id']
+        return Response({})
 
-                        from django_bigbluebutton.models import Meeting
-                        meeting = Meeting.objects.filter(meeting_id=meeting_id).first()
-                        if not meeting:
-                            continue
 
-                        # Now bulk update all meetingLogs which their left_date is null
-                        MeetingLog.objects.filter(
-                            meeting=meeting,
-                            left_date__isnull=True
-                        ).update(
-                            left_date=current_datetime
-                        )
-                    except Exception as e:
-                        logging.error(str(e))
+def metrics_view(request):
+    """ Export metrics in Prometheus text format, if metrics backend can render them. """
+    render = getattr(metrics.backend, 'render', None)
+    if render is None:
+        raise Http404
 
-        except Exception as e:
-            print(e)
-            pass
+    if BBB_METRICS_TOKEN:
+        expected = 'Bearer {}'.format(BBB_METRICS_TOKEN)
+        if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), expected):
+            return HttpResponse(status=401)
 
-        return Response({})
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,212 @@
+"""
+Asyncio version of BigBlueButton client.
+
+Needs httpx to be installed (pip install django-bigbluebutton[async]).
+Sample usage to check lots of meetings at once from sync code:
+
+    import asyncio
+    from django_bigbluebutton.async_bbb import AsyncBigBlueButton
+
+    statuses = asyncio.run(AsyncBigBlueButton().is_running_many(meeting_ids))
+"""
+import time
+import asyncio
+import logging
+import weakref
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *
+from . import metrics
+from .bbb import BigBlueButtonBase
+from .exceptions import BigBlueButtonUnavailable
+from .resilience import get_breaker, call_timeout, call_retries, backoff_delay
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# One pooled client per event loop, because httpx.AsyncClient
+# connections can not be shared between different loops.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """ Return the httpx.AsyncClient shared by all AsyncBigBlueButton
+    instances running in current event loop. """
+    if httpx is None:
+        raise ImproperlyConfigured('httpx is required to use AsyncBigBlueButton.')
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=BBB_HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=BBB_HTTP_POOL_MAXSIZE if BBB_HTTP_KEEP_ALIVE else 0,
+            ),
+            timeout=httpx.Timeout(BBB_READ_TIMEOUT, connect=BBB_CONNECT_TIMEOUT),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_client():
+    """ Close pooled client of current event loop, if any. """
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+class AsyncBigBlueButton(BigBlueButtonBase):
+    """ Same calls as bbb.BigBlueButton, but as coroutines.
+
+    URLs and checksums are built and responses parsed by
+    BigBlueButtonBase, so results are same as sync client.
+    Fan-out calls (get_meetings(detailed=True), is_running_many) run at most
+    BBB_ASYNC_MAX_CONCURRENCY requests at the same time.
+    """
+    max_concurrency = BBB_ASYNC_MAX_CONCURRENCY
+
+    async def get(self, url):
+        """ Send GET request through the pooled client and return body.
+        Retries and circuit breaker work same as BigBlueButton.get. """
+        response = await self.request(url)
+        return response.content
+
+    async def request(self, url, stream=False):
+        """ Send GET request and return the response. With stream=True
+        response body is not read, and caller should close it. """
+        call = self.call_name(url)
+        connect, read = call_timeout(call, (BBB_CONNECT_TIMEOUT, BBB_READ_TIMEOUT))
+        retries = call_retries(call)
+        breaker = get_breaker(self.server)
+        client = get_client()
+
+        attempt = 0
+        while True:
+            breaker.before_call()
+            started = time.perf_counter()
+            failed = True
+            try:
+                request = client.build_request('GET', url, timeout=httpx.Timeout(read, connect=connect))
+                response = await client.send(request, stream=stream)
+                failed = response.status_code >= 500
+            except httpx.TransportError as e:
+                metrics.observe_call(call, self.server, started, e.__class__.__name__)
+                if attempt >= retries:
+                    raise BigBlueButtonUnavailable(
+                        'Unable to call {} on server "{}", {}'.format(call, self.server, str(e))
+                    ) from e
+                response = None
+            finally:
+                # Any outcome, even an unexpected error, ends a half-open trial
+                if failed:
+                    breaker.failure()
+                else:
+                    breaker.success()
+
+            if response is not None:
+                if not failed:
+                    metrics.observe_call(call, self.server, started)
+                    return response
+                metrics.observe_call(call, self.server, started, 'http_{}'.format(response.status_code))
+                if attempt >= retries:
+                    return response
+                await response.aclose()
+
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    async def gather(self, coros):
+        """ Run coroutines concurrently, bounded by max_concurrency,
+        and return their results in same order. """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        return await asyncio.gather(*[bounded(c) for c in coros])
+
+    async def is_running(self, meeting_id):
+        """ Return whether meeting_id is running or not! """
+        url = self.is_running_url(meeting_id)
+        return self.parse_is_running(await self.get(url))
+
+    async def is_running_many(self, meeting_ids):
+        """ Check list of meeting_ids concurrently.
+        Will return dict of {meeting_id: is_running result}. """
+        meeting_ids = list(meeting_ids)
+        results = await self.gather([self.is_running(m) for m in meeting_ids])
+        return dict(zip(meeting_ids, results))
+
+    async def end_meeting(self, meeting_id, password):
+        url = self.end_meeting_url(meeting_id, password)
+        return self.parse_end_meeting(await self.get(url))
+
+    async def meeting_info(self, meeting_id, password):
+        url = self.meeting_info_url(meeting_id, password)
+        return self.parse_meeting_info(await self.get(url))
+
+    async def get_meetings(self, detailed=False):
+        """ Will return list of running meetings (MeetingInfo). If detailed=True,
+        info of all meetings are fetched again concurrently. """
+        url = self.get_meetings_url()
+        d = self.parse_get_meetings(await self.get(url))
+        if detailed:
+            infos = await self.gather([
+                self.meeting_info(m.meeting_id, m.moderator_pw) for m in d
+            ])
+            d = [info or m for m, info in zip(d, infos)]
+        return d
+
+    async def start(self, name, meeting_id, **kwargs):
+        url = self.start_url(name, meeting_id, **kwargs)
+        return self.parse_start(await self.get(url))
+
+    async def get_hooks(self):
+        url = self.get_hooks_url()
+        return self.parse_get_hooks(await self.get(url))
+
+    async def create_hook(self, callback_url, meeting_id=None):
+        url = self.create_hook_url(callback_url, meeting_id)
+        return self.parse_create_hook(await self.get(url))
+
+    async def destroy_hook(self, hook_id):
+        url = self.destroy_hook_url(hook_id)
+        return self.parse_destroy_hook(await self.get(url))
+
+    async def get_meeting_records(self, meeting_id):
+        try:
+            url = self.get_meeting_records_url(meeting_id)
+            return self.parse_get_meeting_records(await self.get(url))
+        except Exception as e:
+            logging.error(str(e))
+
+    async def get_records(self, record_ids):
+        url = self.get_meeting_records_url(None, record_id=record_ids)
+        return self.parse_get_meeting_records(await self.get(url))
+
+    async def iter_meeting_records(self, meeting_id=None, page_size=None):
+        """ Async generator version of BigBlueButton.iter_meeting_records. """
+        page_size = page_size or BBB_RECORDINGS_PAGE_SIZE
+        offset = 0
+        while True:
+            url = self.get_meeting_records_url(meeting_id, offset=offset, limit=page_size)
+            parser = self.recordings_parser()
+            response = await self.request(url, stream=True)
+            try:
+                async for chunk in response.aiter_bytes(BBB_STREAM_CHUNK_SIZE):
+                    for record in parser.feed(chunk):
+                        yield record
+            finally:
+                await response.aclose()
+            for record in parser.close():
+                yield record
+
+            offset += page_size
+            if parser.total is None or offset >= parser.total:
+                break
@@ -1,32 +1,91 @@
+import os
+import time
 import logging
 import urllib
 import random
+import threading
 import requests
 
-from hashlib import sha1
+import hashlib
+import xml.etree.ElementTree as ET
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import ugettext_lazy as _
 
 
 from .settings import *
-from .utils import parse_xml
+from . import metrics
+from .cache import ResponseCache
+from .exceptions import BigBlueButtonError, BigBlueButtonUnavailable
+from .resilience import get_breaker, call_timeout, call_retries, backoff_delay
+from .singleflight import SingleFlight
+from .responses import MeetingInfo, Recording, Hook
+from .utils import parse_xml, parse_xml_list, XMLStream
 
 
-class BigBlueButton:
-    """ Main class for BigBlueButton
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
 
-    List of methods:
-        - api_call
-        - is_running
-        - end_meeting
-        - meeting_info
-        - get_meetings
-        - join_url
-        - start
+
+def get_session():
+    """ Return the requests.Session shared by all BigBlueButton instances.
+
+    Session is created lazily once per process (and again after a fork,
+    so workers never share sockets with their parent) and mounts a
+    pooled HTTPAdapter, so connections to BigBlueButton are kept alive
+    and reused instead of doing a TCP+TLS handshake on every call.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=BBB_HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=BBB_HTTP_POOL_MAXSIZE,
+                    pool_block=BBB_HTTP_POOL_BLOCK,
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if not BBB_HTTP_KEEP_ALIVE:
+                    session.headers['Connection'] = 'close'
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+class BigBlueButtonBase:
+    """ Transport independent part of BigBlueButton client.
+
+    Builds checksummed URLs for each API call and parses the
+    responses. BigBlueButton (sync) and AsyncBigBlueButton (asyncio)
+    only add the way requests are sent, so the two can not drift.
+
+    For each call there is a `<call>_url` method which returns the url
+    to GET, and a `parse_<call>` method which decodes its response.
+
+    :param server:  name of server in settings.BBB_SERVERS to call,
+                    if not provided BBB_DEFAULT_SERVER will be used.
     """
     secret_key = settings.BBB_SECRET_KEY
     api_url = settings.BBB_API_URL
     attendee_password = 'ap'
     moderator_password = 'mp'
+    checksum_algorithm = BBB_CHECKSUM_ALGORITHM
+
+    def __init__(self, server=None):
+        self.server = server or BBB_DEFAULT_SERVER
+        try:
+            config = BBB_SERVERS[self.server]
+        except KeyError:
+            raise ImproperlyConfigured('BigBlueButton server "{}" is not defined in BBB_SERVERS.'.format(self.server))
+        self.api_url = config.get('api_url') or self.api_url
+        self.secret_key = config.get('secret_key') or self.secret_key
+        self.checksum_algorithm = config.get('checksum_algorithm', BBB_CHECKSUM_ALGORITHM)
 
     def api_call(self, query, call):
         """ Method to create valid API query
@@ -34,120 +93,43 @@ class BigBlueButton:
         should have a encrypted checksum based on request Data.
         """
         prepared = '{}{}{}'.format(call, query, self.secret_key)
-        checksum = sha1(str(prepared).encode('utf-8')).hexdigest()
+        checksum = hashlib.new(self.checksum_algorithm, str(prepared).encode('utf-8')).hexdigest()
         result = "%s&checksum=%s" % (query, checksum)
         return result
 
-    def is_running(self, meeting_id):
-        """ Return whether meeting_id is running or not! """
-        call = 'isMeetingRunning'
-        query = urllib.parse.urlencode((
+    def call_name(self, url):
+        """ Return name of call from its url, like 'getMeetings'. """
+        return url[len(self.api_url):].split('?', 1)[0]
+
+    def build_url(self, call, data):
+        """ Url-encode data (tuple of key, value pairs) and
+        return full url of call with checksum appended. """
+        query = urllib.parse.urlencode(data)
+        hashed = self.api_call(query, call)
+        return self.api_url + call + '?' + hashed
+
+    # URL builders
+    def is_running_url(self, meeting_id):
+        return self.build_url('isMeetingRunning', (
             ('meetingID', meeting_id),
         ))
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        result = parse_xml(requests.get(url).content)
-        if result:
-            return result.find('running').text
-        return 'error'
 
-    def end_meeting(self, meeting_id, password):
-        """ End meeting,
-        Should provide Moderator password as input to make it work!
-        """
-        call = 'end'
-        query = urllib.parse.urlencode((
+    def end_meeting_url(self, meeting_id, password):
+        return self.build_url('end', (
             ('meetingID', meeting_id),
             ('password', password),
         ))
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        req = requests.get(url)
-        result = parse_xml(req.content)
-        if result:
-            return True
-        return False
 
-    def meeting_info(self, meeting_id, password):
-        """ Get information about meeting.
-        result includes below data:
-            start_time
-            end_time
-            participant_count
-            moderator_count
-            attendee_pw
-            moderator_pw
-        """
-        call = 'getMeetingInfo'
-        query = urllib.parse.urlencode((
+    def meeting_info_url(self, meeting_id, password):
+        return self.build_url('getMeetingInfo', (
             ('meetingID', meeting_id),
             ('password', password),
         ))
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        r = parse_xml(requests.get(url).content)
-        if r:
-            attendee_list = []
-            try:
-                for a in r.findall('attendees'):
-                    try:
-                        x = a.find('attendee')
-                        user_id = x.find('userID').text
-                        if not user_id:
-                            continue
-                        fullname = x.find('fullName').text
-                        role = x.find('role')
-                        attendee_list.append({
-                            'id': user_id,
-                            'fullname': fullname,
-                            'role': role
-                        })
-                    except:
-                        continue
-            except Exception as e:
-                pass
-
-            # Create dict of values for easy use in template
-            d = {
-                'start_time': r.find('startTime').text,
-                'end_time': r.find('endTime').text,
-                'participant_count': r.find('participantCount').text,
-                'moderator_count': r.find('moderatorCount').text,
-                'moderator_pw': r.find('moderatorPW').text,
-                'attendee_pw': r.find('attendeePW').text,
-                'attendee_list': attendee_list,
-                # 'invite_url': reverse('join', args=[meeting_id]),
-            }
-            return d
-        return None
 
-    def get_meetings(self):
-        """ Will return list of running meetings. """
-        call = 'getMeetings'
-        query = urllib.parse.urlencode((
+    def get_meetings_url(self):
+        return self.build_url('getMeetings', (
             ('random', 'random'),
         ))
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        result = parse_xml(requests.get(url).content)
-        # Create dict of values for easy use in template
-        d = []
-        if result:
-            r = result[1].findall('meeting')
-            for m in r:
-                meeting_id = m.find('meetingID').text
-                password = m.find('moderatorPW').text
-                d.append({
-                    'meeting_id': meeting_id,
-                    'running': m.find('running').text,
-                    'moderator_pw': password,
-                    'attendee_pw': m.find('attendeePW').text,
-                    'info': self.meeting_info(
-                        meeting_id,
-                        password
-                    )
-                })
-        return d
 
     def join_url(self, meeting_id, name, password, **kwargs):
         """ Join existing meeting_id.
@@ -155,7 +137,6 @@ class BigBlueButton:
         can send userID also as **kwargs so it will be set on
         meeting join, and can track useful info about users later.
         """
-        call = 'join'
         data = (
             ('fullName', name),
             ('meetingID', meeting_id),
@@ -164,19 +145,50 @@ class BigBlueButton:
         for key, value in kwargs.items():
             # Iterate on kwargs keys, and set their key=value in request.
             data = data + ((key, value), )
+        return self.build_url('join', data)
 
-        query = urllib.parse.urlencode(data)
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        return url
+    def join_urls(self, meeting_id, users, checksum_algorithm=None):
+        """ Return list of join urls of meeting_id for many users at once.
 
-    def start(self, name, meeting_id, **kwargs):
-        """ Start meeting with provided info.
+        :param users:   iterable of (fullname, password) or
+                        (fullname, password, extra) tuples, where extra
+                        is a dict of other params (like userID).
+        :param checksum_algorithm:  'sha1' or 'sha256', default is algorithm of server.
 
-        Most of BigBlueButton info is provided now.
+        Urls are same as join_url would return, but base url, meeting and
+        password params and hashed 'join' prefix are only built once.
+        """
+        urlencode = urllib.parse.urlencode
+        quote = urllib.parse.quote_plus
+        base_url = self.api_url + 'join?'
+        prefix = hashlib.new(checksum_algorithm or self.checksum_algorithm, b'join')
+        secret = str(self.secret_key).encode('utf-8')
+        meeting_part = '&' + urlencode((('meetingID', meeting_id), ))
+        password_parts = {}
+
+        urls = []
+        for user in users:
+            fullname, password = user[0], user[1]
+            extra = user[2] if len(user) > 2 else None
+
+            password_part = password_parts.get(password)
+            if password_part is None:
+                password_part = password_parts[password] = '&' + urlencode((('password', password), ))
+
+            query = 'fullName=' + quote(str(fullname)) + meeting_part + password_part
+            if extra:
+                query += '&' + urlencode(extra)
+
+            checksum = prefix.copy()
+            checksum.update(query.encode('utf-8'))
+            checksum.update(secret)
+            urls.append(base_url + query + '&checksum=' + checksum.hexdigest())
+        return urls
+
+    def start_url(self, name, meeting_id, **kwargs):
+        """ Most of BigBlueButton info is provided now.
         TODO: will add more configs for bigbluebutton later!
         """
-        call = 'create'
         attendee_password = kwargs.get("attendee_password", self.attendee_password)
         moderator_password = kwargs.get("moderator_password", self.moderator_password)
 
@@ -190,7 +202,7 @@ class BigBlueButton:
         voice_bridge = 70000 + random.randint(0, 9999)
 
         # Making the query string
-        query = urllib.parse.urlencode((
+        return self.build_url('create', (
             ('name', name),
             ('meetingID', meeting_id),
             ('attendeePW', attendee_password),
@@ -205,13 +217,270 @@ class BigBlueButton:
             ('allowStartStopRecording', allow_start_stop_recording),
             ('webcamsOnlyForModerator', webcam_only_for_moderators),
         ))
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        result = parse_xml(requests.get(url).content.decode('utf-8'))
-        if result:
-            return result
-        else:
-            raise
+
+    def get_hooks_url(self):
+        return self.build_url('hooks/list', ())
+
+    def create_hook_url(self, callback_url, meeting_id=None):
+        return self.build_url('hooks/create', (
+            ('callbackURL', callback_url),
+            ('meetingID', meeting_id),
+        ))
+
+    def destroy_hook_url(self, hook_id):
+        return self.build_url('hooks/destroy', (
+            ('hookID', hook_id),
+        ))
+
+    def get_meeting_records_url(self, meeting_id, offset=None, limit=None, record_id=None):
+        """ meeting_id can also be a list of meeting ids, or None
+        to get recordings of all meetings. offset and limit are
+        used to page through recordings (BigBlueButton >= 2.6).
+        record_id (or a list of them) only gets those recordings. """
+        if isinstance(meeting_id, (list, tuple, set)):
+            meeting_id = ','.join(meeting_id)
+        if isinstance(record_id, (list, tuple, set)):
+            record_id = ','.join(record_id)
+        data = ()
+        if meeting_id:
+            data += (('meetingID', meeting_id), )
+        if record_id:
+            data += (('recordID', record_id), )
+        if offset is not None:
+            data += (('offset', offset), )
+        if limit is not None:
+            data += (('limit', limit), )
+        return self.build_url('getRecordings', data)
+
+    # Response parsers
+    @staticmethod
+    def parse_is_running(content):
+        result = parse_xml(content)
+        if result is not None:
+            return result.findtext('running')
+        return 'error'
+
+    @staticmethod
+    def parse_end_meeting(content):
+        return parse_xml(content) is not None
+
+    @staticmethod
+    def parse_meeting_info(content):
+        """ Return MeetingInfo of getMeetingInfo response, or None. """
+        r = parse_xml(content)
+        if r is not None:
+            return MeetingInfo.from_xml(r)
+        return None
+
+    @staticmethod
+    def parse_get_meetings(content):
+        """ Return list of MeetingInfo of running meetings.
+
+        getMeetings response already has all fields of getMeetingInfo
+        for each meeting, so info of them is built from this one
+        response instead of calling getMeetingInfo per meeting.
+        Raises BigBlueButtonError if response is not valid or FAILED.
+        """
+        stream = XMLStream('meeting', MeetingInfo.from_xml)
+        try:
+            items = list(stream.feed(content))
+            items.extend(stream.close())
+        except (ValueError, ET.ParseError) as e:
+            # An empty list would mean all meetings are ended
+            raise BigBlueButtonError('Invalid getMeetings response, {}'.format(str(e)))
+        return items
+
+    @staticmethod
+    def parse_start(content):
+        """ Return MeetingInfo of created meeting. """
+        result = parse_xml(content)
+        if result is not None:
+            return MeetingInfo.from_xml(result)
+        raise BigBlueButtonError('BigBlueButton was unable to create meeting.')
+
+    @staticmethod
+    def parse_get_hooks(content):
+        """ Return list of Hook. """
+        return parse_xml_list(content, 'hook', Hook.from_xml)
+
+    @staticmethod
+    def parse_create_hook(content):
+        r = parse_xml(content)
+        if r is not None and r.findtext('hookID'):
+            return {'hook_id': r.findtext('hookID')}
+        return None
+
+    @staticmethod
+    def parse_destroy_hook(content):
+        return parse_xml(content) is not None
+
+    @staticmethod
+    def parse_get_meeting_records(content):
+        """ Return list of Recording. """
+        return parse_xml_list(content, 'recording', Recording.from_xml)
+
+    @staticmethod
+    def recordings_parser():
+        """ Incremental parser for getRecordings response, see XMLStream. """
+        return XMLStream('recording', Recording.from_xml)
+
+
+class BigBlueButton(BigBlueButtonBase):
+    """ Main class for BigBlueButton
+
+    All instances share one pooled HTTP session (see get_session),
+    so it's cheap to create a new BigBlueButton() for each call.
+    For asyncio code use AsyncBigBlueButton from async_bbb.py.
+
+    Read-only calls are cached (see cache.py), pass use_cache=False
+    to always get fresh result from server.
+
+    List of methods:
+        - api_call
+        - get
+        - is_running
+        - end_meeting
+        - meeting_info
+        - get_meetings
+        - join_url
+        - start
+    """
+    timeout = (BBB_CONNECT_TIMEOUT, BBB_READ_TIMEOUT)
+    cache = ResponseCache()
+    flight = SingleFlight()
+
+    def __init__(self, server=None, use_cache=True):
+        super(BigBlueButton, self).__init__(server=server)
+        self.use_cache = use_cache and BBB_CACHE_ENABLED
+
+    def get(self, url, **kwargs):
+        """ Send GET request to BigBlueButton through the shared
+        connection pool and return the response.
+
+        Idempotent calls are retried with backoff on connection errors,
+        timeouts and 5xx responses. Raises BigBlueButtonUnavailable if
+        server can't be reached, or its circuit breaker is open.
+        """
+        call = self.call_name(url)
+        timeout = call_timeout(call, self.timeout)
+        retries = call_retries(call)
+        breaker = get_breaker(self.server)
+
+        attempt = 0
+        while True:
+            breaker.before_call()
+            started = time.perf_counter()
+            failed = True
+            try:
+                response = get_session().get(url, timeout=timeout, **kwargs)
+                failed = response.status_code >= 500
+            except requests.RequestException as e:
+                metrics.observe_call(call, self.server, started, e.__class__.__name__)
+                if attempt >= retries:
+                    raise BigBlueButtonUnavailable(
+                        'Unable to call {} on server "{}", {}'.format(call, self.server, str(e))
+                    ) from e
+                response = None
+            finally:
+                # Any outcome, even an unexpected error, ends a half-open trial
+                if failed:
+                    breaker.failure()
+                else:
+                    breaker.success()
+
+            if response is not None:
+                if not failed:
+                    metrics.observe_call(call, self.server, started)
+                    return response
+                metrics.observe_call(call, self.server, started, 'http_{}'.format(response.status_code))
+                if attempt >= retries:
+                    return response
+                response.close()
+
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def cached(self, call, args, loader, cacheable=None):
+        """ Return result of loader() for call, from cache if possible.
+        Identical calls running at the same time are coalesced, so
+        only one request is sent to BBB for all of them. """
+        key = self.cache.key(self.server, call, *args)
+        if BBB_COALESCE_CALLS:
+            loader = partial(self.flight.do, key, loader)
+
+        ttl = self.cache.ttl(call)
+        if not self.use_cache or not ttl:
+            return loader()
+        return self.cache.get_or_load(key, ttl, loader, cacheable)
+
+    def is_running(self, meeting_id):
+        """ Return whether meeting_id is running or not! """
+        url = self.is_running_url(meeting_id)
+        return self.cached(
+            'isMeetingRunning', (meeting_id, ),
+            lambda: self.parse_is_running(self.get(url).content),
+            cacheable=lambda r: r != 'error'
+        )
+
+    def end_meeting(self, meeting_id, password):
+        """ End meeting,
+        Should provide Moderator password as input to make it work!
+        """
+        url = self.end_meeting_url(meeting_id, password)
+        result = self.parse_end_meeting(self.get(url).content)
+        self.cache.invalidate_meeting(self.server, meeting_id)
+        return result
+
+    def meeting_info(self, meeting_id, password):
+        """ Get information about meeting, as MeetingInfo.
+        result includes below data (and more, see responses.py):
+            start_time
+            end_time
+            participant_count
+            moderator_count
+            attendee_pw
+            moderator_pw
+            attendees
+        """
+        url = self.meeting_info_url(meeting_id, password)
+        return self.cached(
+            'getMeetingInfo', (meeting_id, ),
+            lambda: self.parse_meeting_info(self.get(url).content),
+            cacheable=lambda r: r is not None
+        )
+
+    def get_meetings(self, detailed=False):
+        """ Will return list of running meetings (MeetingInfo).
+
+        All info is built from single getMeetings call. If detailed=True,
+        info of each meeting is fetched again with getMeetingInfo,
+        running at most BBB_MAX_WORKERS calls in parallel.
+        """
+        return self.cached(
+            'getMeetings', (detailed, ),
+            lambda: self._get_meetings(detailed)
+        )
+
+    def _get_meetings(self, detailed):
+        url = self.get_meetings_url()
+        d = self.parse_get_meetings(self.get(url).content)
+        if detailed and d:
+            with ThreadPoolExecutor(max_workers=min(BBB_MAX_WORKERS, len(d))) as executor:
+                infos = executor.map(
+                    lambda m: self.meeting_info(m.meeting_id, m.moderator_pw),
+                    d
+                )
+                d = [info or m for m, info in zip(d, infos)]
+        return d
+
+    def start(self, name, meeting_id, **kwargs):
+        """ Start meeting with provided info.
+        Accepted kwargs are documented in start_url.
+        """
+        url = self.start_url(name, meeting_id, **kwargs)
+        content = self.get(url).content
+        self.cache.invalidate_meeting(self.server, meeting_id)
+        return self.parse_start(content)
 
     def get_hooks(self):
         """ Will return list of existing hooks.
@@ -234,36 +503,11 @@ class BigBlueButton:
             </hooks>
             </response>
         """
-        call = 'hooks/list'
-        query = urllib.parse.urlencode(())
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        r = parse_xml(requests.get(url).content)
-
-        hooks_list = []
-        if r:
-            try:
-                for h in r.findall('hooks'):
-                    try:
-                        x = h.find('hook')
-                        callback_url = x.find('callbackURL').text
-                        meeting_id = x.find('meetingID').text
-                        hook_id = x.find('meetingID').text
-                    except Exception as e:
-                        # print(e)
-                        continue
-
-                    hooks_list.append({
-                        'hook_id': hook_id,
-                        'meeting_id': meeting_id,
-                        'callback_url': callback_url
-                    })
-            except Exception as e:
-                # print(e)
-                pass
-
-        print(hooks_list)
-        return hooks_list
+        url = self.get_hooks_url()
+        return self.cached(
+            'hooks/list', (),
+            lambda: self.parse_get_hooks(self.get(url).content)
+        )
 
     def create_hook(self, callback_url, meeting_id=None):
         """ Will create a hook for meeting
@@ -279,82 +523,54 @@ class BigBlueButton:
             <message>There is already a hook for this callback URL.</message>
             </response>
         """
-        """ Return whether meeting_id is running or not! """
-        call = 'hooks/create'
-        data = (
-            ('callbackURL', callback_url),
-            ('meetingID', meeting_id),
-        )
-
-        query = urllib.parse.urlencode(data)
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        print(url)
-        r = parse_xml(requests.get(url).content)
-
-        try:
-            hook_id = r.find('hookID').text
-            return {'hook_id': hook_id}
-        except:
-            return None
+        url = self.create_hook_url(callback_url, meeting_id)
+        result = self.parse_create_hook(self.get(url).content)
+        self.cache.invalidate(self.server, 'hooks/list')
+        return result
 
     def destroy_hook(self, hook_id):
-        call = 'hooks/destroy'
-        data = (
-            ('hookID', hook_id),
-        )
-        query = urllib.parse.urlencode(data)
-        hashed = self.api_call(query, call)
-        url = self.api_url + call + '?' + hashed
-        print(url)
-        result = parse_xml(requests.get(url).content)
-        print(result)
-        if result:
-            return True
-        return False
+        url = self.destroy_hook_url(hook_id)
+        result = self.parse_destroy_hook(self.get(url).content)
+        self.cache.invalidate(self.server, 'hooks/list')
+        return result
 
     # Recordings
     def get_meeting_records(self, meeting_id):
         """ Will return list of records for provided meeting_id """
         try:
-            call = 'getRecordings'
-            query = urllib.parse.urlencode((
-                ('meetingID', meeting_id),
-            ))
-            hashed = self.api_call(query, call)
-            url = self.api_url + call + '?' + hashed
-            content = requests.get(url).content
-            result = parse_xml(content)
-            print(result)
-            # Create dict of values for easy use in template
-            d = []
-            if result:
-                r = result[1].findall('recording')
-                for m in r:
-                    try:
-                        record_id = m.find('recordID').text
-                        meeting_id = m.find('meetingID').text
-                        name = m.find('name').text
-                        start_time = m.find('startTime').text
-                        end_time = m.find('endTime').text
-                        raw_size = m.find('rawSize').text
-                        try:
-                            url = m.find('playback').find('format').find('url').text
-                        except:
-                            url = ''
-                        d.append({
-                            'url': url,
-                            'name': name,
-                            'end_time': end_time,
-                            'raw_size': raw_size,
-                            'record_id': record_id,
-                            'meeting_id': meeting_id,
-                            'start_time': start_time,
-                        })
-                    except Exception as e:
-                        logging.error(str(e))
-            return d
+            url = self.get_meeting_records_url(meeting_id)
+            return self.cached(
+                'getRecordings', (meeting_id, ),
+                lambda: self.parse_get_meeting_records(self.get(url).content)
+            )
         except Exception as e:
             logging.error(str(e))
 
+    def get_records(self, record_ids):
+        """ Return list of Recording of record_ids (a record id or list
+        of them), fresh from server. Errors are raised. """
+        url = self.get_meeting_records_url(None, record_id=record_ids)
+        return self.parse_get_meeting_records(self.get(url).content)
 
+    def iter_meeting_records(self, meeting_id=None, page_size=None):
+        """ Generator over records of meeting_id (or list of meeting ids,
+        or all recordings if None). Responses are streamed and parsed
+        incrementally, and fetched page by page with offset/limit, so
+        any number of recordings is processed in constant memory.
+
+        Yields same Recording objects as get_meeting_records.
+        """
+        page_size = page_size or BBB_RECORDINGS_PAGE_SIZE
+        offset = 0
+        while True:
+            url = self.get_meeting_records_url(meeting_id, offset=offset, limit=page_size)
+            parser = self.recordings_parser()
+            with self.get(url, stream=True) as response:
+                for chunk in response.iter_content(chunk_size=BBB_STREAM_CHUNK_SIZE):
+                    yield from parser.feed(chunk)
+                yield from parser.close()
+
+            # Older servers don't send <pagination> and return everything at once
+            offset += page_size
+            if parser.total is None or offset >= parser.total:
+                break
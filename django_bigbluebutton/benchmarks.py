@@ -0,0 +1,260 @@
+"""
+Benchmarks of hot paths of this package, run against FakeBigBlueButton.
+
+Used by `manage.py bbb_benchmark`, which runs them in a test database
+and writes results as json, so results of different versions can be
+compared (see compare()).
+"""
+import gc
+import json
+import time
+import platform
+import datetime
+import statistics
+
+import django
+
+from django.contrib.auth import get_user_model
+from django.test import Client
+from django.urls import reverse, NoReverseMatch
+
+from .settings import *
+from .bbb import BigBlueButton
+from .models import Meeting, MeetingLog
+from . import tasks
+
+
+def package_version():
+    try:
+        from importlib.metadata import version
+        return version('django-bigbluebutton')
+    except Exception:
+        return 'unknown'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(durations, items=1):
+    """ Return stats of list of durations (seconds), each one processing `items` items. """
+    total = sum(durations)
+    return {
+        'runs': len(durations),
+        'items_per_run': round(items, 3),
+        'total_seconds': round(total, 6),
+        'mean_seconds': round(statistics.mean(durations), 6),
+        'p50_seconds': round(percentile(durations, 50), 6),
+        'p95_seconds': round(percentile(durations, 95), 6),
+        'p99_seconds': round(percentile(durations, 99), 6),
+        'items_per_second': round(items * len(durations) / total, 3) if total else None,
+    }
+
+
+def timed(fn, repeat, setup=None, items=1):
+    """ Run fn() `repeat` times, calling setup() (not timed) before each run. """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, items)
+
+
+def clear_cache():
+    """ Drop cached BBB responses. They're in the locmem cache of
+    FakeBigBlueButton, so cache of project is never cleared. """
+    backend = BigBlueButton.cache.backend
+    if backend is None:
+        raise RuntimeError('Benchmarks should run while FakeBigBlueButton is running')
+    backend.clear()
+
+
+def create_meetings(fake, count, running=True):
+    """ Create `count` meetings in database, and (if running) on fake server. """
+    Meeting.objects.all().delete()
+    meetings = [
+        Meeting(
+            name='bench-{}'.format(i), meeting_id='bench-{}'.format(i),
+            attendee_password='ap', moderator_password='mp', server=fake.server,
+        )
+        for i in range(count)
+    ]
+    Meeting.objects.bulk_create(meetings)
+    fake.meetings.clear()
+    if running:
+        for m in meetings:
+            fake.create_meeting(m.meeting_id, m.name)
+    return list(Meeting.objects.all())
+
+
+def callback_path(meeting):
+    try:
+        return reverse('api_bbb:meeting_vs-hook-callback', args=[meeting.id])
+    except NoReverseMatch:
+        return '/api/meeting/{}/callback/'.format(meeting.id)
+
+
+# Benchmarks, each one returns a dict of stats
+def bench_get_meetings(fake, rooms, repeat, **kwargs):
+    create_meetings(fake, rooms)
+    for i in range(rooms):
+        fake.join('bench-{}'.format(i), 'User', user_id=i)
+    bbb = BigBlueButton(use_cache=False)
+    return timed(bbb.get_meetings, repeat, items=rooms)
+
+
+def bench_update_running_meetings(fake, meetings, repeat, **kwargs):
+    create_meetings(fake, meetings)
+    return timed(Meeting.update_running_meetings, repeat, setup=clear_cache, items=meetings)
+
+
+def bench_update_meetings_logs(fake, meetings, repeat, **kwargs):
+    create_meetings(fake, meetings)
+
+    # Half of meetings are ended on server, so their logs should be closed
+    for i in range(0, meetings, 2):
+        fake.end('bench-{}'.format(i))
+
+    def setup():
+        clear_cache()
+        Meeting.objects.update(is_running=True)
+        MeetingLog.objects.all().delete()
+        MeetingLog.objects.bulk_create([
+            MeetingLog(meeting=m, fullname='User') for m in Meeting.objects.all()
+        ])
+
+    return timed(tasks.update_meetings_logs, repeat, setup=setup, items=meetings)
+
+
+def bench_update_meetings_records(fake, meetings, repeat, **kwargs):
+    created = create_meetings(fake, meetings)
+    fake.recordings.clear()
+    for m in created:
+        fake.add_recording(m.meeting_id)
+    return timed(tasks.update_meetings_records, repeat, setup=clear_cache, items=meetings)
+
+
+def bench_hook_callback(fake, events_rate, events_duration, events_batch, **kwargs):
+    """ Post user-joined/user-left events to hook_callback at events_rate
+    events per second, for events_duration seconds. """
+    meetings = create_meetings(fake, 10)
+    User = get_user_model()
+    User.objects.all().delete()
+    User.objects.bulk_create([User(id=i, username='bench-{}'.format(i)) for i in range(1, 51)])
+    client = Client()
+    paths = [callback_path(m) for m in meetings]
+
+    total_events = int(events_rate * events_duration)
+    durations = []
+    sent = 0
+    start = time.perf_counter()
+    while sent < total_events:
+        n = min(events_batch, total_events - sent)
+        meeting = meetings[(sent // events_batch) % len(meetings)]
+        events = [
+            fake.event(
+                'user-joined' if (sent + i) % 2 == 0 else 'user-left',
+                meeting.meeting_id, user_id=(sent + i) // 2 % 50 + 1, fullname='User'
+            )
+            for i in range(n)
+        ]
+        data = {'event': json.dumps(events), 'timestamp': int(time.time() * 1000), 'domain': 'bench'}
+
+        t = time.perf_counter()
+        client.post(paths[(sent // events_batch) % len(paths)], data)
+        durations.append(time.perf_counter() - t)
+        sent += n
+
+        # Keep target rate
+        delay = start + sent / float(events_rate) - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    elapsed = time.perf_counter() - start
+    # Last post may have fewer events than events_batch
+    result = summarize(durations, sent / float(len(durations)))
+    result.update({
+        'target_events_per_second': events_rate,
+        'achieved_events_per_second': round(total_events / elapsed, 3),
+    })
+    return result
+
+
+def bench_get_report(fake, logs, repeat, **kwargs):
+    results = {}
+    meeting = create_meetings(fake, 1)[0]
+    for count in logs:
+        MeetingLog.objects.all().delete()
+        now = datetime.datetime.now()
+        MeetingLog.objects.bulk_create([
+            MeetingLog(
+                meeting=meeting, fullname='User {}'.format(i % 500),
+                left_date=now if i % 10 else None,
+            )
+            for i in range(count)
+        ], batch_size=5000)
+        results[str(count)] = timed(meeting.get_report, repeat, items=count)
+    return results
+
+
+BENCHMARKS = {
+    'get_meetings': bench_get_meetings,
+    'update_running_meetings': bench_update_running_meetings,
+    'update_meetings_logs': bench_update_meetings_logs,
+    'update_meetings_records': bench_update_meetings_records,
+    'hook_callback': bench_hook_callback,
+    'get_report': bench_get_report,
+}
+
+
+def run(fake, names=None, **options):
+    """ Run benchmarks (all if names is None) and return results as dict. """
+    results = {
+        'version': package_version(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'date': datetime.datetime.now().isoformat(),
+        'options': options,
+        'benchmarks': {},
+    }
+    for name, bench in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        results['benchmarks'][name] = bench(fake, **options)
+    return results
+
+
+def flatten(benchmarks, prefix=''):
+    """ Yield (name, stats) of each benchmark, get_report sizes become 'get_report.10000'. """
+    for name, stats in benchmarks.items():
+        if 'mean_seconds' in stats:
+            yield prefix + name, stats
+        else:
+            for item in flatten(stats, prefix + name + '.'):
+                yield item
+
+
+def compare(results, baseline, threshold=0.2):
+    """ Compare mean time of each benchmark with baseline results.
+
+    Return list of (name, baseline mean, current mean, change, regressed)
+    for all benchmarks found in both. change is relative (0.25 means 25%
+    slower), and it's a regression if change is greater than threshold.
+    """
+    old = dict(flatten(baseline.get('benchmarks', {})))
+    rows = []
+    for name, stats in flatten(results['benchmarks']):
+        if name not in old or not old[name]['mean_seconds']:
+            continue
+        before = old[name]['mean_seconds']
+        after = stats['mean_seconds']
+        rows.append((name, before, after, (after - before) / before, (after - before) / before > threshold))
+    return rows
@@ -0,0 +1,93 @@
+"""
+Cache layer for read-only BigBlueButton API responses.
+
+Responses are stored in django cache (settings.BBB_CACHE_ALIAS) for
+BBB_CACHE_TTL[call] seconds. After that they are still served for
+BBB_CACHE_STALE_TTL more seconds while one background thread refreshes
+them (stale-while-revalidate), so a slow BBB server won't stall pages.
+"""
+import time
+import logging
+import threading
+
+from hashlib import sha1
+
+from django.core.cache import caches
+
+from .settings import *
+
+
+class ResponseCache:
+    """ Cache of parsed BBB responses, keyed on server, call and meeting_id. """
+    prefix = 'bbb'
+
+    def __init__(self, alias=None, backend=None):
+        self.alias = alias or BBB_CACHE_ALIAS
+        self.backend = backend
+
+    @property
+    def cache(self):
+        """ Cache backend, `backend` if it's set (used by FakeBigBlueButton), or cache of alias. """
+        if self.backend is not None:
+            return self.backend
+        return caches[self.alias]
+
+    def key(self, server, call, *args):
+        # Hash args, so any meeting_id makes a valid cache key for all backends
+        args_hash = sha1(repr(args).encode('utf-8')).hexdigest()
+        return '{}:{}:{}:{}'.format(self.prefix, server, call, args_hash)
+
+    def ttl(self, call):
+        return BBB_CACHE_TTL.get(call, 0)
+
+    def set(self, key, value, ttl):
+        """ Store value with time it's fresh until. Entry is kept
+        BBB_CACHE_STALE_TTL more seconds to be served as stale. """
+        self.cache.set(key, (value, time.time() + ttl), timeout=ttl + BBB_CACHE_STALE_TTL)
+
+    def get_or_load(self, key, ttl, loader, cacheable=None):
+        """ Return cached value of key, or call loader() and cache its result.
+
+        :param cacheable:   optional function, result of loader is only
+                            cached if cacheable(result) is True. (so errors
+                            are not cached)
+        """
+        entry = self.cache.get(key)
+        if entry is not None:
+            value, fresh_until = entry
+            if time.time() >= fresh_until and self.cache.add(key + ':refresh', 1, BBB_CACHE_STALE_TTL or 1):
+                # Stale, serve it and let only one thread refresh it
+                threading.Thread(
+                    target=self.refresh,
+                    args=(key, ttl, loader, cacheable),
+                    daemon=True
+                ).start()
+            return value
+
+        value = loader()
+        if cacheable is None or cacheable(value):
+            self.set(key, value, ttl)
+        return value
+
+    def refresh(self, key, ttl, loader, cacheable=None):
+        try:
+            value = loader()
+            if cacheable is None or cacheable(value):
+                self.set(key, value, ttl)
+        except Exception as e:
+            logging.error('[-] Unable to refresh cached BBB response {}, {}'.format(key, str(e)))
+        finally:
+            self.cache.delete(key + ':refresh')
+
+    def invalidate(self, server, call, *args):
+        self.cache.delete(self.key(server, call, *args))
+
+    def invalidate_meeting(self, server, meeting_id):
+        """ Remove every cached response which has state of meeting_id. """
+        self.cache.delete_many([
+            self.key(server, 'isMeetingRunning', meeting_id),
+            self.key(server, 'getMeetingInfo', meeting_id),
+            self.key(server, 'getRecordings', meeting_id),
+            self.key(server, 'getMeetings', False),
+            self.key(server, 'getMeetings', True),
+        ])
@@ -0,0 +1,7 @@
+class BigBlueButtonError(Exception):
+    """ Base error of calls to BigBlueButton. """
+
+
+class BigBlueButtonUnavailable(BigBlueButtonError):
+    """ BigBlueButton server can not be reached (or its circuit
+    breaker is open, because it failed too many times recently). """
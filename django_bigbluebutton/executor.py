@@ -0,0 +1,136 @@
+"""
+Parallel execution of per-meeting work in sync tasks.
+
+Executor runs fn(item) for many items on a thread pool, with at most
+`concurrency` calls in flight, and at most `per_server` of them on
+each BigBlueButton server, so one big sync won't overload a server
+while others are idle. Items are read from the iterable only when
+there is room for them (backpressure), and errors of single items
+are collected instead of aborting the whole batch.
+
+Sample usage:
+
+    results = Executor().run(
+        lambda meeting: meeting.create_hook(), meetings,
+        server=lambda meeting: meeting.server,
+    )
+    for meeting, error in results.errors:
+        ...
+
+For asyncio code, AsyncBigBlueButton.gather does the same with a semaphore.
+"""
+import collections
+
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.db import connections
+
+from .settings import *
+
+
+class Results:
+    """ Results of Executor.run, lists of (item, result) and (item, error). """
+
+    def __init__(self):
+        self.results = []
+        self.errors = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __repr__(self):
+        return '<Results {} done, {} failed>'.format(len(self.results), len(self.errors))
+
+
+class Executor:
+
+    def __init__(self, concurrency=None, per_server=None, close_connections=False):
+        """
+        :param concurrency:         max calls in flight, BBB_SYNC_CONCURRENCY by default
+        :param per_server:          max calls in flight on each server,
+                                    BBB_SYNC_PER_SERVER_CONCURRENCY by default
+        :param close_connections:   close database connections of worker
+                                    after each item, set it if fn uses database
+        """
+        self.concurrency = max(1, concurrency or BBB_SYNC_CONCURRENCY)
+        self.per_server = max(1, per_server or BBB_SYNC_PER_SERVER_CONCURRENCY)
+        self.close_connections = close_connections
+
+    def call(self, fn, item, wrappers=None):
+        """ Run fn(item) in a worker, with database execute wrappers of
+        calling thread (like query counters of metrics.track_task), since
+        connections and their wrappers are per thread. """
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    for wrapper in (wrappers or {}).get(connection.alias, ()):
+                        stack.enter_context(connection.execute_wrapper(wrapper))
+                return fn(item)
+        finally:
+            if self.close_connections:
+                connections.close_all()
+
+    def imap(self, fn, items, server=None):
+        """ Run fn(item) for each item, and yield (item, result, error)
+        in order they're finished. error is None if fn succeeded.
+
+        :param server:  function returning name of server of an item,
+                        calls of each server are limited to per_server,
+                        without it only concurrency limits the calls
+        """
+        per_server = self.per_server if server else self.concurrency
+        items = iter(items)
+        exhausted = False
+        waiting = collections.defaultdict(collections.deque)  # Items whose server is busy
+        waiting_count = 0
+        running = collections.Counter()
+        futures = {}
+        wrappers = {c.alias: list(c.execute_wrappers) for c in connections.all()}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+
+            def submit(item, name):
+                running[name] += 1
+                futures[pool.submit(self.call, fn, item, wrappers)] = (item, name)
+
+            while True:
+                # Fill free slots, first with items waiting for their server
+                for name, queue in waiting.items():
+                    while queue and len(futures) < self.concurrency and running[name] < per_server:
+                        submit(queue.popleft(), name)
+                        waiting_count -= 1
+
+                while not exhausted and len(futures) < self.concurrency and waiting_count < self.concurrency:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    name = server(item) if server else None
+                    if running[name] < per_server:
+                        submit(item, name)
+                    else:
+                        waiting[name].append(item)
+                        waiting_count += 1
+
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, name = futures.pop(future)
+                    running[name] -= 1
+                    error = future.exception()
+                    yield item, None if error else future.result(), error
+
+    def run(self, fn, items, server=None):
+        """ Run fn(item) for all items and return Results. """
+        results = Results()
+        for item, result, error in self.imap(fn, items, server):
+            if error is None:
+                results.results.append((item, result))
+            else:
+                results.errors.append((item, error))
+        return results
@@ -0,0 +1,178 @@
+"""
+Cluster-wide locks, so each sync task runs on one node at a time.
+
+A lock is a lease: it's held for BBB_TASK_LOCK_TTL seconds and renewed
+by a background thread while task is running, so a crashed node can't
+hold it forever, and long runs don't lose it. Leases are kept in
+SyncState rows (BBB_TASK_LOCK='db'), or in BBB_CACHE_ALIAS cache
+(BBB_TASK_LOCK='cache'), which should be shared between nodes, like
+redis or memcached. BBB_TASK_LOCK=None disables locks, they're always
+acquired.
+
+If lock is held by another node, task waits up to BBB_TASK_LOCK_WAIT
+seconds for it, and then skips the run.
+"""
+import os
+import time
+import uuid
+import socket
+import logging
+import datetime
+import functools
+import threading
+
+from django.db import connections
+from django.db.models import Q
+from django.core.cache import caches
+from django.utils import timezone
+
+from .settings import *
+
+
+class DatabaseLease:
+    """ Lease in SyncState row of name, taken by an atomic UPDATE. """
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+
+    def acquire(self, token):
+        from .models import SyncState
+        SyncState.get(self.name)
+        now = timezone.now()
+        return SyncState.objects.filter(name=self.name).filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+        ).update(locked_by=token, locked_until=now + datetime.timedelta(seconds=self.ttl)) == 1
+
+    def renew(self, token):
+        from .models import SyncState
+        until = timezone.now() + datetime.timedelta(seconds=self.ttl)
+        return SyncState.objects.filter(name=self.name, locked_by=token).update(locked_until=until) == 1
+
+    def release(self, token):
+        from .models import SyncState
+        SyncState.objects.filter(name=self.name, locked_by=token).update(locked_by='', locked_until=None)
+
+
+class CacheLease:
+    """ Lease in a cache key, taken by cache.add. """
+
+    def __init__(self, name, ttl):
+        self.key = 'bbb:lock:{}'.format(name)
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[BBB_CACHE_ALIAS]
+
+    def acquire(self, token):
+        return self.cache.add(self.key, token, self.ttl)
+
+    def renew(self, token):
+        if self.cache.get(self.key) != token:
+            return False
+        self.cache.set(self.key, token, self.ttl)
+        return True
+
+    def release(self, token):
+        if self.cache.get(self.key) == token:
+            self.cache.delete(self.key)
+
+
+class NoLease:
+    """ No lease at all, when locks are disabled by BBB_TASK_LOCK=None. """
+
+    def __init__(self, name, ttl):
+        pass
+
+    def acquire(self, token):
+        return True
+
+    def renew(self, token):
+        return True
+
+    def release(self, token):
+        pass
+
+
+LEASES = {
+    None: NoLease,
+    'db': DatabaseLease,
+    'cache': CacheLease,
+}
+
+
+class TaskLock:
+    """ Lock of a task between all nodes, used as context manager:
+
+        with TaskLock('update_meetings_logs') as acquired:
+            if acquired:
+                ...
+    """
+
+    def __init__(self, name, backend=None, ttl=None, wait=None):
+        backend = backend or BBB_TASK_LOCK
+        self.name = name
+        self.ttl = ttl or BBB_TASK_LOCK_TTL
+        self.wait = BBB_TASK_LOCK_WAIT if wait is None else wait
+        self.lease = LEASES[backend](name, self.ttl)
+        self.token = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.acquired = False
+        self.stopped = threading.Event()
+        self.renewer = None
+
+    def acquire(self):
+        deadline = time.time() + self.wait
+        while True:
+            self.acquired = self.lease.acquire(self.token)
+            if self.acquired or time.time() >= deadline:
+                break
+            time.sleep(min(1, max(0, deadline - time.time())))
+
+        if self.acquired:
+            self.renewer = threading.Thread(target=self.keep_alive, daemon=True)
+            self.renewer.start()
+        return self.acquired
+
+    def keep_alive(self):
+        """ Renew lease every ttl/3 seconds until released. """
+        try:
+            while not self.stopped.wait(self.ttl / 3.0):
+                try:
+                    if not self.lease.renew(self.token):
+                        logging.error('[-] Lost lock of {}, another run may start'.format(self.name))
+                        return
+                except Exception as e:
+                    logging.error('[-] Unable to renew lock of {}, {}'.format(self.name, str(e)))
+        finally:
+            connections.close_all()
+
+    def release(self):
+        if not self.acquired:
+            return
+        self.stopped.set()
+        self.renewer.join()
+        self.lease.release(self.token)
+        self.acquired = False
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def singleton_task(name):
+    """ Decorator to run task on one node at a time. If another node is
+    running it, call is skipped and returns None. Disabled when
+    BBB_TASK_LOCK is None. """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with TaskLock(name) as acquired:
+                if not acquired:
+                    logging.info('[+] Skipped {}, it is running on another node.'.format(name))
+                    return None
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
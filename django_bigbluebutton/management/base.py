@@ -0,0 +1,125 @@
+import re
+import time
+import datetime
+import threading
+
+from contextlib import ExitStack
+
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+from django.core.management.base import BaseCommand, CommandError
+
+from .. import metrics
+from ..servers import get_server_names
+
+
+class CallCounter(metrics.MetricsBackend):
+    """ Metrics backend which counts BBB calls, and passes
+    everything to the configured backend too. """
+    enabled = True
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def increment(self, name, labels, value=1):
+        if name == 'bbb_call_errors_total':
+            with self.lock:
+                self.errors += value
+        if self.backend.enabled:
+            self.backend.increment(name, labels, value)
+
+    def observe(self, name, labels, value):
+        if name == 'bbb_call_duration_seconds':
+            with self.lock:
+                self.calls += 1
+        if self.backend.enabled:
+            self.backend.observe(name, labels, value)
+
+
+class WriteCounter:
+    """ Database execute wrapper which counts queries writing to database. """
+    pattern = re.compile(r'^\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.pattern.match(sql):
+            with self.lock:
+                self.count += 1
+        return execute(sql, params, many, context)
+
+
+def parse_since(value):
+    """ Parse --since, a datetime, a date, or a duration
+    before now like 30m, 6h or 2d. """
+    match = re.match(r'^(\d+)([smhd])$', value)
+    if match:
+        seconds = int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+        return timezone.now() - datetime.timedelta(seconds=seconds)
+
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError('Invalid --since "{}", use a date, datetime or duration like 6h or 2d'.format(value))
+        since = datetime.datetime.combine(date, datetime.time())
+    if timezone.is_naive(since) and timezone.is_aware(timezone.now()):
+        since = timezone.make_aware(since)
+    return since
+
+
+class SyncCommand(BaseCommand):
+    """ Base of sync commands, runs sync() and prints a summary of it. """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Check all meetings, not only changed ones')
+        parser.add_argument('--server', action='append', dest='servers',
+                            help='Only check meetings of this server (can be repeated)')
+        parser.add_argument('--concurrency', type=int, help='Max BBB calls in parallel')
+        parser.add_argument('--batch-size', type=int, help='Max rows written in each query')
+        parser.add_argument('--dry-run', action='store_true', help="Only count changes, don't save them")
+
+    def sync(self, **options):
+        """ Run the sync, and return its stats dict (or None if skipped). """
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        for server in options['servers'] or []:
+            if server not in get_server_names():
+                raise CommandError('Server "{}" is not in BBB_SERVERS'.format(server))
+
+        previous = metrics.backend
+        counter = CallCounter(previous)
+        writes = WriteCounter()
+        metrics.set_backend(counter)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(writes))
+                stats = self.sync(**options)
+        finally:
+            metrics.set_backend(previous)
+        elapsed = time.perf_counter() - started
+
+        if stats is None:
+            self.stdout.write('Skipped, it is running on another node.')
+            return
+
+        stats = dict(stats, bbb_calls=counter.calls, bbb_errors=counter.errors, db_writes=writes.count)
+        meetings = stats.get('meetings', stats.get('running', 0))
+        if options['dry_run']:
+            self.stdout.write('Dry run, nothing is saved.')
+        for key, value in stats.items():
+            self.stdout.write('{:<16} {}'.format(key, value))
+        self.stdout.write('{:<16} {:.3f}s'.format('elapsed', elapsed))
+        if elapsed:
+            self.stdout.write('{:<16} {:.1f} meetings/s, {:.1f} calls/s'.format(
+                'throughput', meetings / elapsed, counter.calls / elapsed
+            ))
@@ -0,0 +1,69 @@
+import json
+
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import benchmarks
+from ...testing import FakeBigBlueButton
+
+
+class Command(BaseCommand):
+    help = 'Benchmark hot paths of django_bigbluebutton against a local fake BigBlueButton server. ' \
+           'Runs in a separate test database, so your data is not touched.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='+', choices=list(benchmarks.BENCHMARKS.keys()),
+                            help='Only run these benchmarks')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each benchmark')
+        parser.add_argument('--rooms', type=int, default=200, help='Running rooms for get_meetings')
+        parser.add_argument('--meetings', type=int, default=200, help='Meetings for sync benchmarks')
+        parser.add_argument('--events-rate', type=int, default=200, help='Webhook events per second to post')
+        parser.add_argument('--events-duration', type=float, default=5, help='Seconds to post webhook events')
+        parser.add_argument('--events-batch', type=int, default=10, help='Webhook events in each post')
+        parser.add_argument('--logs', type=int, nargs='+', default=[10 ** 4, 10 ** 5],
+                            help='Number of MeetingLog rows for get_report')
+        parser.add_argument('--latency', type=float, default=0, help='Latency of fake server in seconds')
+        parser.add_argument('--output', help='Write json results to this file (default: stdout)')
+        parser.add_argument('--compare', help='Json results of a previous run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative slowdown counted as regression (default 0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        bench_options = {
+            'repeat': options['repeat'],
+            'rooms': options['rooms'],
+            'meetings': options['meetings'],
+            'events_rate': options['events_rate'],
+            'events_duration': options['events_duration'],
+            'events_batch': options['events_batch'],
+            'logs': options['logs'],
+        }
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with FakeBigBlueButton(latency=options['latency']) as fake:
+                results = benchmarks.run(fake, names=options['only'], **bench_options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            rows = benchmarks.compare(results, baseline, options['threshold'])
+            regressions = 0
+            for name, before, after, change, regressed in rows:
+                regressions += regressed
+                line = '{:<40} {:>12.6f}s {:>12.6f}s {:>+8.1%}'.format(name, before, after, change)
+                self.stderr.write(self.style.ERROR(line) if regressed else line)
+            if regressions:
+                raise CommandError('{} benchmark(s) regressed more than {:.0%}'.format(
+                    regressions, options['threshold']
+                ))
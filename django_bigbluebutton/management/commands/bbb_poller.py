@@ -0,0 +1,45 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...locks import TaskLock
+from ...poller import Poller
+from ...servers import get_server_names
+
+
+class Command(BaseCommand):
+    help = 'Poll BigBlueButton servers and keep running state of meetings and their logs up to date. ' \
+           'Servers with running meetings are polled often, others rarely.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', action='append', dest='servers',
+                            help='Only poll this server (can be repeated)')
+        parser.add_argument('--hot-interval', type=float, help='Seconds between polls of busy servers')
+        parser.add_argument('--cold-interval', type=float, help='Seconds between polls of idle servers')
+        parser.add_argument('--once', action='store_true', help='Poll each server once and exit')
+
+    def handle(self, *args, **options):
+        for server in options['servers'] or []:
+            if server not in get_server_names():
+                raise CommandError('Server "{}" is not in BBB_SERVERS'.format(server))
+
+        poller = Poller(
+            servers=options['servers'],
+            hot_interval=options['hot_interval'],
+            cold_interval=options['cold_interval'],
+        )
+        if options['once']:
+            poller.run_once()
+            return
+
+        # Only one poller runs in cluster, lease is renewed while it's running
+        with TaskLock('bbb_poller') as acquired:
+            if not acquired:
+                raise CommandError('Another poller is running.')
+
+            signal.signal(signal.SIGTERM, lambda *args: poller.stop())
+            self.stdout.write('Polling servers {}'.format(', '.join(poller.servers)))
+            try:
+                poller.run()
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,23 @@
+from ..base import SyncCommand, parse_since
+from ... import tasks
+
+
+class Command(SyncCommand):
+    help = 'Store new recordings of meetings from BigBlueButton servers.'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--since', help='Check meetings changed since a date, datetime or duration '
+                                            'like 6h or 2d, instead of since last run')
+        parser.add_argument('--meetings-per-call', type=int, help='Meetings asked in each getRecordings call')
+
+    def sync(self, **options):
+        return tasks.update_meetings_records(
+            full=options['full'],
+            since=parse_since(options['since']) if options['since'] else None,
+            servers=options['servers'],
+            dry_run=options['dry_run'],
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            meetings_per_call=options['meetings_per_call'],
+        )
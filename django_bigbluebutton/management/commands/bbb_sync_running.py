@@ -0,0 +1,15 @@
+from ..base import SyncCommand
+from ... import tasks
+
+
+class Command(SyncCommand):
+    help = 'Sync running state of meetings with BigBlueButton servers, and close logs of ended meetings.'
+
+    def sync(self, **options):
+        return tasks.update_meetings_logs(
+            full=options['full'],
+            servers=options['servers'],
+            dry_run=options['dry_run'],
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+        )
@@ -0,0 +1,56 @@
+import signal
+import logging
+import threading
+
+from django.db import close_old_connections
+from django.core.management.base import BaseCommand, CommandError
+
+from ...settings import BBB_WEBHOOK_POLL_INTERVAL
+from ...locks import TaskLock
+from ...queues import drain
+
+
+class Command(BaseCommand):
+    help = 'Process webhook events queued by callback api, when BBB_WEBHOOK_ASYNC is enabled.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Max posts processed at once')
+        parser.add_argument('--interval', type=float, default=BBB_WEBHOOK_POLL_INTERVAL,
+                            help='Seconds to wait for new posts when queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+
+    def handle(self, *args, **options):
+        stopped = threading.Event()
+
+        # Only one worker runs in cluster, so events of each meeting are applied in order
+        with TaskLock('bbb_webhook_worker') as acquired:
+            if not acquired:
+                raise CommandError('Another webhook worker is running.')
+
+            if not options['once']:
+                signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+            total = failed = 0
+            try:
+                while not stopped.is_set():
+                    close_old_connections()
+                    try:
+                        stats = drain(batch_size=options['batch_size'])
+                    except Exception as e:
+                        logging.error('[-] Unable to process webhook events, {}'.format(str(e)))
+                        if options['once']:
+                            raise
+                        stopped.wait(options['interval'])
+                        continue
+
+                    total += stats['posts']
+                    failed += stats['failed']
+                    if stats['failed']:
+                        # Failed posts are retried by next batches, until they're parked
+                        stopped.wait(options['interval'])
+                    elif not stats['posts']:
+                        if options['once']:
+                            break
+                        stopped.wait(options['interval'])
+            except KeyboardInterrupt:
+                pass
+            self.stdout.write('Processed {} posts, {} attempts failed.'.format(total, failed))
@@ -0,0 +1,189 @@
+"""
+Instrumentation of BigBlueButton calls, sync tasks and webhooks.
+
+Metrics are sent to backend set in BBB_METRICS_BACKEND. Default backend
+does nothing, and instrumented code checks `metrics.enabled` first, so
+it costs nothing when metrics are disabled.
+
+Measured metrics:
+    bbb_call_duration_seconds       histogram {call, server}, each attempt
+    bbb_call_errors_total           counter {call, server, error}
+    bbb_task_duration_seconds       histogram {task}
+    bbb_task_db_queries_total       counter {task}
+    bbb_task_errors_total           counter {task}
+    bbb_webhook_events_total        counter {event}
+
+To send metrics elsewhere (statsd, ...), subclass MetricsBackend and
+set BBB_METRICS_BACKEND to its dotted path.
+"""
+import time
+import threading
+import functools
+
+from contextlib import ExitStack
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from .settings import *
+
+
+HELP = {
+    'bbb_call_duration_seconds': 'Duration of BigBlueButton API calls.',
+    'bbb_call_errors_total': 'Failed BigBlueButton API calls.',
+    'bbb_task_duration_seconds': 'Duration of sync tasks.',
+    'bbb_task_db_queries_total': 'Database queries run by sync tasks.',
+    'bbb_task_errors_total': 'Sync tasks which raised an exception.',
+    'bbb_webhook_events_total': 'Processed webhook events.',
+}
+
+
+class MetricsBackend:
+    """ Base of metrics backends, which ignores everything. """
+    enabled = False
+
+    def increment(self, name, labels, value=1):
+        pass
+
+    def observe(self, name, labels, value):
+        pass
+
+
+class PrometheusBackend(MetricsBackend):
+    """ Keeps metrics in memory of process, and renders them in
+    Prometheus text format (see api/metrics/ view). """
+    enabled = True
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(sorted(buckets or BBB_METRICS_BUCKETS))
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def labels_key(labels):
+        return tuple(sorted(labels.items()))
+
+    def increment(self, name, labels, value=1):
+        key = self.labels_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = self.labels_key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                # [count of each bucket..., sum, count]
+                histogram = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(
+            '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in labels
+        ) + '}'
+
+    def render(self):
+        """ Return all metrics in Prometheus text exposition format. """
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append('# HELP {} {}'.format(name, HELP.get(name, name)))
+                lines.append('# TYPE {} counter'.format(name))
+                for key, value in sorted(series.items()):
+                    lines.append('{}{} {}'.format(name, self.format_labels(key), value))
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append('# HELP {} {}'.format(name, HELP.get(name, name)))
+                lines.append('# TYPE {} histogram'.format(name))
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(self.buckets, histogram):
+                        labels = self.format_labels(key + (('le', repr(float(bound))), ))
+                        lines.append('{}_bucket{} {}'.format(name, labels, count))
+                    labels = self.format_labels(key + (('le', '+Inf'), ))
+                    lines.append('{}_bucket{} {}'.format(name, labels, histogram[-1]))
+                    lines.append('{}_sum{} {}'.format(name, self.format_labels(key), histogram[-2]))
+                    lines.append('{}_count{} {}'.format(name, self.format_labels(key), histogram[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+backend = MetricsBackend()
+enabled = False
+
+
+def set_backend(new_backend):
+    """ Use new_backend (instance of MetricsBackend) for all metrics. """
+    global backend, enabled
+    backend = new_backend
+    enabled = new_backend.enabled
+
+
+if BBB_METRICS_BACKEND:
+    set_backend(import_string(BBB_METRICS_BACKEND)())
+
+
+def observe_call(call, server, started, error=None):
+    """ Record one attempt of call on server, started at time.perf_counter()
+    value `started`. error is name of error if it failed. """
+    if not enabled:
+        return
+    labels = {'call': call, 'server': server}
+    backend.observe('bbb_call_duration_seconds', labels, time.perf_counter() - started)
+    if error is not None:
+        backend.increment('bbb_call_errors_total', dict(labels, error=error))
+
+
+def count_event(event_id):
+    """ Count one processed webhook event. """
+    if enabled:
+        backend.increment('bbb_webhook_events_total', {'event': event_id})
+
+
+class QueryCounter:
+    """ Database execute wrapper which counts queries. Executor installs
+    it in its workers too, so queries of parallel work are counted. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def track_task(name):
+    """ Decorator measuring duration, db queries and errors of a sync task. """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+
+            labels = {'task': name}
+            counter = QueryCounter()
+            started = time.perf_counter()
+            try:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(counter))
+                    return fn(*args, **kwargs)
+            except Exception:
+                backend.increment('bbb_task_errors_total', labels)
+                raise
+            finally:
+                backend.observe('bbb_task_duration_seconds', labels, time.perf_counter() - started)
+                backend.increment('bbb_task_db_queries_total', labels, counter.count)
+        return wrapper
+    return decorator
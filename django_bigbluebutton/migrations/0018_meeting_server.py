@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_bigbluebutton', '0017_auto_20210202_1600'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meeting',
+            name='server',
+            field=models.CharField(blank=True, default='', help_text='Name of BigBlueButton server (from BBB_SERVERS) this meeting is placed on', max_length=100, verbose_name='Server'),
+        ),
+    ]
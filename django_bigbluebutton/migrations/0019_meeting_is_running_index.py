@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_bigbluebutton', '0018_meeting_server'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='meeting',
+            name='is_running',
+            field=models.BooleanField(db_index=True, default=False, help_text='Indicates whether this meeting is running in BigBlueButton or not!', verbose_name='Is running'),
+        ),
+    ]
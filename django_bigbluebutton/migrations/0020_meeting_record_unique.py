@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:43
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_records(apps, schema_editor):
+    """ Keep only first row of each record_id, so it can be unique. """
+    MeetingRecord = apps.get_model('django_bigbluebutton', 'MeetingRecord')
+    duplicates = MeetingRecord.objects.exclude(record_id__isnull=True).values('record_id').\
+        annotate(count=Count('id'), first_id=Min('id')).filter(count__gt=1)
+    for item in duplicates:
+        MeetingRecord.objects.filter(record_id=item['record_id']).exclude(id=item['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_bigbluebutton', '0019_meeting_is_running_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_records, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='meetingrecord',
+            name='end_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='End time'),
+        ),
+        migrations.AddField(
+            model_name='meetingrecord',
+            name='start_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Start time'),
+        ),
+        migrations.AlterField(
+            model_name='meetingrecord',
+            name='record_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='Record ID'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_bigbluebutton', '0020_meeting_record_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Job name')),
+                ('last_run', models.DateTimeField(blank=True, help_text='Start time of last successful run', null=True, verbose_name='Last run')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Sync State',
+                'verbose_name_plural': 'Sync State',
+                'db_table': 'meeting_sync_state',
+            },
+        ),
+        migrations.AlterField(
+            model_name='meeting',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
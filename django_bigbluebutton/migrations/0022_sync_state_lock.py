@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_bigbluebutton', '0021_sync_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncstate',
+            name='locked_by',
+            field=models.CharField(blank=True, default='', help_text='Node which is running this job now', max_length=150, verbose_name='Locked by'),
+        ),
+        migrations.AddField(
+            model_name='syncstate',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Locked until'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_bigbluebutton', '0022_sync_state_lock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.TextField(help_text='Raw event field of webhook post', verbose_name='Payload')),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Times processing of post failed, it is parked after BBB_WEBHOOK_MAX_ATTEMPTS', verbose_name='Attempts')),
+                ('error', models.TextField(blank=True, default='', help_text='Error of last failed attempt', verbose_name='Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Webhook Event',
+                'verbose_name_plural': 'Webhook Event',
+                'db_table': 'meeting_webhook_event',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:08
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_bigbluebutton', '0023_webhook_event'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='meetinglog',
+            name='join_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Join Date'),
+        ),
+    ]
@@ -2,12 +2,17 @@ import logging
 import datetime
 
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 
 from .settings import *
 from .bbb import BigBlueButton
-from .utils import xml_to_json
+from .exceptions import BigBlueButtonError
+from .metrics import track_task
+from .executor import Executor
+from .utils import batched
+from .servers import get_server_names, least_loaded_server
 
 User = get_user_model()
 
@@ -35,9 +40,16 @@ class Meeting(models.Model):
     )
     is_running = models.BooleanField(
         default=False,
+        db_index=True,
         verbose_name=_('Is running'),
         help_text=_('Indicates whether this meeting is running in BigBlueButton or not!')
     )
+    server = models.CharField(
+        max_length=100,
+        default='', blank=True,
+        verbose_name=_('Server'),
+        help_text=_('Name of BigBlueButton server (from BBB_SERVERS) this meeting is placed on')
+    )
 
     # Configs
     max_participants = models.IntegerField(
@@ -139,7 +151,7 @@ class Meeting(models.Model):
 
     # Time related Info
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return '{}-{}'.format(self.id, self.name)
@@ -153,34 +165,61 @@ class Meeting(models.Model):
              update_fields=None):
         if not self.name:
             self.name = self.meeting_id
-        super(Meeting, self).save()
+        super(Meeting, self).save(force_insert, force_update, using, update_fields)
+
+    @property
+    def bbb(self):
+        """ BigBlueButton client for server this meeting is placed on. """
+        return BigBlueButton(server=self.server or None)
 
     @property
     def info(self):
         # Will return result of bbb.get_meeting_info
-        return BigBlueButton().meeting_info(
+        return self.bbb.meeting_info(
             self.meeting_id,
             self.moderator_password
         )
 
     def check_is_running(self, commit=True):
         """ Call bbb is_running method, and see if this meeting_id is running! """
-        is_running = BigBlueButton().is_running(self.meeting_id)
+        is_running = self.bbb.is_running(self.meeting_id)
         self.is_running = True if is_running in ['true', True, 'True'] else False
         if commit:
             self.save()
         return self.is_running
 
     def start(self):
-        """ Will start already created meeting again. """
-        result = BigBlueButton().start(
+        """ Will start already created meeting again.
+
+        If meeting is not running on its server anymore (or its
+        server is down), it will be placed on least loaded server again.
+        """
+        servers = get_server_names()
+        if not self.server or self.server not in servers:
+            self.server = least_loaded_server()
+        elif len(servers) > 1:
+            # Only with many servers it may be placed somewhere else
+            try:
+                running = BigBlueButton(server=self.server, use_cache=False).is_running(self.meeting_id)
+            except BigBlueButtonError as e:
+                logging.error('[-] Unable to check meeting {} on server {}, {}'.format(
+                    self.meeting_id, self.server, str(e)
+                ))
+                running = None
+            if running != 'true':
+                self.server = least_loaded_server()
+
+        result = self.bbb.start(
             name=self.name,
             meeting_id=self.meeting_id,
             attendee_password=self.attendee_password,
             moderator_password=self.moderator_password
         )
 
-        if result:
+        if result is not None:
+            self.is_running = True
+            self.save()
+
             # It's better to create hook again,
             # So if by any reason is removed from bbb, again be created
             # If already exist will just give warning and will be ignored
@@ -190,7 +229,7 @@ class Meeting(models.Model):
 
     def end(self):
         # If successfully ended, will return True
-        ended = BigBlueButton().end_meeting(
+        ended = self.bbb.end_meeting(
             meeting_id=self.meeting_id,
             password=self.moderator_password
         )
@@ -206,36 +245,61 @@ class Meeting(models.Model):
 
     def create_join_link(self, fullname, role='moderator', **kwargs):
         pw = self.moderator_password if role == 'moderator' else self.attendee_password
-        link = BigBlueButton().join_url(self.meeting_id, fullname, pw, **kwargs)
+        link = self.bbb.join_url(self.meeting_id, fullname, pw, **kwargs)
         return link
 
-    def create_hook(self):
+    def create_join_links(self, users, checksum_algorithm=None):
+        """ Same as create_join_link, but for many users at once.
+
+        :param users:   iterable of (fullname, role) or (fullname, role, extra)
+                        tuples, extra is a dict of params like {'userID': 12}
+        :return:        list of links in same order of users
+        """
+        users = (
+            (user[0], self.moderator_password if user[1] == 'moderator' else self.attendee_password) + tuple(user[2:])
+            for user in users
+        )
+        return self.bbb.join_urls(self.meeting_id, users, checksum_algorithm=checksum_algorithm)
+
+    def create_hook(self, commit=True, raise_errors=False):
         """ By calling this method, will create a hook to callback-url for this meeting-id
 
+        Errors are logged, or raised if raise_errors=True (used by
+        tasks.update_meetings_hooks, which counts them). Returns True if
+        hook is registered.
+
         TODO: Maybe it's better to delete hooks first then create new one.
         """
-        callback_url = settings.BBB_CALLBACK_URL
-        if callback_url:
-            try:
-                # Be noted meeting_id is different from id,
-                # meeting_id is like meeting-11 (value to know in bbb)
-                # id is just primary key for Meeting instance
-                if not self.hook_url:
-                    self.hook_url = '{callback}/api/meeting/{id}/callback/'.format(
-                        id=self.id,
-                        callback=str(callback_url).rstrip('/'),
-                    )
-                output = BigBlueButton().create_hook(self.hook_url, self.meeting_id)
-                if output.get('hook_id'):
-                    self.hook_id = output['hook_id']
-                    self.save()
-            except Exception as e:
-                error_msg = 'Error in setting api hook for meeting: {}, {}'.format(self.meeting_id, str(e))
-                logging.error(error_msg)
+        callback_url = getattr(settings, 'BBB_CALLBACK_URL', None)
+        if not callback_url:
+            return False
+        try:
+            # Be noted meeting_id is different from id,
+            # meeting_id is like meeting-11 (value to know in bbb)
+            # id is just primary key for Meeting instance
+            if not self.hook_url:
+                self.hook_url = '{callback}/api/meeting/{id}/callback/'.format(
+                    id=self.id,
+                    callback=str(callback_url).rstrip('/'),
+                )
+            output = self.bbb.create_hook(self.hook_url, self.meeting_id)
+            if not output or not output.get('hook_id'):
+                raise BigBlueButtonError('hooks/create did not return a hook id')
+            self.hook_id = output['hook_id']
+            if commit:
+                # Only hook fields, other fields of instance may be stale
+                self.save(update_fields=['hook_id', 'hook_url'])
+            return True
+        except Exception as e:
+            if raise_errors:
+                raise
+            error_msg = 'Error in setting api hook for meeting: {}, {}'.format(self.meeting_id, str(e))
+            logging.error(error_msg)
+            return False
 
     def delete_hook(self):
         if self.hook_id:
-            BigBlueButton().destroy_hook(self.hook_id)
+            self.bbb.destroy_hook(self.hook_id)
 
     def get_report(self):
         """ This method will return useful info about participants in meeting.
@@ -331,6 +395,10 @@ class Meeting(models.Model):
 
     @classmethod
     def create(cls, name, meeting_id, **kwargs):
+        """ Create meeting on BigBlueButton and store it.
+        Meeting is placed on least loaded server, unless
+        name of server is provided as `server` in kwargs. """
+        server = kwargs.pop('server', None) or least_loaded_server()
         kwargs.update({
             'record': kwargs.get('record', BBB_RECORD),
             'logout_url': kwargs.get('logout_url', BBB_LOGOUT_URL),
@@ -339,24 +407,22 @@ class Meeting(models.Model):
             'allow_start_stop_recording': kwargs.get('allow_start_stop_recording', BBB_ALLOW_START_STOP_RECORDING),
         })
 
-        m_xml = BigBlueButton().start(name=name, meeting_id=meeting_id, **kwargs)
-        print(m_xml)
-        meeting_json = xml_to_json(m_xml)
-        if meeting_json['returncode'] != 'SUCCESS':
-            raise ValueError('Unable to create meeting!')
+        # Will raise BigBlueButtonError if unable to create meeting
+        info = BigBlueButton(server=server).start(name=name, meeting_id=meeting_id, **kwargs)
 
         # Now create a model for it.
         meeting, _ = Meeting.objects.get_or_create(meeting_id=meeting_id)
 
         meeting.name = name
+        meeting.server = server
         meeting.is_running = True
         meeting.record = kwargs.get('record', True)
         meeting.logout_url = kwargs.get('logout_url', '')
-        meeting.voice_bridge = meeting_json['voiceBridge']
-        meeting.attendee_password = meeting_json['attendeePW']
-        meeting.moderator_password = meeting_json['moderatorPW']
-        meeting.parent_meeting_id = meeting_json['parentMeetingID']
-        meeting.internal_meeting_id = meeting_json['internalMeetingID']
+        meeting.voice_bridge = info.voice_bridge
+        meeting.attendee_password = info.attendee_pw
+        meeting.moderator_password = info.moderator_pw
+        meeting.parent_meeting_id = info.parent_meeting_id
+        meeting.internal_meeting_id = info.internal_meeting_id
         meeting.welcome_text = kwargs.get('welcome_text', BBB_WELCOME_TEXT)
         meeting.auto_start_recording = kwargs.get('auto_start_recording', True)
         meeting.allow_start_stop_recording = kwargs.get('allow_start_stop_recording', True)
@@ -368,37 +434,100 @@ class Meeting(models.Model):
         return meeting
 
     @classmethod
-    def update_running_meetings(cls):
+    @track_task('update_running_meetings')
+    def update_running_meetings(cls, servers=None, dry_run=False, concurrency=None, batch_size=None, stats=None):
         """ This method will call bigbluebutton,
         fetch running meetings on bbb, and update local
-        database with running meetings info. """
-        running_meetings = BigBlueButton().get_meetings()
-
-        """ A sample response from bigbluebutton.getMeeting():
-        [
-            {
-                'name': 'meeting-10', 'running': 'true', 
-                'moderator_pw': 'mp', 'attendee_pw': 'ap', 
-                'info': {
-                    'start_time': '1599199672948', 'end_time': '0', 
-                    'participant_count': '1', 'moderator_count': '1',
-                     'moderator_pw': 'mp', 'attendee_pw': 'ap'
-                }
-            }
-        ]
+        database with running meetings info.
+        All servers in BBB_SERVERS are checked, in parallel.
+
+        Snapshot of running meetings is diffed against is_running
+        flags in database, and only meetings which their state changed
+        are updated. Returns (started, stopped), lists of ids of meetings
+        which are now running or not running anymore.
+
+        :param servers:     only check these servers, meetings of other
+                            servers are not changed
+        :param dry_run:     find changes, but don't save them
+        :param batch_size:  max meetings updated in each query
+        :param stats:       optional dict, filled with number of checked
+                            servers, failed servers and running meetings
         """
-
+        checked = [s for s in get_server_names() if servers is None or s in servers]
+        batch_size = batch_size or BBB_SYNC_BATCH_SIZE
+
+        running = {}
+        failed_servers = []
+        skipped_servers = set(get_server_names()) - set(checked)
+        def get_meetings(server):
+            # Always a fresh snapshot, a cached one may still show ended meetings
+            return BigBlueButton(server=server, use_cache=False).get_meetings()
+
+        executor = Executor(concurrency=concurrency)
+        for server, meetings, error in executor.imap(get_meetings, checked):
+            if error is not None:
+                # Keep state of meetings on unreachable server as it is
+                logging.error('[-] Unable to get meetings of server {}, {}'.format(server, str(error)))
+                failed_servers.append(server)
+                skipped_servers.add(server)
+                continue
+
+            """ bigbluebutton.getMeetings() returns list of MeetingInfo, like:
+            [
+                <MeetingInfo {
+                    'meeting_id': 'meeting-10', 'running': True,
+                    'moderator_pw': 'mp', 'attendee_pw': 'ap',
+                    'start_time': datetime(2020, 9, 4, 10, 7, 52), 'end_time': None,
+                    'participant_count': 1, 'moderator_count': 1, ...
+                }>
+            ]
+            """
+            for item in meetings:
+                running[item.meeting_id] = server
+
+        if BBB_DEFAULT_SERVER in skipped_servers:
+            # Meetings created before servers were added are on default server
+            skipped_servers.add('')
+
+        if stats is not None:
+            stats.update({
+                'servers': len(checked),
+                'failed_servers': len(failed_servers),
+                'running': len(running),
+            })
+
+        started, stopped = [], []
         try:
-            # First get list of running meetings from bbb
-            meetings_id_list = [item['meeting_id'] for item in running_meetings]
-
-            # Now update all to not running
-            Meeting.objects.all().update(is_running=False)
-
-            # Find meetings with proper id_list running, and update their model status to running
-            Meeting.objects.filter(meeting_id__in=meetings_id_list).update(is_running=True)
+            moved = {}
+            running_in_db = set()
+            for pk, meeting_id, server in Meeting.objects.filter(is_running=True).values_list(
+                    'id', 'meeting_id', 'server'):
+                running_in_db.add(meeting_id)
+                if meeting_id not in running:
+                    if server not in skipped_servers:
+                        stopped.append(pk)
+                elif running[meeting_id] != server:
+                    moved.setdefault(running[meeting_id], []).append(pk)
+
+            new_ids = [meeting_id for meeting_id in running if meeting_id not in running_in_db]
+            new_meetings = {}
+            for ids in batched(new_ids, batch_size):
+                for pk, meeting_id in Meeting.objects.filter(meeting_id__in=ids).values_list('id', 'meeting_id'):
+                    new_meetings.setdefault(running[meeting_id], []).append(pk)
+                    started.append(pk)
+
+            if dry_run:
+                return started, stopped
+
+            now = timezone.now()
+            for ids in batched(stopped, batch_size):
+                Meeting.objects.filter(id__in=ids).update(is_running=False, updated_at=now)
+            for server in set(moved) | set(new_meetings):
+                for ids in batched(moved.get(server, []) + new_meetings.get(server, []), batch_size):
+                    Meeting.objects.filter(id__in=ids).update(is_running=True, server=server, updated_at=now)
         except Exception as e:
             logging.error('[-] Exception in update_running_meetings, {}'.format(str(e)))
+        return started, stopped
 
 
 class MeetingRecord(models.Model):
@@ -421,7 +550,7 @@ class MeetingRecord(models.Model):
     record_id = models.CharField(
         null=True,
         blank=True,
-        db_index=True,
+        unique=True,
         max_length=255,
         verbose_name=_('Record ID'),
     )
@@ -431,6 +560,16 @@ class MeetingRecord(models.Model):
         max_length=500,
         verbose_name=_('Link'),
     )
+    start_time = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('Start time'),
+    )
+    end_time = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('End time'),
+    )
 
     def __str__(self):
         return '{}, {}'.format(self.meeting.name, self.record_id)
@@ -473,7 +612,7 @@ class MeetingLog(models.Model):
         on_delete=models.SET_NULL,
     )
     join_date = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
         verbose_name=_('Join Date')
     )
     left_date = models.DateTimeField(
@@ -507,6 +646,79 @@ class MeetingLog(models.Model):
             ).update(left_date=now_date)
 
         if self.user:
-            self.fullname = self.user.fullname
+            # fullname is a field of custom user model of project, if it has one
+            self.fullname = getattr(self.user, 'fullname', None) or self.fullname
 
         super(MeetingLog, self).save()
+
+
+class SyncState(models.Model):
+    """ High-water marks of each sync job in tasks.py, so next
+    runs only check meetings changed since previous run, and
+    lease of the node which is running it (see locks.py).
+    """
+    name = models.CharField(
+        unique=True,
+        max_length=100,
+        verbose_name=_('Job name')
+    )
+    last_run = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('Last run'),
+        help_text=_('Start time of last successful run')
+    )
+    locked_by = models.CharField(
+        default='',
+        blank=True,
+        max_length=150,
+        verbose_name=_('Locked by'),
+        help_text=_('Node which is running this job now')
+    )
+    locked_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('Locked until'),
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{}, {}'.format(self.name, self.last_run)
+
+    class Meta:
+        db_table = 'meeting_sync_state'
+        verbose_name = 'Sync State'
+        verbose_name_plural = _('Sync State')
+
+    @classmethod
+    def get(cls, name):
+        return cls.objects.get_or_create(name=name)[0]
+
+
+class WebhookEvent(models.Model):
+    """ Raw webhook posts waiting to be processed, when
+    BBB_WEBHOOK_ASYNC is enabled (see queues.DatabaseQueue).
+    """
+    payload = models.TextField(
+        verbose_name=_('Payload'),
+        help_text=_('Raw event field of webhook post')
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Attempts'),
+        help_text=_('Times processing of post failed, it is parked after BBB_WEBHOOK_MAX_ATTEMPTS')
+    )
+    error = models.TextField(
+        blank=True, default='',
+        verbose_name=_('Error'),
+        help_text=_('Error of last failed attempt')
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{}, {}'.format(self.id, self.created_at)
+
+    class Meta:
+        db_table = 'meeting_webhook_event'
+        verbose_name = 'Webhook Event'
+        verbose_name_plural = _('Webhook Event')
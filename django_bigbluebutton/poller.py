@@ -0,0 +1,103 @@
+"""
+Long-running poller of meeting state, see `manage.py bbb_poller`.
+
+Each server is polled with one getMeetings call (through
+tasks.update_meetings_logs), which updates running state of all its
+meetings and closes logs of ended ones. It's never served from cache,
+so duration of a poll is latency of server. How often depends on server:
+
+    hot     has running meetings, or meetings changed in last
+            BBB_POLL_HOT_WINDOW seconds (just created or started),
+            polled every BBB_POLL_HOT_INTERVAL seconds
+    cold    polled every BBB_POLL_COLD_INTERVAL seconds
+
+When a server is slow, it's polled less often, so poller waits on
+it at most 1/load_factor of the time, and when it fails, interval is
+doubled each time, up to BBB_POLL_MAX_INTERVAL.
+"""
+import time
+import logging
+import datetime
+import threading
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .settings import *
+from .models import Meeting
+from .servers import get_server_names
+from . import tasks
+
+
+class Poller:
+    load_factor = 10
+
+    def __init__(self, servers=None, hot_interval=None, cold_interval=None, max_interval=None):
+        self.servers = servers or get_server_names()
+        self.hot_interval = hot_interval or BBB_POLL_HOT_INTERVAL
+        self.cold_interval = cold_interval or BBB_POLL_COLD_INTERVAL
+        self.max_interval = max_interval or BBB_POLL_MAX_INTERVAL
+        self.next_poll = {server: 0 for server in self.servers}
+        self.failures = {server: 0 for server in self.servers}
+        self.stopped = threading.Event()
+
+    def is_hot(self, server, running):
+        if running:
+            return True
+        since = timezone.now() - datetime.timedelta(seconds=BBB_POLL_HOT_WINDOW)
+        return Meeting.objects.filter(
+            server__in=tasks.server_names([server]),
+            updated_at__gte=since
+        ).exists()
+
+    def interval(self, server, hot, duration, failed):
+        """ Return seconds to wait before next poll of server. """
+        if failed:
+            self.failures[server] += 1
+            return min(self.max_interval, self.hot_interval * 2 ** self.failures[server])
+        self.failures[server] = 0
+        interval = self.hot_interval if hot else self.cold_interval
+        return min(self.max_interval, max(interval, duration * self.load_factor))
+
+    def poll(self, server):
+        """ Poll server once, and return seconds until its next poll. """
+        started = time.perf_counter()
+        try:
+            stats = tasks.update_meetings_logs(servers=[server])
+        except Exception as e:
+            logging.error('[-] Unable to poll server {}, {}'.format(server, str(e)))
+            stats = {'failed_servers': 1}
+        duration = time.perf_counter() - started
+
+        if stats is None:
+            # Sync is running somewhere else right now, try again soon
+            return self.hot_interval
+        failed = bool(stats.get('failed_servers'))
+        try:
+            hot = not failed and self.is_hot(server, stats.get('running'))
+        except Exception as e:
+            logging.error('[-] Unable to check meetings of server {}, {}'.format(server, str(e)))
+            hot = True
+        interval = self.interval(server, hot, duration, failed)
+        logging.debug('[+] Polled server {} in {:.3f}s, next poll in {:.1f}s, {}'.format(
+            server, duration, interval, stats
+        ))
+        return interval
+
+    def run_once(self):
+        """ Poll servers which are due, and return seconds until next poll. """
+        now = time.monotonic()
+        for server in self.servers:
+            if self.next_poll[server] <= now:
+                self.next_poll[server] = time.monotonic() + self.poll(server)
+        return max(0, min(self.next_poll.values()) - time.monotonic())
+
+    def run(self):
+        """ Poll servers until stop() is called. """
+        while not self.stopped.is_set():
+            # Connections may be broken or too old between polls of a long-running process
+            close_old_connections()
+            self.stopped.wait(self.run_once())
+
+    def stop(self):
+        self.stopped.set()
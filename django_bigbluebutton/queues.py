@@ -0,0 +1,157 @@
+"""
+Queue of webhook posts, used when BBB_WEBHOOK_ASYNC is enabled.
+
+hook_callback only stores the raw `event` field of each post and
+answers 202, so BBB's webhook delivery never waits on (or retries
+because of) slow database writes. `manage.py bbb_webhook_worker`
+drains the queue in batches with drain(), oldest post first, so events
+of each meeting are applied in order they were posted.
+
+Posts are kept in WebhookEvent table by default. To use another store,
+subclass WebhookQueue and set BBB_WEBHOOK_QUEUE to its dotted path; a
+queue should return posts in order they were put, and keep them until
+they are acked, so a crashed worker doesn't lose them.
+
+A post which can't be processed is retried by next batches, and after
+BBB_WEBHOOK_MAX_ATTEMPTS failures it's parked: kept for inspection, but
+not returned by get() any more. Until then later posts of its meetings
+wait for it, posts of other meetings are not blocked.
+"""
+import json
+import logging
+from collections import Counter
+
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .settings import *
+from .webhooks import parse_events, process_events, event_meeting_id, event_internal_meeting_id
+
+
+class WebhookQueue:
+
+    def put(self, payload):
+        """ Store raw payload of a post. """
+        raise NotImplementedError
+
+    def get(self, limit):
+        """ Return list of (id, payload) of oldest `limit` posts which are neither acked nor parked. """
+        raise NotImplementedError
+
+    def ack(self, ids):
+        """ Remove processed posts. """
+        raise NotImplementedError
+
+    def fail(self, ids, error):
+        """ Count a failed attempt of posts, and park those failed BBB_WEBHOOK_MAX_ATTEMPTS times.
+
+        :return:    ids of parked posts
+        """
+        raise NotImplementedError
+
+
+class DatabaseQueue(WebhookQueue):
+    """ Queue in WebhookEvent table, posts are removed when acked,
+    parked posts are kept with their attempts and last error.
+    """
+
+    def put(self, payload):
+        from .models import WebhookEvent
+        WebhookEvent.objects.create(payload=payload)
+
+    def get(self, limit):
+        from .models import WebhookEvent
+        return list(
+            WebhookEvent.objects.filter(attempts__lt=BBB_WEBHOOK_MAX_ATTEMPTS)
+            .order_by('id').values_list('id', 'payload')[:limit]
+        )
+
+    def ack(self, ids):
+        from .models import WebhookEvent
+        WebhookEvent.objects.filter(id__in=ids).delete()
+
+    def fail(self, ids, error):
+        from .models import WebhookEvent
+        posts = WebhookEvent.objects.filter(id__in=ids)
+        posts.update(attempts=F('attempts') + 1, error=error)
+        return list(posts.filter(attempts__gte=BBB_WEBHOOK_MAX_ATTEMPTS).values_list('id', flat=True))
+
+
+_queue = None
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        _queue = import_string(BBB_WEBHOOK_QUEUE)()
+    return _queue
+
+
+def to_payload(data):
+    """ Return raw `event` field of posted data (form or json), as string. """
+    payload = data.get('event', '') if hasattr(data, 'get') else data
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode('utf-8')
+    if not isinstance(payload, str):
+        payload = json.dumps(payload)
+    return payload
+
+
+def event_meetings(events):
+    """ Return set of meeting ids (external and internal) of events. """
+    return {id for e in events for id in (event_meeting_id(e), event_internal_meeting_id(e)) if id}
+
+
+def drain(queue=None, batch_size=None):
+    """ Process one batch of queued posts, and ack them.
+
+    Posts which can't be decoded are logged and dropped, so they don't
+    block the queue. Each call of process_events is all or nothing, so
+    if the batch fails nothing is applied, and its posts are processed
+    one by one in order: good ones are acked, failures are counted with
+    queue.fail(), and later posts of meetings of a failed post are held
+    back (neither processed nor acked), so events of each meeting are
+    still applied in order when they're retried.
+
+    :return:    stats of process_events, number of processed (or
+                dropped) posts, failed posts and held back posts
+    """
+    queue = queue or get_queue()
+    items = queue.get(batch_size or BBB_WEBHOOK_BATCH_SIZE)
+    stats = {'posts': 0, 'failed': 0, 'held': 0, 'events': 0, 'opened_logs': 0, 'closed_logs': 0, 'records': 0, 'duplicates': 0}
+    if not items:
+        return stats
+
+    posts = []
+    for id, payload in items:
+        try:
+            posts.append((id, parse_events(payload)))
+        except Exception as e:
+            logging.error('[-] Dropped invalid webhook post {}, {}'.format(id, str(e)))
+
+    failed, held = [], []
+    try:
+        stats.update(process_events([event for id, events in posts for event in events]))
+    except Exception as e:
+        logging.error('[-] Unable to process webhook batch, retrying posts one by one, {}'.format(str(e)))
+        totals = Counter()
+        blocked = set()     # Meetings of failed posts
+        for id, events in posts:
+            meetings = event_meetings(events)
+            if meetings & blocked:
+                held.append(id)
+                continue
+            try:
+                totals.update(process_events(events))
+            except Exception as e:
+                failed.append(id)
+                blocked |= meetings
+                for parked in queue.fail([id], str(e)):
+                    logging.error('[-] Parked webhook post {} after {} attempts, {}'.format(
+                        parked, BBB_WEBHOOK_MAX_ATTEMPTS, str(e)
+                    ))
+        stats.update(totals)
+
+    queue.ack([id for id, payload in items if id not in failed and id not in held])
+    stats.update(posts=len(items) - len(failed) - len(held), failed=len(failed), held=len(held))
+    return stats
@@ -0,0 +1,99 @@
+"""
+Timeouts, retries and circuit breaker for calls to BigBlueButton.
+
+Each server has its own CircuitBreaker. After BBB_CIRCUIT_FAILURE_THRESHOLD
+failures in a row, calls to that server fail fast with BigBlueButtonUnavailable
+for BBB_CIRCUIT_RESET_TIMEOUT seconds. After that one trial call is let through,
+if it succeeds server is used again, otherwise breaker opens again.
+"""
+import time
+import random
+import threading
+
+from .settings import *
+from .exceptions import BigBlueButtonUnavailable
+
+
+# Calls which can be safely sent again if they failed
+IDEMPOTENT_CALLS = (
+    'isMeetingRunning',
+    'getMeetings',
+    'getMeetingInfo',
+    'getRecordings',
+    'hooks/list',
+)
+
+
+def call_timeout(call, default):
+    """ Return (connect, read) timeout of call from BBB_CALL_TIMEOUTS, or default. """
+    timeout = BBB_CALL_TIMEOUTS.get(call, default)
+    if not isinstance(timeout, (list, tuple)):
+        timeout = (timeout, timeout)
+    return tuple(timeout)
+
+
+def call_retries(call):
+    """ Return how many times call can be retried. """
+    return BBB_RETRIES if call in IDEMPOTENT_CALLS else 0
+
+
+def backoff_delay(attempt):
+    """ Seconds to wait before retry number attempt (starting from 0),
+    exponential backoff with full jitter. """
+    return random.uniform(0, min(BBB_RETRY_BACKOFF_MAX, BBB_RETRY_BACKOFF * (2 ** attempt)))
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or BBB_CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout if reset_timeout is not None else BBB_CIRCUIT_RESET_TIMEOUT
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_call(self):
+        """ Raise BigBlueButtonUnavailable if calls to server should fail fast. """
+        if not BBB_CIRCUIT_BREAKER_ENABLED:
+            return
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                raise BigBlueButtonUnavailable(
+                    'BigBlueButton server "{}" is unavailable (circuit open)'.format(self.name)
+                )
+            # Half open, let this call through as a trial
+            self.trial = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(server):
+    """ Return CircuitBreaker of server, shared in process. """
+    breaker = _breakers.get(server)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(server, CircuitBreaker(server))
+    return breaker
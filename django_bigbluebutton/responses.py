@@ -0,0 +1,217 @@
+"""
+Typed objects for responses of BigBlueButton APIs.
+
+Each object is built in one pass over children of its xml element,
+converting numbers, booleans and timestamps on the way, and does
+not keep any reference to xml tree. They use __slots__, so they're
+small and cheap to create in polling loops.
+
+For compatibility with old dict results, fields can also be read
+like a dict: info['participant_count'] or info.get('participant_count').
+"""
+import datetime
+
+from django.conf import settings
+
+
+def to_int(text):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_bool(text):
+    return text is not None and text.strip().lower() == 'true'
+
+
+def to_datetime(text):
+    """ Convert BigBlueButton timestamp (milliseconds since epoch) to datetime.
+    0 (like endTime of running meeting) is returned as None. """
+    ms = to_int(text)
+    if not ms:
+        return None
+    if getattr(settings, 'USE_TZ', False):
+        return datetime.datetime.fromtimestamp(ms / 1000.0, tz=datetime.timezone.utc)
+    return datetime.datetime.fromtimestamp(ms / 1000.0)
+
+
+def to_text(text):
+    return text.strip() if text is not None else None
+
+
+def to_metadata(elem):
+    return {x.tag: x.text for x in elem}
+
+
+class Response:
+    """ Base of response objects.
+
+    Subclasses define __slots__ and `fields`, a dict of
+    {xml tag: (attribute, converter)}. Converter gets text of
+    element, or the element itself if tag is in `nested`.
+    """
+    __slots__ = ()
+    fields = {}
+    nested = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    @classmethod
+    def from_xml(cls, elem):
+        obj = cls()
+        fields = cls.fields
+        nested = cls.nested
+        for child in elem:
+            field = fields.get(child.tag)
+            if field is not None:
+                name, convert = field
+                setattr(obj, name, convert(child if child.tag in nested else child.text))
+        return obj
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.to_dict())
+
+
+class Attendee(Response):
+    __slots__ = (
+        'user_id', 'fullname', 'role', 'is_presenter',
+        'is_listening_only', 'has_joined_voice', 'has_video', 'client_type',
+    )
+    fields = {
+        'userID': ('user_id', to_text),
+        'fullName': ('fullname', to_text),
+        'role': ('role', to_text),
+        'isPresenter': ('is_presenter', to_bool),
+        'isListeningOnly': ('is_listening_only', to_bool),
+        'hasJoinedVoice': ('has_joined_voice', to_bool),
+        'hasVideo': ('has_video', to_bool),
+        'clientType': ('client_type', to_text),
+    }
+
+
+def to_attendees(elem):
+    return [Attendee.from_xml(x) for x in elem]
+
+
+class MeetingInfo(Response):
+    """ Meeting from getMeetingInfo, getMeetings or create response. """
+    __slots__ = (
+        'meeting_id', 'meeting_name', 'internal_meeting_id', 'parent_meeting_id',
+        'attendee_pw', 'moderator_pw', 'voice_bridge', 'dial_number',
+        'create_time', 'start_time', 'end_time', 'duration',
+        'running', 'recording', 'has_user_joined', 'has_been_forcibly_ended', 'is_breakout',
+        'participant_count', 'listener_count', 'voice_participant_count',
+        'video_count', 'moderator_count', 'max_users',
+        'attendees', 'metadata',
+    )
+    fields = {
+        'meetingID': ('meeting_id', to_text),
+        'meetingName': ('meeting_name', to_text),
+        'internalMeetingID': ('internal_meeting_id', to_text),
+        'parentMeetingID': ('parent_meeting_id', to_text),
+        'attendeePW': ('attendee_pw', to_text),
+        'moderatorPW': ('moderator_pw', to_text),
+        'voiceBridge': ('voice_bridge', to_int),
+        'dialNumber': ('dial_number', to_text),
+        'createTime': ('create_time', to_datetime),
+        'startTime': ('start_time', to_datetime),
+        'endTime': ('end_time', to_datetime),
+        'duration': ('duration', to_int),
+        'running': ('running', to_bool),
+        'recording': ('recording', to_bool),
+        'hasUserJoined': ('has_user_joined', to_bool),
+        'hasBeenForciblyEnded': ('has_been_forcibly_ended', to_bool),
+        'isBreakout': ('is_breakout', to_bool),
+        'participantCount': ('participant_count', to_int),
+        'listenerCount': ('listener_count', to_int),
+        'voiceParticipantCount': ('voice_participant_count', to_int),
+        'videoCount': ('video_count', to_int),
+        'moderatorCount': ('moderator_count', to_int),
+        'maxUsers': ('max_users', to_int),
+        'attendees': ('attendees', to_attendees),
+        'metadata': ('metadata', to_metadata),
+    }
+    nested = ('attendees', 'metadata')
+
+    @classmethod
+    def from_xml(cls, elem):
+        obj = super(MeetingInfo, cls).from_xml(elem)
+        if obj.attendees is None:
+            obj.attendees = []
+        return obj
+
+    @property
+    def attendee_list(self):
+        # Name of attendees in old dict result of meeting_info
+        return self.attendees
+
+    @property
+    def info(self):
+        # Items of get_meetings had their info under 'info' key
+        return self
+
+
+def to_playback_url(elem):
+    for url in elem.iter('url'):
+        return to_text(url.text)
+    return ''
+
+
+class Recording(Response):
+    __slots__ = (
+        'record_id', 'meeting_id', 'internal_meeting_id', 'name', 'state',
+        'published', 'is_breakout', 'start_time', 'end_time',
+        'participants', 'raw_size', 'url', 'metadata',
+    )
+    fields = {
+        'recordID': ('record_id', to_text),
+        'meetingID': ('meeting_id', to_text),
+        'internalMeetingID': ('internal_meeting_id', to_text),
+        'name': ('name', to_text),
+        'state': ('state', to_text),
+        'published': ('published', to_bool),
+        'isBreakout': ('is_breakout', to_bool),
+        'startTime': ('start_time', to_datetime),
+        'endTime': ('end_time', to_datetime),
+        'participants': ('participants', to_int),
+        'rawSize': ('raw_size', to_int),
+        'playback': ('url', to_playback_url),
+        'metadata': ('metadata', to_metadata),
+    }
+    nested = ('playback', 'metadata')
+
+    @classmethod
+    def from_xml(cls, elem):
+        obj = super(Recording, cls).from_xml(elem)
+        if obj.url is None:
+            obj.url = ''
+        return obj
+
+
+class Hook(Response):
+    __slots__ = ('hook_id', 'callback_url', 'meeting_id', 'permanent_hook', 'raw_data')
+    fields = {
+        'hookID': ('hook_id', to_text),
+        'callbackURL': ('callback_url', to_text),
+        'meetingID': ('meeting_id', to_text),
+        'permanentHook': ('permanent_hook', to_bool),
+        'rawData': ('raw_data', to_bool),
+    }
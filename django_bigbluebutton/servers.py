@@ -0,0 +1,82 @@
+"""
+Helpers to work with all BigBlueButton servers defined in settings.BBB_SERVERS.
+
+Used to place new meetings on least loaded healthy server.
+"""
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .settings import *
+from .bbb import BigBlueButton
+from .utils import parse_xml
+
+
+def get_server_names():
+    """ Return names of all configured servers. """
+    return list(BBB_SERVERS.keys())
+
+
+def get_server_load(server):
+    """ Call getMeetings on server and return its load as dict:
+
+        {
+            'server': 'bbb1',
+            'meetings': 3,
+            'participants': 42,
+            'load': 57.0,
+        }
+
+    Will return None if server is not healthy (not reachable or
+    does not answer with SUCCESS).
+    """
+    try:
+        bbb = BigBlueButton(server=server)
+        result = parse_xml(bbb.get(bbb.get_meetings_url()).content)
+    except Exception as e:
+        logging.error('[-] BigBlueButton server {} is not reachable, {}'.format(server, str(e)))
+        return None
+    if result is None:
+        logging.error('[-] BigBlueButton server {} did not answer getMeetings'.format(server))
+        return None
+
+    meetings = 0
+    participants = 0
+    for m in result.iterfind('meetings/meeting'):
+        meetings += 1
+        try:
+            participants += int(m.find('participantCount').text)
+        except Exception:
+            pass
+
+    weight = BBB_SERVERS[server].get('weight', 1) or 1
+    return {
+        'server': server,
+        'meetings': meetings,
+        'participants': participants,
+        'load': (participants + meetings * BBB_CLUSTER_MEETING_LOAD) / float(weight),
+    }
+
+
+def get_servers_load():
+    """ Return load of all healthy servers, checking them in parallel. """
+    servers = get_server_names()
+    with ThreadPoolExecutor(max_workers=min(BBB_MAX_WORKERS, len(servers))) as executor:
+        loads = executor.map(get_server_load, servers)
+    return [load for load in loads if load is not None]
+
+
+def least_loaded_server():
+    """ Return name of healthy server with lowest load, new meetings
+    should be created there. With only one server defined, it's returned
+    without any call. If no server is healthy, BBB_DEFAULT_SERVER is returned.
+    """
+    servers = get_server_names()
+    if len(servers) == 1:
+        return servers[0]
+
+    loads = get_servers_load()
+    if not loads:
+        logging.error('[-] No healthy BigBlueButton server found, using {}'.format(BBB_DEFAULT_SERVER))
+        return BBB_DEFAULT_SERVER
+    return min(loads, key=lambda x: x['load'])['server']
@@ -8,6 +8,208 @@ BBB_SECRET_KEY = getattr(settings, 'BBB_SECRET_KEY', None)
 BBB_CALLBACK_URL = getattr(settings, 'BBB_CALLBACK_URL', None)
 
 
+""" BBB_SERVERS:
+
+To use more than one BigBlueButton server, define all of them here.
+New meetings will be placed on least loaded healthy server, and each
+meeting remembers its server for later calls. Sample:
+
+BBB_SERVERS = {
+    'bbb1': {'api_url': 'https://bbb1.test.com/bigbluebutton/api/', 'secret_key': '...'},
+    'bbb2': {'api_url': 'https://bbb2.test.com/bigbluebutton/api/', 'secret_key': '...', 'weight': 2},
+}
+
+'weight' is optional (default 1), server with weight=2 gets twice the load of others.
+'checksum_algorithm' is optional too ('sha1' or 'sha256'), default is BBB_CHECKSUM_ALGORITHM.
+If not set, a single 'default' server is made from BBB_API_URL and BBB_SECRET_KEY.
+BBB_CLUSTER_MEETING_LOAD is how many participants each running meeting counts as,
+when comparing load of servers.
+"""
+BBB_SERVERS = getattr(settings, 'BBB_SERVERS', None) or {
+    'default': {'api_url': BBB_API_URL, 'secret_key': BBB_SECRET_KEY},
+}
+BBB_CHECKSUM_ALGORITHM = getattr(settings, 'BBB_CHECKSUM_ALGORITHM', 'sha1')
+BBB_DEFAULT_SERVER = getattr(settings, 'BBB_DEFAULT_SERVER', None) or list(BBB_SERVERS.keys())[0]
+BBB_CLUSTER_MEETING_LOAD = getattr(settings, 'BBB_CLUSTER_MEETING_LOAD', 5)
+
+
+""" HTTP connection pool settings:
+
+All BigBlueButton instances share one requests.Session per process.
+BBB_HTTP_POOL_CONNECTIONS is number of hosts to keep pools for, and
+BBB_HTTP_POOL_MAXSIZE is number of kept-alive connections per host (set it to
+number of threads of your worker). If BBB_HTTP_POOL_BLOCK=True, threads will wait
+for a free connection instead of opening extra ones.
+Timeouts are in seconds.
+"""
+BBB_HTTP_POOL_CONNECTIONS = getattr(settings, 'BBB_HTTP_POOL_CONNECTIONS', 10)
+BBB_HTTP_POOL_MAXSIZE = getattr(settings, 'BBB_HTTP_POOL_MAXSIZE', 10)
+BBB_HTTP_POOL_BLOCK = getattr(settings, 'BBB_HTTP_POOL_BLOCK', False)
+BBB_HTTP_KEEP_ALIVE = getattr(settings, 'BBB_HTTP_KEEP_ALIVE', True)
+BBB_CONNECT_TIMEOUT = getattr(settings, 'BBB_CONNECT_TIMEOUT', 5)
+BBB_READ_TIMEOUT = getattr(settings, 'BBB_READ_TIMEOUT', 30)
+
+
+""" Timeouts, retries and circuit breaker:
+
+BBB_CALL_TIMEOUTS overrides timeout of some calls, as (connect, read) tuple or a
+single number, for example {'getRecordings': (5, 120)}.
+Idempotent calls (isMeetingRunning, getMeetings, getMeetingInfo, getRecordings,
+hooks/list) are retried BBB_RETRIES times on connection errors, timeouts and 5xx
+responses, waiting a random time up to BBB_RETRY_BACKOFF * 2^attempt seconds
+(at most BBB_RETRY_BACKOFF_MAX) between tries.
+After BBB_CIRCUIT_FAILURE_THRESHOLD failures in a row, calls to that server fail fast
+with BigBlueButtonUnavailable for BBB_CIRCUIT_RESET_TIMEOUT seconds.
+"""
+BBB_CALL_TIMEOUTS = getattr(settings, 'BBB_CALL_TIMEOUTS', {})
+BBB_RETRIES = getattr(settings, 'BBB_RETRIES', 2)
+BBB_RETRY_BACKOFF = getattr(settings, 'BBB_RETRY_BACKOFF', 0.2)
+BBB_RETRY_BACKOFF_MAX = getattr(settings, 'BBB_RETRY_BACKOFF_MAX', 2)
+BBB_CIRCUIT_BREAKER_ENABLED = getattr(settings, 'BBB_CIRCUIT_BREAKER_ENABLED', True)
+BBB_CIRCUIT_FAILURE_THRESHOLD = getattr(settings, 'BBB_CIRCUIT_FAILURE_THRESHOLD', 5)
+BBB_CIRCUIT_RESET_TIMEOUT = getattr(settings, 'BBB_CIRCUIT_RESET_TIMEOUT', 30)
+
+""" Cache of read-only BigBlueButton responses:
+
+Results of isMeetingRunning, getMeetings, getMeetingInfo, getRecordings and
+hooks/list are cached in django cache named BBB_CACHE_ALIAS for BBB_CACHE_TTL[call]
+seconds (0 disables caching of that call). They are dropped whenever start, end or
+hook calls change the state. Expired responses are still served for BBB_CACHE_STALE_TTL
+seconds while they are refreshed in background.
+"""
+BBB_CACHE_ENABLED = getattr(settings, 'BBB_CACHE_ENABLED', True)
+BBB_CACHE_ALIAS = getattr(settings, 'BBB_CACHE_ALIAS', 'default')
+BBB_CACHE_TTL = {
+    'isMeetingRunning': 5,
+    'getMeetings': 5,
+    'getMeetingInfo': 5,
+    'getRecordings': 60,
+    'hooks/list': 60,
+}
+BBB_CACHE_TTL.update(getattr(settings, 'BBB_CACHE_TTL', {}))
+BBB_CACHE_STALE_TTL = getattr(settings, 'BBB_CACHE_STALE_TTL', 30)
+
+""" Coalescing of identical concurrent calls:
+
+If BBB_COALESCE_CALLS=True, identical read-only calls (same call and meeting)
+running at the same time in a process are sent to BBB only once, and all callers
+get that one result. With BBB_COALESCE_ACROSS_PROCESSES=True, same is done between
+processes with a lock in BBB_CACHE_ALIAS cache, held at most BBB_COALESCE_LOCK_TTL
+seconds; its result is kept BBB_COALESCE_RESULT_TTL seconds for waiting processes.
+"""
+BBB_COALESCE_CALLS = getattr(settings, 'BBB_COALESCE_CALLS', True)
+BBB_COALESCE_ACROSS_PROCESSES = getattr(settings, 'BBB_COALESCE_ACROSS_PROCESSES', False)
+BBB_COALESCE_LOCK_TTL = getattr(settings, 'BBB_COALESCE_LOCK_TTL', 10)
+BBB_COALESCE_RESULT_TTL = getattr(settings, 'BBB_COALESCE_RESULT_TTL', 2)
+BBB_COALESCE_POLL_INTERVAL = getattr(settings, 'BBB_COALESCE_POLL_INTERVAL', 0.05)
+
+""" Streaming of recordings:
+
+BigBlueButton.iter_meeting_records fetches recordings BBB_RECORDINGS_PAGE_SIZE
+at a time (BigBlueButton >= 2.6 allows at most 100), reading responses in chunks
+of BBB_STREAM_CHUNK_SIZE bytes.
+"""
+BBB_RECORDINGS_PAGE_SIZE = getattr(settings, 'BBB_RECORDINGS_PAGE_SIZE', 100)
+BBB_STREAM_CHUNK_SIZE = getattr(settings, 'BBB_STREAM_CHUNK_SIZE', 64 * 1024)
+
+""" Syncing of recordings:
+
+tasks.update_meetings_records asks recordings of BBB_SYNC_MEETINGS_PER_CALL
+meetings in each getRecordings call, and writes them to database in bulk,
+BBB_SYNC_BATCH_SIZE rows at a time.
+"""
+BBB_SYNC_MEETINGS_PER_CALL = getattr(settings, 'BBB_SYNC_MEETINGS_PER_CALL', 100)
+BBB_SYNC_BATCH_SIZE = getattr(settings, 'BBB_SYNC_BATCH_SIZE', 500)
+
+""" After first run, it only checks meetings which were running, or started/ended
+since its previous successful run minus BBB_SYNC_RECORDINGS_DELAY seconds, which
+should be more than the time your BigBlueButton takes to process recordings.
+Call it with full=True once in a while to check all meetings again.
+"""
+BBB_SYNC_RECORDINGS_DELAY = getattr(settings, 'BBB_SYNC_RECORDINGS_DELAY', 6 * 60 * 60)
+
+""" Per meeting work of sync tasks runs in parallel, at most BBB_SYNC_CONCURRENCY
+calls at a time, and at most BBB_SYNC_PER_SERVER_CONCURRENCY on each server.
+"""
+BBB_SYNC_CONCURRENCY = getattr(settings, 'BBB_SYNC_CONCURRENCY', 10)
+BBB_SYNC_PER_SERVER_CONCURRENCY = getattr(settings, 'BBB_SYNC_PER_SERVER_CONCURRENCY', 4)
+
+""" Sync tasks take a lock, so they run on one node at a time. BBB_TASK_LOCK is
+'db' (lease in SyncState table), 'cache' (lease in BBB_CACHE_ALIAS cache, should be
+shared between nodes) or None to disable it. Lease is held BBB_TASK_LOCK_TTL seconds
+and renewed while task is running. When another node holds it, task waits at most
+BBB_TASK_LOCK_WAIT seconds (0 means skip this run at once).
+"""
+BBB_TASK_LOCK = getattr(settings, 'BBB_TASK_LOCK', 'db')
+BBB_TASK_LOCK_TTL = getattr(settings, 'BBB_TASK_LOCK_TTL', 60)
+BBB_TASK_LOCK_WAIT = getattr(settings, 'BBB_TASK_LOCK_WAIT', 0)
+
+""" Poller (manage.py bbb_poller) checks servers with running meetings, or meetings
+changed in last BBB_POLL_HOT_WINDOW seconds, every BBB_POLL_HOT_INTERVAL seconds,
+and other servers every BBB_POLL_COLD_INTERVAL seconds. Slow or failing servers are
+polled less often, at least every BBB_POLL_MAX_INTERVAL seconds.
+"""
+BBB_POLL_HOT_INTERVAL = getattr(settings, 'BBB_POLL_HOT_INTERVAL', 5)
+BBB_POLL_COLD_INTERVAL = getattr(settings, 'BBB_POLL_COLD_INTERVAL', 60)
+BBB_POLL_MAX_INTERVAL = getattr(settings, 'BBB_POLL_MAX_INTERVAL', 300)
+BBB_POLL_HOT_WINDOW = getattr(settings, 'BBB_POLL_HOT_WINDOW', 10 * 60)
+
+""" Max number of threads used when BigBlueButton runs per meeting calls in parallel """
+BBB_MAX_WORKERS = getattr(settings, 'BBB_MAX_WORKERS', 10)
+
+""" Max number of concurrent requests AsyncBigBlueButton sends on fan-out calls """
+BBB_ASYNC_MAX_CONCURRENCY = getattr(settings, 'BBB_ASYNC_MAX_CONCURRENCY', 20)
+
+""" Metrics:
+
+BBB_METRICS_BACKEND is dotted path of a metrics backend class (see metrics.py),
+for example 'django_bigbluebutton.metrics.PrometheusBackend'. By default (None)
+nothing is measured. PrometheusBackend keeps metrics in memory of each process and
+serves them on api/metrics/, only to requests with 'Authorization: Bearer <token>'
+header if BBB_METRICS_TOKEN is set. BBB_METRICS_BUCKETS are histogram buckets (seconds).
+"""
+BBB_METRICS_BACKEND = getattr(settings, 'BBB_METRICS_BACKEND', None)
+BBB_METRICS_TOKEN = getattr(settings, 'BBB_METRICS_TOKEN', None)
+BBB_METRICS_BUCKETS = getattr(
+    settings, 'BBB_METRICS_BUCKETS',
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+""" Webhooks:
+
+If BBB_WEBHOOK_ASYNC=True, hook_callback only stores posted events in queue
+BBB_WEBHOOK_QUEUE (dotted path of a queues.WebhookQueue class, a database table by
+default) and answers 202 right away. `manage.py bbb_webhook_worker` processes them,
+BBB_WEBHOOK_BATCH_SIZE posts at a time, checking for new ones every
+BBB_WEBHOOK_POLL_INTERVAL seconds when queue is empty. A post which fails
+BBB_WEBHOOK_MAX_ATTEMPTS times is parked, kept in queue but not processed again.
+"""
+BBB_WEBHOOK_ASYNC = getattr(settings, 'BBB_WEBHOOK_ASYNC', False)
+BBB_WEBHOOK_QUEUE = getattr(settings, 'BBB_WEBHOOK_QUEUE', 'django_bigbluebutton.queues.DatabaseQueue')
+BBB_WEBHOOK_BATCH_SIZE = getattr(settings, 'BBB_WEBHOOK_BATCH_SIZE', 100)
+BBB_WEBHOOK_POLL_INTERVAL = getattr(settings, 'BBB_WEBHOOK_POLL_INTERVAL', 1)
+BBB_WEBHOOK_MAX_ATTEMPTS = getattr(settings, 'BBB_WEBHOOK_MAX_ATTEMPTS', 5)
+
+""" Webhook deduplication:
+
+Events delivered more than once (retries, several hooks of a meeting) are dropped,
+by key of internal meeting id, event id, user and timestamp. Keys of processed events
+are kept BBB_WEBHOOK_DEDUP_TTL seconds in BBB_WEBHOOK_DEDUP store: 'memory' (per process,
+at most BBB_WEBHOOK_DEDUP_SIZE keys), 'cache' (BBB_CACHE_ALIAS cache, shared between
+nodes) or None to disable it.
+"""
+BBB_WEBHOOK_DEDUP = getattr(settings, 'BBB_WEBHOOK_DEDUP', 'memory')
+BBB_WEBHOOK_DEDUP_TTL = getattr(settings, 'BBB_WEBHOOK_DEDUP_TTL', 3600)
+BBB_WEBHOOK_DEDUP_SIZE = getattr(settings, 'BBB_WEBHOOK_DEDUP_SIZE', 100000)
+
+""" BBB_WEBHOOK_MEETING_CACHE_SIZE:
+
+Max meetings whose pks are kept in memory of each process to resolve webhook events
+without queries (see webhooks.MeetingCache).
+"""
+BBB_WEBHOOK_MEETING_CACHE_SIZE = getattr(settings, 'BBB_WEBHOOK_MEETING_CACHE_SIZE', 10000)
+
+
 """ UPDATE_RUNNING_ON_EACH_CALL:
 
 If UPDATE_RUNNING_ON_EACH_CALL=True, means that on each call of queryset for
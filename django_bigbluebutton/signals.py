@@ -1,4 +1,12 @@
-from django.dispatch import Signal
+from django.dispatch import Signal, receiver
+from django.db.models.signals import post_save, post_delete
 
 
 meeting_ended = Signal()
+
+
+@receiver([post_save, post_delete], sender='django_bigbluebutton.Meeting')
+def invalidate_meeting_cache(sender, instance, **kwargs):
+    """ Drop cached pk of meeting used by webhooks, its meeting_id may have changed. """
+    from .webhooks import meeting_cache
+    meeting_cache.invalidate(instance.pk, instance.meeting_id)
@@ -0,0 +1,93 @@
+"""
+Coalescing (single-flight) of identical concurrent BigBlueButton calls.
+
+When many threads ask for same call (same call name and query) at the
+same moment, only first one sends request to BBB and all others wait
+for its result. With BBB_COALESCE_ACROSS_PROCESSES=True, a short-lived
+lock in django cache does the same between processes.
+"""
+import time
+import threading
+
+from django.core.cache import caches
+
+from .settings import *
+
+
+class _Call:
+    """ One in-flight call, which others can wait for. """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self, across_processes=None):
+        self.lock = threading.Lock()
+        self.calls = {}
+        if across_processes is None:
+            across_processes = BBB_COALESCE_ACROSS_PROCESSES
+        self.across_processes = across_processes
+
+    def do(self, key, fn):
+        """ Return fn(), if same key is already in flight
+        wait for it and return its result instead. """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if self.across_processes:
+                call.result = self.do_shared(key, fn)
+            else:
+                call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def do_shared(self, key, fn):
+        """ Same as do() but between processes, using cache.add as lock.
+        If lock holder fails or takes too long, fn() is called anyway. """
+        cache = caches[BBB_CACHE_ALIAS]
+        lock_key = key + ':flight'
+        result_key = key + ':flight-result'
+
+        if cache.add(lock_key, 1, BBB_COALESCE_LOCK_TTL):
+            try:
+                result = fn()
+                cache.set(result_key, (result, ), BBB_COALESCE_RESULT_TTL)
+                return result
+            finally:
+                cache.delete(lock_key)
+
+        # Another process is calling, wait for its result
+        deadline = time.time() + BBB_COALESCE_LOCK_TTL
+        while time.time() < deadline:
+            entry = cache.get(result_key)
+            if entry is not None:
+                return entry[0]
+            if cache.get(lock_key) is None:
+                break
+            time.sleep(BBB_COALESCE_POLL_INTERVAL)
+
+        entry = cache.get(result_key)
+        if entry is not None:
+            return entry[0]
+        return fn()
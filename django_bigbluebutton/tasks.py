@@ -6,63 +6,274 @@ Like updating records of meetings, update logs and ...
 """
 import logging
 import datetime
+import threading
 
+from queue import Queue
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .settings import *
 from .bbb import BigBlueButton
-from .models import Meeting, MeetingLog, MeetingRecord
+from .models import Meeting, MeetingLog, MeetingRecord, SyncState
+from .metrics import track_task
+from .executor import Executor
+from .locks import singleton_task
+from .utils import batched
+
+
+def server_names(servers):
+    """ Values of Meeting.server for meetings of servers. Meetings
+    created before servers were added have '' as server. """
+    names = list(servers)
+    if BBB_DEFAULT_SERVER in names:
+        names.append('')
+    return names
+
 
+@singleton_task('update_meetings_logs')
+@track_task('update_meetings_logs')
+def update_meetings_logs(full=False, servers=None, dry_run=False, concurrency=None, batch_size=None):
+    """ Will check which meetings are closed since last check,
+    using one getMeetings snapshot of each server, and will
+    close meetingLogs joined to them. Logs of meetings which
+    stopped otherwise since last run (like by Meeting.end) are
+    closed too.
 
-def update_meetings_logs():
-    """ Will iterate on all meetings, and check if they are closed,
-    will close meetingLogs joined to them.
+    :param full:        also close open logs of every meeting which is not
+                        running, not only the ones stopped since last check.
+                        (it's slower, run it rarely to fix missed changes)
+    :param servers:     only check meetings of these servers
+    :param dry_run:     only count changes, don't save them
+    :return:            dict of stats, number of running, started and
+                        stopped meetings and closed logs
     """
     logging.info('[+] Check meetings and close left out meetingLogs.')
 
-    meetings = Meeting.objects.all()
-    for meeting in meetings:
-        try:
-            is_running = meeting.check_is_running(commit=True)
-            if not is_running:
-                now_date = datetime.datetime.now()
-                MeetingLog.objects.filter(
-                    meeting__meeting_id=meeting.meeting_id,
-                    left_date__isnull=True
-                ).update(left_date=now_date)
-        except Exception as e:
-            logging.error(str(e))
-    logging.info('[+] Done checking meetings and updating logs for them.')
+    state = SyncState.get('update_meetings_logs')
+    run_time = timezone.now()
+    batch_size = batch_size or BBB_SYNC_BATCH_SIZE
+
+    stats = {}
+    started, stopped = Meeting.update_running_meetings(
+        servers=servers, dry_run=dry_run, concurrency=concurrency, batch_size=batch_size, stats=stats
+    )
+
+    now_date = timezone.now()
+    if full:
+        querysets = [MeetingLog.objects.filter(meeting__is_running=False)]
+        if servers is not None:
+            querysets[0] = querysets[0].filter(meeting__server__in=server_names(servers))
+    else:
+        querysets = [MeetingLog.objects.filter(meeting_id__in=ids) for ids in batched(stopped, batch_size)]
+        if state.last_run:
+            queryset = MeetingLog.objects.filter(
+                meeting__is_running=False, meeting__updated_at__gte=state.last_run
+            ).exclude(meeting_id__in=stopped)
+            if servers is not None:
+                queryset = queryset.filter(meeting__server__in=server_names(servers))
+            querysets.append(queryset)
+
+    closed = 0
+    for queryset in querysets:
+        queryset = queryset.filter(left_date__isnull=True)
+        closed += queryset.count() if dry_run else queryset.update(left_date=now_date)
+
+    if not dry_run and servers is None:
+        state.last_run = run_time
+        state.save(update_fields=['last_run', 'updated_at'])
+
+    stats.update({'started': len(started), 'stopped': len(stopped), 'closed_logs': closed})
+    logging.info('[+] Done checking meetings and updating logs for them, {}'.format(stats))
+    return stats
+
+
+def save_records(records, meetings, dry_run=False):
+    """ Insert new records and update changed ones, in bulk.
+
+    :param records:     list of Recording from bbb
+    :param meetings:    dict of {meeting_id: pk of Meeting}
+    :param dry_run:     only count new and changed records
+    :return:            (created, updated) number of rows
+    """
+    fields = ('meeting_id', 'name', 'link', 'start_time', 'end_time')
+    existing = MeetingRecord.objects.in_bulk([r.record_id for r in records], field_name='record_id')
+
+    new, changed = {}, []
+    for record in records:
+        if not record.record_id:
+            continue
+        values = {
+            'meeting_id': meetings.get(record.meeting_id),
+            'name': record.name or '',
+            'link': record.url,
+            'start_time': record.start_time,
+            'end_time': record.end_time,
+        }
+        obj = existing.get(record.record_id)
+        if obj is None:
+            new[record.record_id] = MeetingRecord(record_id=record.record_id, **values)
+        elif any(getattr(obj, k) != v for k, v in values.items()):
+            for k, v in values.items():
+                setattr(obj, k, v)
+            changed.append(obj)
+
+    if dry_run:
+        return len(new), len(changed)
+    if new:
+        # Rows inserted meanwhile by another worker are skipped
+        MeetingRecord.objects.bulk_create(new.values(), ignore_conflicts=True)
+    if changed:
+        MeetingRecord.objects.bulk_update(changed, fields)
+    return len(new), len(changed)
+
+
+def changed_meetings(since):
+    """ Return meetings which may have new recordings since `since`:
+    running ones, and ones updated (started/ended) since then. """
+    return Meeting.objects.filter(Q(is_running=True) | Q(updated_at__gte=since))
 
 
-def update_meetings_records():
+@singleton_task('update_meetings_records')
+@track_task('update_meetings_records')
+def update_meetings_records(meetings=None, batch_size=None, meetings_per_call=None, full=False, since=None,
+                            concurrency=None, servers=None, dry_run=False):
     """
-    Will iterate on meetings,
-    check if new record is created for them by bbb,
+    Will check if new record is created for meetings by bbb,
     then save it in database for showing to customers.
+
+    By default only meetings changed since last successful run are
+    checked, BBB_SYNC_RECORDINGS_DELAY seconds earlier, because BBB
+    publishes recordings a while after meeting is ended.
+
+    Recordings of BBB_SYNC_MEETINGS_PER_CALL meetings are fetched in
+    each getRecordings call, `concurrency` calls in parallel, and saved
+    BBB_SYNC_BATCH_SIZE at a time with bulk inserts/updates, while
+    next pages are fetched, so only a few batches are kept in memory.
+
+    :param meetings:    queryset of meetings to check, instead of
+                        meetings changed since last run
+    :param full:        check all meetings (full reconciliation),
+                        it's slow, run it rarely
+    :param since:       check meetings changed since this datetime,
+                        instead of last run
+    :param concurrency: max getRecordings calls in parallel,
+                        BBB_SYNC_CONCURRENCY by default
+    :param servers:     only check meetings of these servers
+    :param dry_run:     only count new and changed records, don't save them
+    :return:            dict of stats, number of meetings, records,
+                        created and updated rows and errors
     """
 
     logging.info('[+] Checking meetings and store new records if created any!')
 
-    meetings = Meeting.objects.all()
-    for meeting in meetings:
+    batch_size = batch_size or BBB_SYNC_BATCH_SIZE
+    meetings_per_call = meetings_per_call or BBB_SYNC_MEETINGS_PER_CALL
+
+    # Watermark is moved only on runs over all meetings changed since it
+    state = SyncState.get('update_meetings_records')
+    run_time = timezone.now()
+    track = meetings is None and since is None and servers is None and not dry_run
+    if meetings is None:
+        if full or (since is None and state.last_run is None):
+            meetings = Meeting.objects.all()
+        else:
+            if since is None:
+                since = state.last_run - datetime.timedelta(seconds=BBB_SYNC_RECORDINGS_DELAY)
+            meetings = changed_meetings(since)
+    if servers is not None:
+        meetings = meetings.filter(server__in=server_names(servers))
+
+    # Recordings are on server of meeting, so ask each server for its own meetings
+    by_server = {}
+    for pk, meeting_id, server in meetings.values_list('id', 'meeting_id', 'server').iterator():
+        by_server.setdefault(server or BBB_DEFAULT_SERVER, {}).setdefault(meeting_id, pk)
+
+    stats = {'meetings': 0, 'records': 0, 'created': 0, 'updated': 0, 'errors': 0}
+    calls = []
+    for server, server_meetings in by_server.items():
+        stats['meetings'] += len(server_meetings)
+        calls.extend((server, meeting_ids) for meeting_ids in batched(server_meetings, meetings_per_call))
+
+    def fetch(call):
+        """ Records of a batch of meetings, each record is a Recording, like:
+        <Recording {
+            'url': 'https://meeting.cpol.co/playback/presentation/2.0/playback.html?meetingId=0c19812ecd8955d77a3351a4e489fe50afcc-1612087443063',
+            'name': 'name of meeting',
+            'end_time': datetime(2021, 1, 31, 13, 32, 16),
+            'raw_size': 165691706,
+            'record_id': '0c19812ecd8955d77a3351a4e489fe50afcc-1612087443063',
+            'meeting_id': 'meeting-id',
+            'start_time': datetime(2021, 1, 31, 10, 4, 3),
+            ...
+        }>
+        """
+        server, meeting_ids = call
+        for batch in batched(BigBlueButton(server=server).iter_meeting_records(meeting_ids), batch_size):
+            batches.put((server, batch))
+
+    # Calls run in parallel and pass their records here in batches, which are
+    # saved in this thread as they come. Calls wait while the queue is full.
+    executor = Executor(concurrency=concurrency)
+    batches = Queue(maxsize=2 * executor.concurrency)
+    done = object()
+
+    def run_calls():
         try:
-            bbb = BigBlueButton()
-            recordings = bbb.get_meeting_records(meeting.meeting_id)
-            for record in recordings:
-                """ record sample:
-                {
-                    'url': 'https://meeting.cpol.co/playback/presentation/2.0/playback.html?meetingId=0c19812ecd8955d77a3351a4e489fe50afcc-1612087443063',
-                    'name': 'name of meeting',
-                    'end_time': 1612099936637,
-                    'raw_size': 165691706,
-                    'record_id': '0c19812ecd8955d77a3351a4e489fe50afcc-1612087443063',
-                    'meeting_id': 'meeting-id',
-                    'start_time': 1612087443063,
-                }
-                """
-                MeetingRecord.objects.get_or_create(
-                    link=record['url'],
-                    name=record['name'],
-                    record_id=record['record_id'],
-                    meeting=meeting,
-                )
+            for (server, meeting_ids), result, error in executor.imap(fetch, calls, server=lambda call: call[0]):
+                if error is not None:
+                    batches.put((server, error))
+        finally:
+            batches.put(done)
+
+    threading.Thread(target=run_calls, daemon=True).start()
+    for item in iter(batches.get, done):
+        server, batch = item
+        if isinstance(batch, Exception):
+            stats['errors'] += 1
+            logging.error('[-] Unable to get records of server {}, {}'.format(server, str(batch)))
+            continue
+        try:
+            created, updated = save_records(batch, by_server[server], dry_run)
+            stats['records'] += len(batch)
+            stats['created'] += created
+            stats['updated'] += updated
         except Exception as e:
-            logging.error(str(e))
+            stats['errors'] += 1
+            logging.error('[-] Unable to save records of server {}, {}'.format(server, str(e)))
+
+    if track and not stats['errors']:
+        state.last_run = run_time
+        state.save(update_fields=['last_run', 'updated_at'])
+
+    logging.info('[+] Done syncing records, {}'.format(stats))
+    return stats
+
+
+@singleton_task('update_meetings_hooks')
+@track_task('update_meetings_hooks')
+def update_meetings_hooks(meetings=None, concurrency=None):
+    """ Register hook of running meetings again, for example after
+    BBB_CALLBACK_URL is changed or hooks of a BBB server are lost.
+
+    :param meetings:    queryset of meetings, running ones by default
+    :return:            dict of stats, number of meetings and errors
+    """
+    if meetings is None:
+        meetings = Meeting.objects.filter(is_running=True)
+
+    # Hooks are registered in parallel, and saved here in bulk
+    results = Executor(concurrency=concurrency).run(
+        lambda meeting: meeting.create_hook(commit=False, raise_errors=True),
+        meetings.iterator(),
+        server=lambda meeting: meeting.server or BBB_DEFAULT_SERVER,
+    )
+    for meeting, error in results.errors:
+        logging.error('[-] Unable to register hook of meeting {}, {}'.format(meeting.meeting_id, str(error)))
+    registered = [meeting for meeting, result in results.results if result]
+    if registered:
+        Meeting.objects.bulk_update(registered, ['hook_id', 'hook_url'], batch_size=BBB_SYNC_BATCH_SIZE)
+
+    stats = {'meetings': len(results.results) + len(results.errors), 'errors': len(results.errors)}
+    logging.info('[+] Done registering hooks, {}'.format(stats))
+    return stats
@@ -0,0 +1,482 @@
+"""
+In-process fake BigBlueButton server, for tests and benchmarks.
+
+It serves BigBlueButton APIs over real HTTP on localhost, verifies
+checksums, and keeps meetings, attendees, hooks and recordings in memory.
+Latency and errors can be injected, and webhook events can be sent to
+hook callbacks (like MeetingViewSet.hook_callback). Sample usage:
+
+    from django_bigbluebutton.testing import FakeBigBlueButton
+
+    with FakeBigBlueButton() as fake:
+        meeting = Meeting.create('test', 'test-meeting')
+        fake.join('test-meeting', 'Test User', user_id=12)
+        assert meeting.check_is_running()
+
+While it's running, BBB_SERVERS entry of its server (BBB_DEFAULT_SERVER by default)
+points to it. BBB responses are cached in a separate in-memory cache while it's
+running, so no cached response of a real server is used, and cache of project is
+left untouched.
+"""
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib.parse
+
+from collections import Counter
+from xml.sax.saxutils import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from django.core.cache.backends.locmem import LocMemCache
+
+from .settings import *
+from . import resilience
+from .bbb import BigBlueButton
+
+
+class FakeMeeting:
+
+    def __init__(self, meeting_id, name, attendee_pw, moderator_pw, voice_bridge, record):
+        self.meeting_id = meeting_id
+        self.name = name
+        self.create_time = int(time.time() * 1000)
+        self.internal_meeting_id = '{}-{}'.format(
+            hashlib.sha1(meeting_id.encode('utf-8')).hexdigest(), self.create_time
+        )
+        self.attendee_pw = attendee_pw
+        self.moderator_pw = moderator_pw
+        self.voice_bridge = voice_bridge
+        self.record = record
+        self.running = False
+        self.start_time = 0
+        self.attendees = {}
+
+    def xml(self):
+        attendees = ''.join(
+            '<attendee><userID>{}</userID><fullName>{}</fullName><role>{}</role>'
+            '<isPresenter>false</isPresenter><isListeningOnly>false</isListeningOnly>'
+            '<hasJoinedVoice>false</hasJoinedVoice><hasVideo>false</hasVideo>'
+            '<clientType>HTML5</clientType></attendee>'.format(
+                escape(str(user_id)), escape(a['fullname']), a['role']
+            )
+            for user_id, a in self.attendees.items()
+        )
+        moderators = len([a for a in self.attendees.values() if a['role'] == 'MODERATOR'])
+        return (
+            '<meetingName>{name}</meetingName><meetingID>{meeting_id}</meetingID>'
+            '<internalMeetingID>{internal_id}</internalMeetingID><parentMeetingID>bbb-none</parentMeetingID>'
+            '<createTime>{create_time}</createTime><voiceBridge>{voice_bridge}</voiceBridge>'
+            '<dialNumber>613-555-1234</dialNumber><attendeePW>{attendee_pw}</attendeePW>'
+            '<moderatorPW>{moderator_pw}</moderatorPW><running>{running}</running><duration>0</duration>'
+            '<hasUserJoined>{joined}</hasUserJoined><recording>false</recording>'
+            '<hasBeenForciblyEnded>false</hasBeenForciblyEnded><startTime>{start_time}</startTime>'
+            '<endTime>0</endTime><participantCount>{participants}</participantCount>'
+            '<listenerCount>0</listenerCount><voiceParticipantCount>0</voiceParticipantCount>'
+            '<videoCount>0</videoCount><maxUsers>0</maxUsers><moderatorCount>{moderators}</moderatorCount>'
+            '<attendees>{attendees}</attendees><metadata/><isBreakout>false</isBreakout>'
+        ).format(
+            name=escape(self.name), meeting_id=escape(self.meeting_id),
+            internal_id=self.internal_meeting_id, create_time=self.create_time,
+            voice_bridge=self.voice_bridge, attendee_pw=escape(self.attendee_pw),
+            moderator_pw=escape(self.moderator_pw), running=str(self.running).lower(),
+            joined=str(bool(self.attendees)).lower(), start_time=self.start_time,
+            participants=len(self.attendees), moderators=moderators, attendees=attendees,
+        )
+
+
+class FakeRecording:
+
+    def __init__(self, record_id, meeting_id, internal_meeting_id, name, start_time, end_time, published):
+        self.record_id = record_id
+        self.meeting_id = meeting_id
+        self.internal_meeting_id = internal_meeting_id
+        self.name = name
+        self.start_time = start_time
+        self.end_time = end_time
+        self.published = published
+
+    def xml(self, base_url):
+        return (
+            '<recording><recordID>{record_id}</recordID><meetingID>{meeting_id}</meetingID>'
+            '<internalMeetingID>{record_id}</internalMeetingID><name>{name}</name>'
+            '<isBreakout>false</isBreakout><published>{published}</published>'
+            '<state>{state}</state><startTime>{start_time}</startTime><endTime>{end_time}</endTime>'
+            '<participants>1</participants><rawSize>1024</rawSize><metadata/>'
+            '<playback><format><type>presentation</type>'
+            '<url>{base_url}playback/presentation/2.3/{record_id}</url></format></playback></recording>'
+        ).format(
+            record_id=escape(self.record_id), meeting_id=escape(self.meeting_id), name=escape(self.name),
+            published=str(self.published).lower(), state='published' if self.published else 'unpublished',
+            start_time=self.start_time, end_time=self.end_time, base_url=escape(base_url),
+        )
+
+
+class FakeBigBlueButton:
+    """ Fake BigBlueButton server.
+
+    :param server:      name of server in BBB_SERVERS to point to this fake
+    :param secret_key:  secret used to verify checksums
+    :param latency:     seconds to wait before answering each call
+    :param error_rate:  fraction (0..1) of calls answered with HTTP 500
+    :param auto_running: if True created meetings are running right away,
+                        otherwise (like real BBB) only after someone joins.
+
+    `calls` counts received calls by name, `fail_calls` is a set of call
+    names to answer with FAILED returncode.
+    """
+
+    def __init__(self, server=None, secret_key='fake-secret', latency=0, error_rate=0, auto_running=True):
+        self.server = server or BBB_DEFAULT_SERVER
+        self.secret_key = secret_key
+        self.latency = latency
+        self.error_rate = error_rate
+        self.auto_running = auto_running
+        self.fail_calls = set()
+        self.calls = Counter()
+        self.lock = threading.RLock()
+        self.meetings = {}
+        self.recordings = {}
+        self.hooks = {}
+        self.last_hook_id = 0
+        self.last_event_ts = 0
+        self.httpd = None
+        self.previous_config = None
+        self.previous_cache = None
+
+    # Server lifecycle
+    @property
+    def api_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/bigbluebutton/api/'.format(host, port)
+
+    def start(self):
+        """ Start serving in a background thread and point BBB_SERVERS to it. """
+        fake = self
+
+        class Handler(FakeRequestHandler):
+            server_fake = fake
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05, ), daemon=True).start()
+
+        self.previous_config = BBB_SERVERS.get(self.server)
+        BBB_SERVERS[self.server] = {'api_url': self.api_url, 'secret_key': self.secret_key}
+        resilience.get_breaker(self.server).success()
+
+        self.previous_cache = BigBlueButton.cache.backend
+        BigBlueButton.cache.backend = LocMemCache('bbb-fake-{}'.format(id(self)), {})
+        return self
+
+    def stop(self):
+        if self.previous_config is None:
+            BBB_SERVERS.pop(self.server, None)
+        else:
+            BBB_SERVERS[self.server] = self.previous_config
+
+        BigBlueButton.cache.backend.clear()
+        BigBlueButton.cache.backend = self.previous_cache
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # State helpers
+    def create_meeting(self, meeting_id, name=None, attendee_pw='ap', moderator_pw='mp', voice_bridge=70000, record=True):
+        with self.lock:
+            meeting = self.meetings.get(meeting_id)
+            if meeting is None:
+                meeting = FakeMeeting(meeting_id, name or meeting_id, attendee_pw, moderator_pw, voice_bridge, record)
+                if self.auto_running:
+                    meeting.running = True
+                    meeting.start_time = meeting.create_time
+                self.meetings[meeting_id] = meeting
+            return meeting
+
+    def join(self, meeting_id, fullname, user_id=None, role='VIEWER'):
+        """ Add attendee to meeting, like a user opened a join link. """
+        with self.lock:
+            meeting = self.meetings[meeting_id]
+            user_id = user_id if user_id is not None else 'w_{}'.format(random.randint(0, 10 ** 9))
+            meeting.attendees[str(user_id)] = {'fullname': fullname, 'role': role}
+            if not meeting.running:
+                meeting.running = True
+                meeting.start_time = int(time.time() * 1000)
+            return str(user_id)
+
+    def leave(self, meeting_id, user_id):
+        with self.lock:
+            self.meetings[meeting_id].attendees.pop(str(user_id), None)
+
+    def end(self, meeting_id):
+        with self.lock:
+            return self.meetings.pop(meeting_id, None)
+
+    def add_recording(self, meeting_id, record_id=None, name=None, start_time=None, end_time=None, published=True):
+        """ Add a recording of meeting_id and return its record_id. """
+        with self.lock:
+            now = int(time.time() * 1000)
+            meeting = self.meetings.get(meeting_id)
+            internal_id = meeting.internal_meeting_id if meeting else '{}-{}'.format(
+                hashlib.sha1(meeting_id.encode('utf-8')).hexdigest(), now
+            )
+            record_id = record_id or '{}-{}'.format(internal_id.split('-')[0], now + len(self.recordings))
+            self.recordings[record_id] = FakeRecording(
+                record_id, meeting_id, internal_id, name or meeting_id,
+                start_time or now, end_time or now, published,
+            )
+            return record_id
+
+    def remove_recording(self, record_id):
+        with self.lock:
+            return self.recordings.pop(record_id, None)
+
+    # Webhooks
+    def event(self, event_id, meeting_id, user_id=None, fullname='', role='VIEWER', **attributes):
+        """ Build a webhook event like BBB does, and apply it on state
+        (user-joined adds attendee, user-left removes it, meeting-ended ends meeting). """
+        meeting = self.meetings.get(meeting_id)
+        internal_id = meeting.internal_meeting_id if meeting else attributes.pop('internal_meeting_id', '')
+        with self.lock:
+            # Unique timestamps, so distinct events are never taken as duplicates
+            self.last_event_ts = max(int(time.time() * 1000), self.last_event_ts + 1)
+            ts = self.last_event_ts
+        data = {
+            'type': 'event',
+            'id': event_id,
+            'attributes': {
+                'meeting': {
+                    'internal-meeting-id': internal_id,
+                    'external-meeting-id': meeting_id,
+                },
+            },
+            'event': {'ts': ts},
+        }
+        if user_id is not None:
+            data['attributes']['user'] = {
+                'internal-user-id': 'w_{}'.format(user_id),
+                'external-user-id': str(user_id),
+                'name': fullname,
+                'role': role,
+                'presenter': False,
+            }
+        data['attributes'].update(attributes)
+
+        if meeting is not None:
+            if event_id == 'user-joined':
+                self.join(meeting_id, fullname, user_id=user_id, role=role)
+            elif event_id == 'user-left':
+                self.leave(meeting_id, user_id)
+            elif event_id == 'meeting-ended':
+                self.end(meeting_id)
+        return {'data': data}
+
+    def send_events(self, meeting_id, events, client=None):
+        """ Send list of events (made by event()) in one post to every hook
+        of meeting_id (and global hooks), like BBB webhooks module does.
+
+        If django test `client` is provided, events are posted through it
+        to path of hook url, otherwise a real http request is sent.
+        Returns list of responses.
+        """
+        data = {
+            'event': json.dumps(events),
+            'timestamp': int(time.time() * 1000),
+            'domain': '127.0.0.1',
+        }
+        with self.lock:
+            urls = [
+                hook['callback_url'] for hook in self.hooks.values()
+                if not hook['meeting_id'] or hook['meeting_id'] == meeting_id
+            ]
+
+        responses = []
+        for url in urls:
+            if client is not None:
+                responses.append(client.post(urllib.parse.urlparse(url).path, data))
+            else:
+                responses.append(requests.post(url, data=data))
+        return responses
+
+    def send_event(self, event_id, meeting_id, client=None, **kwargs):
+        return self.send_events(meeting_id, [self.event(event_id, meeting_id, **kwargs)], client=client)
+
+    # API
+    def check_checksum(self, call, raw_query):
+        if raw_query.startswith('checksum='):
+            query, checksum = '', raw_query[len('checksum='):]
+        elif '&checksum=' in raw_query:
+            query, checksum = raw_query.rsplit('&checksum=', 1)
+        else:
+            return False
+        algorithm = 'sha256' if len(checksum) == 64 else 'sha1'
+        expected = hashlib.new(algorithm, '{}{}{}'.format(call, query, self.secret_key).encode('utf-8')).hexdigest()
+        return checksum == expected
+
+    def handle(self, call, params):
+        """ Return body of response (inside <response>) for call. """
+        with self.lock:
+            handler = getattr(self, 'api_' + call.replace('/', '_'), None)
+            if handler is None:
+                return failed('unsupportedRequest', 'This request is not supported.')
+            return handler(params)
+
+    def api_create(self, params):
+        meeting = self.create_meeting(
+            params.get('meetingID', ''), params.get('name'),
+            params.get('attendeePW', 'ap'), params.get('moderatorPW', 'mp'),
+            params.get('voiceBridge', 70000), params.get('record') == 'True'
+        )
+        return success(meeting.xml())
+
+    def api_join(self, params):
+        meeting = self.meetings.get(params.get('meetingID'))
+        if meeting is None:
+            return failed('notFound', 'We could not find a meeting with that meeting ID.')
+        if params.get('password') not in (meeting.attendee_pw, meeting.moderator_pw):
+            return failed('invalidPassword', 'You either did not supply a password or the password supplied is neither the attendee or moderator password for this conference.')
+        role = 'MODERATOR' if params.get('password') == meeting.moderator_pw else 'VIEWER'
+        user_id = params.get('userID') or 'w_{}'.format(random.randint(0, 10 ** 9))
+        meeting.attendees[str(user_id)] = {'fullname': params.get('fullName', ''), 'role': role}
+        meeting.running = True
+        meeting.start_time = meeting.start_time or int(time.time() * 1000)
+        return success('<meeting_id>{}</meeting_id><user_id>{}</user_id>'.format(
+            meeting.internal_meeting_id, escape(str(user_id))
+        ))
+
+    def api_isMeetingRunning(self, params):
+        meeting = self.meetings.get(params.get('meetingID'))
+        running = meeting is not None and meeting.running
+        return success('<running>{}</running>'.format(str(running).lower()))
+
+    def api_getMeetingInfo(self, params):
+        meeting = self.meetings.get(params.get('meetingID'))
+        if meeting is None:
+            return failed('notFound', 'We could not find a meeting with that meeting ID')
+        return success(meeting.xml())
+
+    def api_getMeetings(self, params):
+        if not self.meetings:
+            return success('<meetings/>') + '<messageKey>noMeetings</messageKey><message>no meetings were found on this server</message>'
+        return success('<meetings>{}</meetings>'.format(
+            ''.join('<meeting>{}</meeting>'.format(m.xml()) for m in self.meetings.values())
+        ))
+
+    def api_end(self, params):
+        meeting = self.meetings.get(params.get('meetingID'))
+        if meeting is None:
+            return failed('notFound', 'We could not find a meeting with that meeting ID - perhaps the meeting is not yet running?')
+        if params.get('password') != meeting.moderator_pw:
+            return failed('invalidPassword', 'You must supply the moderator password for this call.')
+        del self.meetings[meeting.meeting_id]
+        return success('<messageKey>sentEndMeetingRequest</messageKey><message>A request to end the meeting was sent.</message>')
+
+    def api_getRecordings(self, params):
+        recordings = list(self.recordings.values())
+        if params.get('meetingID'):
+            meeting_ids = set(params['meetingID'].split(','))
+            recordings = [r for r in recordings if r.meeting_id in meeting_ids]
+        if params.get('recordID'):
+            record_ids = set(params['recordID'].split(','))
+            recordings = [r for r in recordings if r.record_id in record_ids]
+
+        total = len(recordings)
+        pagination = ''
+        if 'offset' in params or 'limit' in params:
+            offset = int(params.get('offset', 0))
+            limit = int(params.get('limit', 100))
+            recordings = recordings[offset:offset + limit]
+            pagination = '<pagination><pageable><offset>{}</offset><limit>{}</limit></pageable>' \
+                         '<totalElements>{}</totalElements></pagination>'.format(offset, limit, total)
+
+        base_url = self.api_url.replace('bigbluebutton/api/', '')
+        return success('<recordings>{}</recordings>{}'.format(
+            ''.join(r.xml(base_url) for r in recordings), pagination
+        ))
+
+    def api_hooks_create(self, params):
+        callback_url = params.get('callbackURL', '')
+        meeting_id = params.get('meetingID') or None
+        for hook_id, hook in self.hooks.items():
+            if hook['callback_url'] == callback_url:
+                return success(
+                    '<hookID>{}</hookID><messageKey>duplicateWarning</messageKey>'
+                    '<message>There is already a hook for this callback URL.</message>'.format(hook_id)
+                )
+        self.last_hook_id += 1
+        self.hooks[self.last_hook_id] = {'callback_url': callback_url, 'meeting_id': meeting_id}
+        return success('<hookID>{}</hookID><permanentHook>false</permanentHook><rawData>false</rawData>'.format(
+            self.last_hook_id
+        ))
+
+    def api_hooks_list(self, params):
+        return success('<hooks>{}</hooks>'.format(''.join(
+            '<hook><hookID>{}</hookID><callbackURL><![CDATA[{}]]></callbackURL>'
+            '<meetingID><![CDATA[{}]]></meetingID><permanentHook>false</permanentHook>'
+            '<rawData>false</rawData></hook>'.format(hook_id, hook['callback_url'], hook['meeting_id'] or '')
+            for hook_id, hook in self.hooks.items()
+        )))
+
+    def api_hooks_destroy(self, params):
+        try:
+            del self.hooks[int(params.get('hookID'))]
+        except (KeyError, TypeError, ValueError):
+            return failed('destroyMissingHook', 'The hook informed was not found.')
+        return success('<removed>true</removed>')
+
+
+def success(body):
+    return '<returncode>SUCCESS</returncode>' + body
+
+
+def failed(key, message):
+    return '<returncode>FAILED</returncode><messageKey>{}</messageKey><message>{}</message>'.format(
+        key, escape(message)
+    )
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_fake = None
+
+    def do_GET(self):
+        fake = self.server_fake
+        url = urllib.parse.urlparse(self.path)
+        prefix = '/bigbluebutton/api/'
+        if not url.path.startswith(prefix):
+            return self.respond(404, 'Not found')
+
+        call = url.path[len(prefix):]
+        fake.calls[call] += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.error_rate and random.random() < fake.error_rate:
+            return self.respond(500, 'Internal server error')
+
+        if not fake.check_checksum(call, url.query):
+            body = failed('checksumError', 'You did not pass the checksum security check')
+        elif call in fake.fail_calls:
+            body = failed('internalError', 'Injected failure')
+        else:
+            params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+            body = fake.handle(call, params)
+        self.respond(200, '<response>{}</response>'.format(body), 'text/xml')
+
+    def respond(self, status, body, content_type='text/plain'):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
@@ -1,11 +1,49 @@
-from django.test import TestCase
+import json
+import time
+import datetime
+import threading
 
-from .models import Meeting
-from .bbb import BigBlueButton
-from .utils import xml_to_json
+from io import StringIO
+from unittest import mock
+from collections import Counter
+
+from django.test import TestCase, override_settings
+from django.db import connection, IntegrityError
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import caches
+
+from .models import Meeting, MeetingLog, MeetingRecord, SyncState, WebhookEvent
+from .bbb import BigBlueButton, get_session
+from .async_bbb import AsyncBigBlueButton
+from .cache import ResponseCache
+from .servers import least_loaded_server
+from .singleflight import SingleFlight
+from .exceptions import BigBlueButtonUnavailable
+from .resilience import CircuitBreaker, get_breaker
+from .settings import BBB_DEFAULT_SERVER, BBB_SERVERS
+from .testing import FakeBigBlueButton
+from .executor import Executor
+from .locks import TaskLock
+from .poller import Poller
+from .webhooks import process_events, deduplicator, meeting_cache, EventDeduplicator, MeetingCache, event_key
+from .queues import drain
+from . import benchmarks, metrics, tasks
 
 
 class BBBTest(TestCase):
+    """ Tests run against an in-process fake BigBlueButton server. """
+
+    def setUp(self):
+        self.fake = FakeBigBlueButton().start()
+        deduplicator.clear()
+        meeting_cache.clear()
+
+    def tearDown(self):
+        self.fake.stop()
 
     def test_get_meetings(self):
         """ Test if BigBlueButton's get_meeting method is working or not.
@@ -18,43 +56,721 @@ class BBBTest(TestCase):
 
         self.assertTrue(type(meetings) == list)
 
+    def test_shared_session(self):
+        """ All BigBlueButton instances should reuse one pooled session. """
+        self.assertIs(get_session(), get_session())
+        adapter = get_session().get_adapter(BigBlueButton.api_url or 'https://')
+        self.assertTrue(adapter._pool_maxsize > 0)
+
+    def test_async_client_urls(self):
+        """ Sync and async clients should build exactly same urls. """
+        self.assertEqual(
+            BigBlueButton().is_running_url('test'),
+            AsyncBigBlueButton().is_running_url('test')
+        )
+        self.assertEqual(
+            BigBlueButton().join_url('test', 'user', 'ap', userID='1'),
+            AsyncBigBlueButton().join_url('test', 'user', 'ap', userID='1')
+        )
+
+    def test_parse_get_meetings(self):
+        """ Info of each meeting should be built from getMeetings response itself. """
+        content = b'''<response><returncode>SUCCESS</returncode><meetings>
+            <meeting><meetingID>m-1</meetingID><running>true</running>
+                <attendeePW>ap</attendeePW><moderatorPW>mp</moderatorPW>
+                <startTime>1599199672948</startTime><endTime>0</endTime>
+                <participantCount>2</participantCount><moderatorCount>1</moderatorCount>
+                <attendees>
+                    <attendee><userID>1</userID><fullName>A</fullName><role>MODERATOR</role></attendee>
+                    <attendee><userID>2</userID><fullName>B</fullName><role>VIEWER</role></attendee>
+                </attendees>
+            </meeting>
+        </meetings></response>'''
+        meetings = BigBlueButton.parse_get_meetings(content)
+        self.assertEqual(len(meetings), 1)
+        self.assertEqual(meetings[0].meeting_id, 'm-1')
+        self.assertTrue(meetings[0].running)
+        self.assertIsNone(meetings[0].end_time)
+        self.assertEqual(meetings[0].participant_count, 2)
+        self.assertEqual([a.fullname for a in meetings[0].attendees], ['A', 'B'])
+
+        # Old dict style access still works
+        self.assertEqual(meetings[0]['info']['participant_count'], 2)
+
+    def test_servers(self):
+        """ With single server, it's always chosen and unknown servers are rejected. """
+        self.assertEqual(BigBlueButton().server, BBB_DEFAULT_SERVER)
+        self.assertEqual(least_loaded_server(), BBB_DEFAULT_SERVER)
+        with self.assertRaises(ImproperlyConfigured):
+            BigBlueButton(server='not-defined-server')
+
+    def test_start_single_server(self):
+        """ With one server, starting a meeting again doesn't check where it's running. """
+        meeting = Meeting.create('test', 'restart-meeting')
+        self.fake.calls.clear()
+        self.assertIsNotNone(meeting.start())
+        self.assertEqual(self.fake.calls['isMeetingRunning'], 0)
+
+    def test_start_server_down(self):
+        """ With many servers, a meeting whose server is down is started on a healthy one. """
+        meeting = Meeting.create('test', 'moved-meeting')
+        down = {'api_url': 'http://127.0.0.1:1/bigbluebutton/api/', 'secret_key': 'down'}
+        with mock.patch.dict(BBB_SERVERS, {'down-server': down}):
+            Meeting.objects.filter(pk=meeting.pk).update(server='down-server')
+            meeting.refresh_from_db()
+            self.assertIsNotNone(meeting.start())
+        self.assertEqual(Meeting.objects.get(pk=meeting.pk).server, BBB_DEFAULT_SERVER)
+
+    def test_update_meetings_logs(self):
+        """ Only meetings which stopped should be updated and have their logs closed. """
+        for i in range(3):
+            Meeting.objects.create(
+                name='m', meeting_id='diff-{}'.format(i), attendee_password='ap',
+                moderator_password='mp', is_running=i < 2, server=BBB_DEFAULT_SERVER,
+            )
+            self.fake.create_meeting('diff-{}'.format(i))
+            MeetingLog.objects.create(meeting=Meeting.objects.get(meeting_id='diff-{}'.format(i)), fullname='u')
+        self.fake.end('diff-1')
+
+        started, stopped = Meeting.update_running_meetings()
+        self.assertEqual(started, [Meeting.objects.get(meeting_id='diff-2').id])
+        self.assertEqual(stopped, [Meeting.objects.get(meeting_id='diff-1').id])
+
+        # Cached getMeetings responses are not used
+        BigBlueButton().get_meetings()
+        self.fake.end('diff-2')
+        self.assertEqual(Meeting.update_running_meetings()[1], [Meeting.objects.get(meeting_id='diff-2').id])
+        Meeting.objects.filter(meeting_id='diff-2').update(is_running=True)
+        self.fake.create_meeting('diff-2')
+
+        Meeting.objects.filter(meeting_id='diff-1').update(is_running=True)
+        # 1 select of running meetings, 1 update of stopped and 1 update of logs,
+        # 2 queries for the sync state and 3 for its lock
+        SyncState.get('update_meetings_logs')
+        with self.assertNumQueries(3 + 2 + 3):
+            tasks.update_meetings_logs()
+        self.assertEqual(
+            list(MeetingLog.objects.filter(left_date__isnull=True).values_list('meeting__meeting_id', flat=True)),
+            ['diff-0', 'diff-2']
+        )
+
+        # Meetings stopped since last run by other ways have their logs closed too
+        last_run = SyncState.get('update_meetings_logs').last_run
+        self.assertIsNotNone(last_run)
+        Meeting.objects.filter(meeting_id='diff-0').update(is_running=False, updated_at=last_run)
+        Meeting.objects.filter(meeting_id='diff-2').update(
+            is_running=False, updated_at=last_run - datetime.timedelta(seconds=1)
+        )
+        self.fake.end('diff-0')
+        self.fake.end('diff-2')
+        tasks.update_meetings_logs()
+        self.assertEqual(
+            list(MeetingLog.objects.filter(left_date__isnull=True).values_list('meeting__meeting_id', flat=True)),
+            ['diff-2']
+        )
+
+    def test_update_meetings_records(self):
+        """ Recordings are fetched for many meetings at once, and inserted or updated in bulk. """
+        for i in range(5):
+            Meeting.objects.create(
+                name='m', meeting_id='rec-{}'.format(i), attendee_password='ap', moderator_password='mp'
+            )
+            self.fake.add_recording('rec-{}'.format(i), record_id='record-{}'.format(i))
+        MeetingRecord.objects.create(record_id='record-0', name='old name')
+
+        stats = tasks.update_meetings_records(batch_size=2, meetings_per_call=2)
+        self.assertEqual(stats, {'meetings': 5, 'records': 5, 'created': 4, 'updated': 1, 'errors': 0})
+        self.assertEqual(self.fake.calls['getRecordings'], 3)
+        record = MeetingRecord.objects.get(record_id='record-0')
+        self.assertEqual((record.name, record.meeting.meeting_id), ('rec-0', 'rec-0'))
+
+        # Nothing changed, so nothing is written
+        with self.assertNumQueries(1 + 1 + 3 + 1 + 3):
+            stats = tasks.update_meetings_records(meetings_per_call=2)
+        self.assertEqual((stats['created'], stats['updated']), (0, 0))
+
+        # Pages of a call are saved in batches as they're fetched, not all at once
+        self.fake.calls.clear()
+        with mock.patch('django_bigbluebutton.bbb.BBB_RECORDINGS_PAGE_SIZE', 2), \
+                mock.patch('django_bigbluebutton.tasks.save_records', wraps=tasks.save_records) as save:
+            stats = tasks.update_meetings_records(full=True, batch_size=2, meetings_per_call=10)
+        self.assertEqual(stats['records'], 5)
+        self.assertEqual(self.fake.calls['getRecordings'], 3)
+        self.assertEqual([len(call.args[0]) for call in save.call_args_list], [2, 2, 1])
+
+    def test_task_lock(self):
+        """ Task is skipped while another node holds its lock, until the lease expires. """
+        for backend in ('db', 'cache'):
+            other = TaskLock('update_meetings_hooks', backend=backend, ttl=60)
+            self.assertTrue(other.acquire())
+            self.assertFalse(TaskLock('update_meetings_hooks', backend=backend).acquire())
+            if backend == 'db':
+                self.assertIsNone(tasks.update_meetings_hooks())
+            other.release()
+            with TaskLock('update_meetings_hooks', backend=backend) as acquired:
+                self.assertTrue(acquired)
+
+        SyncState.objects.filter(name='update_meetings_hooks').update(
+            locked_by='crashed-node', locked_until=timezone.now() - datetime.timedelta(seconds=1)
+        )
+        self.assertEqual(tasks.update_meetings_hooks(), {'meetings': 0, 'errors': 0})
+
+        # Locks disabled, they're always acquired
+        other = TaskLock('update_meetings_hooks', backend='db')
+        self.assertTrue(other.acquire())
+        with mock.patch('django_bigbluebutton.locks.BBB_TASK_LOCK', None):
+            with TaskLock('update_meetings_hooks') as acquired, TaskLock('update_meetings_hooks') as again:
+                self.assertTrue(acquired and again)
+            self.assertEqual(tasks.update_meetings_hooks(), {'meetings': 0, 'errors': 0})
+        other.release()
+
+    @override_settings(BBB_CALLBACK_URL='http://testserver')
+    def test_update_meetings_hooks(self):
+        """ Hooks of running meetings are registered again, and failures are counted. """
+        meeting = Meeting.create('test', 'hook-sync-meeting')
+        Meeting.objects.filter(pk=meeting.pk).update(hook_id='')
+        self.assertEqual(tasks.update_meetings_hooks(), {'meetings': 1, 'errors': 0})
+        self.assertTrue(Meeting.objects.get(pk=meeting.pk).hook_id)
+
+        self.fake.fail_calls.add('hooks/create')
+        self.assertEqual(tasks.update_meetings_hooks(), {'meetings': 1, 'errors': 1})
+
+        # Only hook fields are saved, other fields changed meanwhile are kept
+        self.fake.fail_calls.clear()
+        Meeting.objects.filter(pk=meeting.pk).update(name='renamed')
+        self.assertTrue(meeting.create_hook())
+        self.assertEqual(Meeting.objects.get(pk=meeting.pk).name, 'renamed')
+
+    def test_sync_commands(self):
+        """ Sync commands run tasks with their options, and print a summary. """
+        meeting = Meeting.create('test', 'command-meeting')
+        self.fake.add_recording('command-meeting')
+
+        out = StringIO()
+        call_command('bbb_sync_records', '--dry-run', '--since', '2d', stdout=out)
+        self.assertIn('Dry run', out.getvalue())
+        self.assertRegex(out.getvalue(), r'created\s+1')
+        self.assertRegex(out.getvalue(), r'bbb_calls\s+1')
+        self.assertFalse(MeetingRecord.objects.exists())
+
+        call_command('bbb_sync_records', '--server', BBB_DEFAULT_SERVER, stdout=StringIO())
+        self.assertEqual(meeting.records.count(), 1)
+
+        self.fake.end('command-meeting')
+        out = StringIO()
+        call_command('bbb_sync_running', '--concurrency', '2', stdout=out)
+        self.assertRegex(out.getvalue(), r'stopped\s+1')
+        self.assertIn('throughput', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('bbb_sync_running', '--server', 'not-defined-server')
+
+    def test_poller(self):
+        """ Servers with running meetings are polled often, idle ones rarely, failing ones with backoff. """
+        poller = Poller(hot_interval=5, cold_interval=60, max_interval=300)
+        self.assertEqual(poller.poll(BBB_DEFAULT_SERVER), 60)
+
+        Meeting.create('test', 'poller-meeting')
+        self.assertEqual(poller.poll(BBB_DEFAULT_SERVER), 5)
+        self.assertEqual(poller.interval(BBB_DEFAULT_SERVER, True, duration=2, failed=False), 20)
+        self.assertEqual(poller.interval(BBB_DEFAULT_SERVER, True, duration=0, failed=True), 10)
+        self.assertEqual(poller.interval(BBB_DEFAULT_SERVER, True, duration=0, failed=True), 20)
+
+        self.fake.error_rate = 1
+        self.assertEqual(poller.poll(BBB_DEFAULT_SERVER), 40)
+        self.assertTrue(Meeting.objects.get(meeting_id='poller-meeting').is_running)
+
+        # Each poll reaches the server even if getMeetings is cached, so a slow one is polled less often
+        self.fake.error_rate = 0
+        BigBlueButton().get_meetings()
+        self.fake.latency = 0.1
+        self.assertGreaterEqual(Poller(hot_interval=0.5).poll(BBB_DEFAULT_SERVER), 1)
+
+    def test_poller_command(self):
+        """ Poller command runs with locks disabled too. """
+        Meeting.create('test', 'command-poll-meeting')
+        out = StringIO()
+        with mock.patch('django_bigbluebutton.locks.BBB_TASK_LOCK', None), mock.patch('signal.signal'), \
+                mock.patch.object(Poller, 'run', autospec=True, side_effect=lambda poller: poller.run_once()):
+            call_command('bbb_poller', stdout=out)
+        self.assertIn('Polling servers {}'.format(BBB_DEFAULT_SERVER), out.getvalue())
+        self.assertEqual(self.fake.calls['getMeetings'], 1)
+
+    def test_bulk_webhook_events(self):
+        """ A batch of events is applied in order, with a few queries. """
+        meeting = Meeting.objects.create(
+            name='m', meeting_id='hook-meeting', attendee_password='ap', moderator_password='mp'
+        )
+        users = [get_user_model().objects.create(username='user-{}'.format(i)) for i in range(3)]
+        old_log = MeetingLog.objects.create(meeting=meeting, user=users[0], fullname='u')
+
+        events = []
+        for user in users:
+            events.append(self.fake.event('user-joined', 'hook-meeting', user_id=user.id, fullname='User'))
+        events.append(self.fake.event('user-left', 'hook-meeting', user_id=users[1].id))
+        events.append(self.fake.event('user-joined', 'unknown-meeting', user_id=users[2].id))
+        events = [e['data'] for e in events]
+
+        # meetings, users, transaction savepoints, 1 update and 1 insert
+        with self.assertNumQueries(2 + 2 + 2):
+            stats = process_events(events + events[:1])
+        self.assertEqual(stats, {'events': 4, 'opened_logs': 3, 'closed_logs': 1, 'records': 0, 'duplicates': 1})
+
+        # Redelivered events are dropped
+        stats = process_events(events)
+        self.assertEqual((stats['events'], stats['duplicates']), (0, 5))
+
+        old_log.refresh_from_db()
+        self.assertIsNotNone(old_log.left_date)
+        open_logs = MeetingLog.objects.filter(meeting=meeting, left_date__isnull=True)
+        self.assertEqual(sorted(open_logs.values_list('user_id', flat=True)), [users[0].id, users[2].id])
+        self.assertEqual(MeetingLog.objects.filter(user=users[1]).exclude(left_date=None).count(), 1)
+
+        process_events([self.fake.event('meeting-ended', 'hook-meeting')['data']])
+        self.assertFalse(MeetingLog.objects.filter(meeting=meeting, left_date__isnull=True).exists())
+
+    def test_webhook_dedup_claims(self):
+        """ Events are claimed before they're applied, and released if they fail. """
+        meeting = Meeting.objects.create(
+            name='m', meeting_id='claimed-meeting', attendee_password='ap', moderator_password='mp'
+        )
+        user = get_user_model().objects.create(username='claimed-user')
+        events = [self.fake.event('user-joined', 'claimed-meeting', user_id=user.id)['data']]
+
+        with mock.patch('django_bigbluebutton.webhooks.apply_events', side_effect=ValueError('failed')):
+            with self.assertRaises(ValueError):
+                process_events(events)
+        self.assertEqual(process_events(events)['opened_logs'], 1)
+        self.assertEqual(MeetingLog.objects.filter(meeting=meeting).count(), 1)
+
+        # Only first of concurrent deliveries claims the event, in each store
+        for store in ('memory', 'cache'):
+            dedup = EventDeduplicator(store=store)
+            new_events, keys, duplicates = dedup.filter(events)
+            self.assertEqual((len(new_events), keys), (1, [event_key(events[0])]))
+            self.assertEqual(dedup.filter(events)[2], 1)
+            dedup.release(keys)
+            self.assertEqual(len(dedup.filter(events)[0]), 1)
+            dedup.release(keys)
+
+    def test_webhook_event_times(self):
+        """ Logs are stamped with time of their events, so a join and leave in one batch last 0s. """
+        meeting = Meeting.objects.create(
+            name='m', meeting_id='timed-meeting', attendee_password='ap', moderator_password='mp'
+        )
+        user = get_user_model().objects.create(username='timed-user')
+        events = [self.fake.event(e, 'timed-meeting', user_id=user.id)['data'] for e in ('user-joined', 'user-left')]
+        events[1]['event']['ts'] = events[0]['event']['ts'] + 1500
+        process_events(events, now=datetime.datetime.now() + datetime.timedelta(minutes=1))
+
+        log = MeetingLog.objects.get(meeting=meeting)
+        self.assertEqual(log.left_date - log.join_date, datetime.timedelta(seconds=1.5))
+        self.assertEqual(meeting.get_report()['presence_time_logs'][str(user.id)]['duration'], 1)
+
+        # Existing logs are closed at time of event, never before they're joined
+        process_events([self.fake.event('user-joined', 'timed-meeting', user_id=user.id)['data']])
+        event = self.fake.event('user-left', 'timed-meeting', user_id=user.id)['data']
+        event['event']['ts'] -= 60000
+        process_events([event])
+        log = MeetingLog.objects.get(meeting=meeting, pk__gt=log.pk)
+        self.assertEqual(log.left_date, log.join_date)
+
+    def test_webhook_meeting_cache(self):
+        """ Meetings of events are cached, until they're changed or fail to be saved. """
+        meeting = Meeting.objects.create(
+            name='m', meeting_id='cached-meeting', attendee_password='ap', moderator_password='mp'
+        )
+        user = get_user_model().objects.create(username='cached-user')
+
+        def send(event_id, meeting_id='cached-meeting'):
+            return process_events([self.fake.event(event_id, meeting_id, user_id=user.id)['data']])
+
+        # meeting, user, transaction savepoints, update and insert, and no meeting query once cached
+        with self.assertNumQueries(6):
+            send('user-joined')
+        with self.assertNumQueries(4):
+            send('user-left')
+
+        meeting.meeting_id = 'renamed-meeting'
+        meeting.save()
+        self.assertEqual(send('user-left', 'cached-meeting')['events'], 0)
+
+        # Meeting deleted by another process, its logs can't be saved
+        send('user-left', 'renamed-meeting')
+        MeetingLog.objects.filter(meeting=meeting)._raw_delete(Meeting.objects.db)
+        Meeting.objects.filter(pk=meeting.pk)._raw_delete(Meeting.objects.db)
+        with mock.patch.object(MeetingLog.objects, 'bulk_create', side_effect=IntegrityError('FOREIGN KEY')):
+            self.assertEqual(send('user-joined', 'renamed-meeting')['events'], 0)
+        self.assertIsNone(meeting_cache.lookup('renamed-meeting', None))
+
+        # Least recently used meetings are evicted with all their ids
+        cache = MeetingCache(size=2)
+        events = []
+        for i in range(3):
+            Meeting.objects.create(
+                name='m', meeting_id='lru-{}'.format(i), attendee_password='ap', moderator_password='mp'
+            )
+            events.append(self.fake.event('meeting-ended', 'lru-{}'.format(i), internal_meeting_id='int-{}'.format(i)))
+        for event in events:
+            cache.resolve([event['data']])
+        self.assertEqual((len(cache.by_meeting_id), len(cache.by_internal_id)), (2, 2))
+        self.assertIsNone(cache.lookup(None, 'int-0'))
+        self.assertIsNotNone(cache.lookup(None, 'int-2'))
+
+    def test_recording_events(self):
+        """ Recording events save just that recording, or delete it. """
+        meeting = Meeting.create('test', 'rap-meeting')
+        record_id = self.fake.add_recording('rap-meeting')
+        self.fake.add_recording('rap-meeting')
+
+        def send(event_id):
+            event = self.fake.event(event_id, 'rap-meeting', **{'record-id': record_id})['data']
+            return process_events([event])['records']
+
+        self.assertEqual(send('rap-publish-ended'), 1)
+        self.assertEqual(self.fake.calls['getRecordings'], 1)
+        self.assertEqual(list(meeting.records.values_list('record_id', flat=True)), [record_id])
+        self.assertEqual(send('rap-published'), 0)
+
+        self.assertEqual(send('rap-deleted'), 1)
+        self.assertFalse(meeting.records.exists())
+
+    def test_webhook_queue(self):
+        """ In async mode callback only queues posts, and worker applies them in order. """
+        meeting = Meeting.objects.create(
+            name='m', meeting_id='queued-meeting', attendee_password='ap', moderator_password='mp'
+        )
+        user = get_user_model().objects.create(username='queued-user')
+        url = reverse('api_bbb:meeting_vs-hook-callback', kwargs={'pk': meeting.id})
+        with mock.patch('django_bigbluebutton.api.views.BBB_WEBHOOK_ASYNC', True):
+            for event_id in ('user-joined', 'user-left', 'user-joined'):
+                event = self.fake.event(event_id, 'queued-meeting', user_id=user.id)
+                res = self.client.post(url, {'event': json.dumps([event])})
+                self.assertEqual(res.status_code, 202)
+            self.client.post(url, {'event': 'invalid'})
+        self.assertEqual(WebhookEvent.objects.count(), 4)
+        self.assertFalse(MeetingLog.objects.exists())
+
+        out = StringIO()
+        with mock.patch('django_bigbluebutton.locks.BBB_TASK_LOCK', None):
+            call_command('bbb_webhook_worker', '--once', '--batch-size', '2', stdout=out)
+        self.assertIn('Processed 4 posts', out.getvalue())
+        self.assertFalse(WebhookEvent.objects.exists())
+        self.assertEqual(MeetingLog.objects.filter(user=user).count(), 2)
+        self.assertEqual(MeetingLog.objects.filter(user=user, left_date__isnull=True).count(), 1)
+
+    def test_webhook_queue_failures(self):
+        """ A post which keeps failing is parked, later posts of its meeting wait for it, others don't. """
+        meeting = Meeting.objects.create(
+            name='m', meeting_id='queued-meeting', attendee_password='ap', moderator_password='mp'
+        )
+        poisoned = Meeting.objects.create(
+            name='m', meeting_id='poison-meeting', attendee_password='ap', moderator_password='mp'
+        )
+        user = get_user_model().objects.create(username='queued-user')
+        url = reverse('api_bbb:meeting_vs-hook-callback', kwargs={'pk': meeting.id})
+        with mock.patch('django_bigbluebutton.api.views.BBB_WEBHOOK_ASYNC', True):
+            for event_id, meeting_id in (
+                ('user-joined', 'queued-meeting'), ('user-left', 'poison-meeting'),
+                ('user-joined', 'poison-meeting'), ('user-left', 'queued-meeting'),
+            ):
+                event = self.fake.event(event_id, meeting_id, user_id=user.id)
+                self.client.post(url, {'event': json.dumps([event])})
+
+        def process(events):
+            if any(e['id'] == 'user-left' and e['attributes']['meeting']['external-meeting-id'] == 'poison-meeting'
+                   for e in events):
+                raise ValueError('poison')
+            return process_events(events)
+
+        with mock.patch('django_bigbluebutton.queues.process_events', side_effect=process), \
+                mock.patch('django_bigbluebutton.queues.BBB_WEBHOOK_MAX_ATTEMPTS', 2):
+            stats = drain()
+            self.assertEqual((stats['posts'], stats['failed'], stats['held']), (2, 1, 1))
+            self.assertEqual(MeetingLog.objects.filter(meeting=meeting, left_date__isnull=False).count(), 1)
+            self.assertFalse(MeetingLog.objects.filter(meeting=poisoned).exists())
+
+            # Join after the failed leave is applied only once the leave is parked
+            out = StringIO()
+            call_command('bbb_webhook_worker', '--once', '--interval', '0', stdout=out)
+            self.assertIn('Processed 1 posts, 1 attempts failed', out.getvalue())
+            self.assertEqual(MeetingLog.objects.filter(meeting=poisoned, left_date__isnull=True).count(), 1)
+
+            parked = WebhookEvent.objects.get()
+            self.assertEqual((parked.attempts, parked.error), (2, 'poison'))
+            self.assertEqual(drain()['posts'], 0)
+
+        # A failed batch is rolled back as a whole, so its retry applies events once
+        events = [
+            self.fake.event('user-joined', 'queued-meeting', user_id=user.id)['data'],
+            self.fake.event('rap-published', 'queued-meeting', record_id='rec')['data'],
+        ]
+        with mock.patch('django_bigbluebutton.webhooks.process_recording_events', side_effect=ValueError('failed')):
+            with self.assertRaises(ValueError):
+                process_events(events)
+        self.assertEqual(MeetingLog.objects.filter(meeting=meeting, left_date__isnull=True).count(), 0)
+        with mock.patch('django_bigbluebutton.webhooks.process_recording_events', return_value=0):
+            self.assertEqual(process_events(events)['opened_logs'], 1)
+
+    def test_executor(self):
+        """ Executor limits calls per server and collects errors of items. """
+        lock = threading.Lock()
+        running, peak = Counter(), Counter()
+
+        def work(item):
+            server, i = item
+            with lock:
+                running[server] += 1
+                peak[server] = max(peak[server], running[server])
+            time.sleep(0.01)
+            with lock:
+                running[server] -= 1
+            if i == 3:
+                raise ValueError(i)
+            return i * 2
+
+        items = [('a', i) for i in range(10)] + [('b', i) for i in range(10)]
+        results = Executor(concurrency=6, per_server=2).run(work, items, server=lambda item: item[0])
+        self.assertEqual(len(results.results), 18)
+        self.assertEqual(sorted(item for item, error in results.errors), [('a', 3), ('b', 3)])
+        self.assertEqual(peak, {'a': 2, 'b': 2})
+
+        # Without servers, only concurrency limits the calls
+        peak.clear()
+        Executor(concurrency=6, per_server=2).run(work, [('x', i) for i in range(12)])
+        self.assertEqual(peak, {'x': 6})
+
+        # Queries of workers are seen by query counters of calling thread
+        counter = metrics.QueryCounter()
+        with connection.execute_wrapper(counter):
+            Executor(concurrency=2, close_connections=True).run(lambda i: SyncState.objects.count(), range(4))
+        self.assertEqual(counter.count, 4)
+
+    def test_incremental_records_sync(self):
+        """ After first run, only meetings changed since last run are checked, unless full=True. """
+        for i in range(3):
+            Meeting.objects.create(
+                name='m', meeting_id='inc-{}'.format(i), attendee_password='ap', moderator_password='mp'
+            )
+            self.fake.add_recording('inc-{}'.format(i))
+        self.assertEqual(tasks.update_meetings_records()['meetings'], 3)
+        self.assertIsNotNone(SyncState.get('update_meetings_records').last_run)
+
+        old = timezone.now() - datetime.timedelta(days=2)
+        Meeting.objects.update(updated_at=old)
+        SyncState.objects.filter(name='update_meetings_records').update(last_run=timezone.now())
+        Meeting.objects.filter(meeting_id='inc-1').update(is_running=True)
+        self.assertEqual(tasks.update_meetings_records()['meetings'], 1)
+
+        Meeting.objects.update(is_running=False)
+        self.assertEqual(tasks.update_meetings_records()['meetings'], 0)
+        self.assertEqual(tasks.update_meetings_records(full=True)['meetings'], 3)
+
+    def test_response_cache(self):
+        """ Cached responses are served until invalidated. """
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return 'true'
+
+        cache = ResponseCache()
+        key = cache.key('default', 'isMeetingRunning', 'test')
+        self.assertEqual(cache.get_or_load(key, 10, loader), 'true')
+        self.assertEqual(cache.get_or_load(key, 10, loader), 'true')
+        self.assertEqual(len(calls), 1)
+
+        cache.invalidate_meeting('default', 'test')
+        cache.get_or_load(key, 10, loader)
+        self.assertEqual(len(calls), 2)
+
+    def test_single_flight(self):
+        """ Concurrent identical calls should run loader only once. """
+        import threading
+        import time
+
+        calls = []
+        flight = SingleFlight(across_processes=False)
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'true'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(flight.do('key', loader)))
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, ['true'] * 10)
+        self.assertEqual(len(calls), 1)
+
+    def test_recordings_parser(self):
+        """ Recordings should be decoded incrementally, chunk by chunk. """
+        content = b'''<response><returncode>SUCCESS</returncode><recordings>
+            <recording><recordID>r-1</recordID><meetingID>m-1</meetingID><name>A</name>
+                <startTime>1</startTime><endTime>2</endTime><rawSize>10</rawSize>
+                <playback><format><url>https://test.com/1</url></format></playback></recording>
+            <recording><recordID>r-2</recordID><meetingID>m-1</meetingID><name>B</name>
+                <startTime>3</startTime><endTime>4</endTime><rawSize>20</rawSize></recording>
+        </recordings><pagination><totalElements>2</totalElements></pagination></response>'''
+        parser = BigBlueButton.recordings_parser()
+        records = []
+        for i in range(0, len(content), 16):
+            records.extend(parser.feed(content[i:i + 16]))
+        records.extend(parser.close())
+
+        self.assertEqual([r['record_id'] for r in records], ['r-1', 'r-2'])
+        self.assertEqual(records[0]['url'], 'https://test.com/1')
+        self.assertEqual(records[1]['url'], '')
+        self.assertEqual(parser.total, 2)
+        self.assertEqual(records, BigBlueButton.parse_get_meeting_records(content))
+
+    def test_bulk_join_urls(self):
+        """ Bulk join urls should be same as join_url ones. """
+        bbb = BigBlueButton()
+        urls = bbb.join_urls('test meeting', [
+            ('Test User', 'ap', {'userID': 12}),
+            ('مدرس', 'mp'),
+        ])
+        self.assertEqual(urls, [
+            bbb.join_url('test meeting', 'Test User', 'ap', userID=12),
+            bbb.join_url('test meeting', 'مدرس', 'mp'),
+        ])
+
+        url = bbb.join_urls('test', [('Test User', 'ap')], checksum_algorithm='sha256')[0]
+        self.assertEqual(len(url.split('checksum=')[1]), 64)
+
+    def test_circuit_breaker(self):
+        """ Breaker should fail fast after failures, and let a trial call through later. """
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.1)
+        breaker.failure()
+        breaker.before_call()
+        breaker.failure()
+        with self.assertRaises(BigBlueButtonUnavailable):
+            breaker.before_call()
+
+        time.sleep(0.15)
+        breaker.before_call()   # Trial call
+        with self.assertRaises(BigBlueButtonUnavailable):
+            breaker.before_call()
+        breaker.success()
+        breaker.before_call()
+        self.assertFalse(breaker.is_open)
+
+        # Unexpected errors of a trial call end it too
+        breaker = get_breaker(BBB_DEFAULT_SERVER)
+        bbb = BigBlueButton(use_cache=False)
+        try:
+            breaker.opened_at = time.monotonic() - breaker.reset_timeout - 1
+            with mock.patch.object(get_session(), 'get', side_effect=ValueError('unexpected')):
+                with self.assertRaises(ValueError):
+                    bbb.get(bbb.get_meetings_url())
+            self.assertFalse(breaker.trial)
+        finally:
+            breaker.success()
+
+    def test_fake_server_cache(self):
+        """ Fake server caches responses apart, and leaves cache of project alone. """
+        caches['default'].set('project-key', 1)
+        with FakeBigBlueButton():
+            BigBlueButton().get_meetings()
+        self.assertEqual(caches['default'].get('project-key'), 1)
+        self.assertIsNone(caches['default'].get(BigBlueButton.cache.key(BBB_DEFAULT_SERVER, 'getMeetings', False)))
+
+    @override_settings(BBB_CALLBACK_URL='http://testserver')
+    def test_fake_server_webhook(self):
+        """ Fake server should keep state and deliver webhooks to hook_callback. """
+        meeting = Meeting.create('test', 'fake-meeting')
+        self.assertTrue(meeting.hook_id)
+        self.assertTrue(meeting.check_is_running())
+
+        self.fake.join('fake-meeting', 'Test User', user_id=12)
+        self.assertEqual(meeting.info.participant_count, 1)
+
+        log = MeetingLog.objects.create(meeting=meeting, fullname='Test User')
+        responses = self.fake.send_event('meeting-ended', 'fake-meeting', client=self.client)
+        self.assertEqual([r.status_code for r in responses], [200])
+
+        log.refresh_from_db()
+        self.assertIsNotNone(log.left_date)
+        self.assertFalse(BigBlueButton(use_cache=False).is_running('fake-meeting') == 'true')
+
+    def test_benchmarks(self):
+        """ Benchmarks should run against fake server and detect regressions. """
+        results = benchmarks.run(self.fake, names=['get_meetings', 'get_report'], rooms=5, repeat=2, logs=[50])
+        self.assertEqual(results['benchmarks']['get_meetings']['runs'], 2)
+        self.assertEqual(results['benchmarks']['get_report']['50']['items_per_run'], 50)
+
+        # 5 events posted in 3 posts, last one is smaller
+        result = benchmarks.bench_hook_callback(self.fake, events_rate=1000, events_duration=0.005, events_batch=2)
+        self.assertEqual((result['runs'], result['items_per_run']), (3, round(5 / 3.0, 3)))
+
+        baseline = {'benchmarks': {'get_meetings': {'mean_seconds': 1.0}, 'get_report': {'50': {'mean_seconds': 0.0001}}}}
+        rows = {row[0]: row for row in benchmarks.compare(results, baseline)}
+        self.assertFalse(rows['get_meetings'][4])
+        self.assertTrue(rows['get_report.50'][4])
+
+    @override_settings(BBB_CALLBACK_URL='http://testserver')
+    def test_metrics(self):
+        """ Calls, tasks and webhook events should be exported in Prometheus format. """
+        backend = metrics.PrometheusBackend(buckets=(0.1, 1))
+        metrics.set_backend(backend)
+        try:
+            Meeting.create('test', 'metrics-meeting')
+            Meeting.update_running_meetings()
+            self.fake.send_event('meeting-ended', 'metrics-meeting', client=self.client)
+            response = self.client.get(reverse('api_bbb:metrics'))
+        finally:
+            metrics.set_backend(metrics.MetricsBackend())
+
+        text = response.content.decode()
+        self.assertIn('bbb_call_duration_seconds_count{call="create",server="default"} 1', text)
+        self.assertIn('bbb_call_duration_seconds_bucket{call="getMeetings",server="default",le="+Inf"} 1', text)
+        self.assertIn('# TYPE bbb_task_duration_seconds histogram', text)
+        self.assertIn('bbb_task_db_queries_total{task="update_running_meetings"}', text)
+        self.assertIn('bbb_webhook_events_total{event="meeting-ended"} 1', text)
+        self.assertEqual(self.client.get(reverse('api_bbb:metrics')).status_code, 404)
+
     def test_create_meeting(self):
         """ Will try to create a meeting with bbb.
 
-        Example output as json from bbb 'create' command:
+        Example output from bbb 'create' command is a MeetingInfo:
 
-        {'returncode': 'SUCCESS', 'meetingID': 'test',
-        'internalMeetingID': 'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3-1598891360456',
-        'parentMeetingID': 'bbb-none', 'attendeePW': 'ap', 'moderatorPW': 'mp',
-        'createTime': '1598891360456', 'voiceBridge': '73362', 'dialNumber': '613-555-1234',
-        'createDate': 'Mon Aug 31 12:29:20 EDT 2020', 'hasUserJoined': 'false',
-        'duration': '0', 'hasBeenForciblyEnded': 'false', 'messageKey': None, 'message': None}
+        <MeetingInfo {'meeting_id': 'test',
+        'internal_meeting_id': 'a94a8fe5ccb19ba61c4c0873d391e987982fbbd3-1598891360456',
+        'parent_meeting_id': 'bbb-none', 'attendee_pw': 'ap', 'moderator_pw': 'mp',
+        'create_time': datetime(2020, 8, 31, 16, 29, 20), 'voice_bridge': 73362,
+        'dial_number': '613-555-1234', 'has_user_joined': False,
+        'duration': 0, 'has_been_forcibly_ended': False, ...}>
         """
         meeting_name = 'test'
         meeting_id = 'test'
         meeting_welcome = 'test meeting welcome!'
 
         # First step is to request BBB and create a meeting
-        m_xml = BigBlueButton().start(
+        info = BigBlueButton().start(
             name=meeting_name,
             meeting_id=meeting_id,
             welcome=meeting_welcome
         )
-        meeting_json = xml_to_json(m_xml)
-        self.assertTrue(meeting_json['returncode'] == 'SUCCESS')
-        self.assertTrue(meeting_json['meetingID'] == meeting_id)
+        self.assertTrue(info.meeting_id == meeting_id)
 
         # Now create a model for it.
         current_meetings = Meeting.objects.count()
-        meeting, _ = Meeting.objects.get_or_create(meeting_id=meeting_json['meetingID'])
-        meeting.meeting_id = meeting_json['meetingID']
+        meeting, _ = Meeting.objects.get_or_create(meeting_id=info.meeting_id)
+        meeting.meeting_id = info.meeting_id
         meeting.name = meeting_name
-        meeting.welcome_text = meeting_json['meetingID']
-        meeting.attendee_password = meeting_json['attendeePW']
-        meeting.moderator_password = meeting_json['moderatorPW']
-        meeting.internal_meeting_id = meeting_json['internalMeetingID']
-        meeting.parent_meeting_id = meeting_json['parentMeetingID']
-        meeting.voice_bridge = meeting_json['voiceBridge']
+        meeting.welcome_text = info.meeting_id
+        meeting.attendee_password = info.attendee_pw
+        meeting.moderator_password = info.moderator_pw
+        meeting.internal_meeting_id = info.internal_meeting_id
+        meeting.parent_meeting_id = info.parent_meeting_id
+        meeting.voice_bridge = info.voice_bridge
         meeting.save()
 
         self.assertFalse(Meeting.objects.count() == current_meetings)
@@ -18,3 +18,71 @@ def xml_to_json(xml):
     for x in xml:
         result[x.tag] = x.text
     return result
+
+
+class XMLStream:
+    """ Incremental parser of BigBlueButton responses with a list of items.
+
+    feed() it with chunks of response and iterate on its result to get
+    decode(element) of each <tag> element parsed so far. Each element is
+    removed from tree as soon as it's decoded, so memory use does not grow
+    with size of response. `total` is set from <pagination> if server sent it.
+    Raises ValueError if BigBlueButton answered with FAILED returncode.
+    """
+
+    def __init__(self, tag, decode):
+        self.tag = tag
+        self.decode = decode
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.parents = []
+        self.total = None
+
+    def feed(self, data):
+        self.parser.feed(data)
+        return self.read()
+
+    def close(self):
+        self.parser.close()
+        return self.read()
+
+    def read(self):
+        for event, elem in self.parser.read_events():
+            if event == 'start':
+                self.parents.append(elem)
+                continue
+
+            self.parents.pop()
+            if elem.tag == self.tag:
+                try:
+                    yield self.decode(elem)
+                finally:
+                    if self.parents:
+                        self.parents[-1].remove(elem)
+            elif elem.tag == 'returncode' and elem.text != 'SUCCESS':
+                raise ValueError('BigBlueButton answered with returncode {}'.format(elem.text))
+            elif elem.tag == 'totalElements':
+                self.total = int(elem.text)
+
+
+def parse_xml_list(content, tag, decode):
+    """ Return list of decode(element) for each <tag> in content,
+    parsed in one pass. Empty list if response is not valid or FAILED. """
+    stream = XMLStream(tag, decode)
+    try:
+        items = list(stream.feed(content))
+        items.extend(stream.close())
+        return items
+    except (ValueError, ET.ParseError):
+        return []
+
+
+def batched(items, size):
+    """ Yield lists of at most size items from iterable items. """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,517 @@
+"""
+Processing of events posted by BigBlueButton webhooks.
+
+A posted batch is decoded once, its meetings and users are resolved
+with one query each, and all joins, leaves and meeting ends are
+applied with a few bulk statements in one transaction, instead of
+3-4 queries per event.
+
+Events which were already processed (BBB retries deliveries, and a
+meeting may have several hooks) are dropped before any of it, see
+EventDeduplicator, and meetings of recent events are resolved without
+queries, see MeetingCache.
+
+Recording events (rap-*) keep MeetingRecords up to date: a published
+recording is fetched alone with getRecordings recordID and saved, and
+a deleted one is removed, so recordings don't wait for polling sync.
+"""
+import json
+import time
+import logging
+import datetime
+import threading
+import urllib.parse
+
+from hashlib import sha1
+from collections import OrderedDict
+
+from django.db import transaction, IntegrityError
+from django.db.models import Case, When, Value, F, DateTimeField
+from django.db.models.functions import Greatest
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+
+from . import metrics
+from .settings import *
+from .bbb import BigBlueButton
+from .models import Meeting, MeetingLog, MeetingRecord
+from .executor import Executor
+from .tasks import save_records
+
+
+def parse_events(payload):
+    """ Decode `event` field of a webhook post to list of events.
+
+    Data sample (url-encoded):
+        event=[
+           {
+              "data":{
+                 "type":"event",
+                 "id":"user-joined",
+                 "attributes":{
+                    "meeting":{
+                       "internal-meeting-id":"5c13f0e2e59b3348767e88ee9e7d8ee858689f8c-1607594986040",
+                       "external-meeting-id":"meeting-11"
+                    },
+                    "user":{
+                       "internal-user-id":"w_fqxudq3emu8z",
+                       "external-user-id":"12",
+                       "name":"User name"
+                    }
+                 },
+                 "event":{
+                    "ts":1607595086800
+                 }
+              }
+           }
+        ]&timestamp=1607608642905&domain=meeting.cpol.co
+
+    Returns list of `data` of each event, invalid ones are skipped.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode('utf-8')
+    if isinstance(payload, str):
+        payload = payload.strip()
+        if not payload.startswith(('[', '{')):
+            payload = urllib.parse.unquote(payload)
+        payload = json.loads(payload)
+    if isinstance(payload, dict):
+        payload = [payload]
+
+    events = []
+    for item in payload or []:
+        data = item.get('data') if isinstance(item, dict) else None
+        if isinstance(data, dict) and data.get('id'):
+            events.append(data)
+    return events
+
+
+def to_user_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def event_meeting_id(event):
+    return event.get('attributes', {}).get('meeting', {}).get('external-meeting-id')
+
+
+def event_internal_meeting_id(event):
+    return event.get('attributes', {}).get('meeting', {}).get('internal-meeting-id')
+
+
+def event_record_id(event):
+    """ Return record id of a recording event, it's internal meeting id of recorded session. """
+    attributes = event.get('attributes', {})
+    return attributes.get('record-id') or event_internal_meeting_id(event)
+
+
+def event_time(event, default):
+    """ Return time of event from its `ts` (milliseconds), or default. """
+    try:
+        ts = int(event['event']['ts']) / 1000.0
+    except (KeyError, TypeError, ValueError):
+        return default
+    return datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc if settings.USE_TZ else None)
+
+
+def closed_at(times):
+    """ left_date of logs closed at time of their key in times, as
+    {key: time}, and never before they're joined. """
+    return Greatest(Case(
+        *[When(then=Value(time), **{key: value}) for (key, value), time in times.items()],
+        output_field=DateTimeField(),
+    ), F('join_date'))
+
+
+def event_user(event):
+    """ Return (user id, name) of a user event. """
+    user = event.get('attributes', {}).get('user', {})
+    return to_user_id(user.get('external-user-id')), user.get('name') or ''
+
+
+def event_key(event):
+    """ Return key of event, same for all deliveries of it, or None
+    if event has no timestamp to tell it apart from similar ones. """
+    ts = event.get('event', {}).get('ts')
+    if ts is None:
+        return None
+    attributes = event.get('attributes', {})
+    user = attributes.get('user', {})
+    return '{}|{}|{}|{}'.format(
+        attributes.get('meeting', {}).get('internal-meeting-id') or event_meeting_id(event) or '',
+        event['id'],
+        user.get('internal-user-id') or user.get('external-user-id') or '',
+        ts,
+    )
+
+
+class EventDeduplicator:
+    """ Keys of processed events, kept for `ttl` seconds.
+
+    Keys are claimed before their events are applied, atomically, so
+    an event delivered to several workers at once is applied by one of
+    them. Claims of a batch are released if it fails.
+
+    In 'memory' store, at most `size` keys are kept per process, oldest
+    ones are forgotten first. 'cache' store keeps them in BBB_CACHE_ALIAS
+    cache, so duplicates are found between nodes too.
+    """
+    prefix = 'bbb:event:'
+
+    def __init__(self, store=None, ttl=None, size=None):
+        self.store = store or BBB_WEBHOOK_DEDUP
+        self.ttl = ttl or BBB_WEBHOOK_DEDUP_TTL
+        self.size = size or BBB_WEBHOOK_DEDUP_SIZE
+        self.keys = OrderedDict()       # {key: expire time}
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[BBB_CACHE_ALIAS]
+
+    def cache_key(self, key):
+        return self.prefix + sha1(key.encode('utf-8')).hexdigest()
+
+    def claim(self, keys):
+        """ Mark keys as processed, and return set of keys which were not already. """
+        if self.store == 'cache':
+            return {k for k in keys if self.cache.add(self.cache_key(k), 1, self.ttl)}
+
+        now = time.monotonic()
+        expires = now + self.ttl
+        claimed = set()
+        with self.lock:
+            for key in keys:
+                if self.keys.get(key, 0) > now:
+                    continue
+                self.keys.pop(key, None)
+                self.keys[key] = expires
+                claimed.add(key)
+            while len(self.keys) > self.size:
+                self.keys.popitem(last=False)
+        return claimed
+
+    def release(self, keys):
+        """ Forget claimed keys, their events were not applied. """
+        if self.store == 'cache':
+            self.cache.delete_many([self.cache_key(k) for k in keys])
+            return
+
+        with self.lock:
+            for key in keys:
+                self.keys.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+
+    def filter(self, events):
+        """ Split events into (new events, their claimed keys, number of
+        duplicates). Duplicates in events itself are dropped too. """
+        keys = [event_key(e) for e in events]
+        claimed = self.claim({k for k in keys if k is not None})
+        new_events, new_keys = [], []
+        for event, key in zip(events, keys):
+            if key is not None:
+                if key not in claimed:
+                    continue
+                claimed.discard(key)
+                new_keys.append(key)
+            new_events.append(event)
+        return new_events, new_keys, len(events) - len(new_events)
+
+
+deduplicator = EventDeduplicator()
+
+
+class LRU(OrderedDict):
+    """ Dict which keeps at most `size` recently used keys. """
+
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key, value):
+        """ Set key, and return list of (key, value) of evicted ones. """
+        self[key] = value
+        self.move_to_end(key)
+        evicted = []
+        while len(self) > self.size:
+            evicted.append(self.popitem(last=False))
+        return evicted
+
+
+class MeetingCache:
+    """ Process-local map of external and internal meeting ids to Meeting pks,
+    so events of recent meetings are resolved without queries.
+
+    At most `size` recently used meetings are kept, with all their ids.
+    Entries of a meeting are dropped when it's saved or deleted in this
+    process (see signals.py). A meeting deleted by another process stays
+    cached, until its logs fail to be saved, see process_events.
+    """
+
+    def __init__(self, size=None):
+        self.size = size or BBB_WEBHOOK_MEETING_CACHE_SIZE
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.by_meeting_id = {}             # {meeting_id: pk}
+            self.by_internal_id = {}            # {internal meeting id: pk}
+            self.by_pk = LRU(self.size)         # {pk: (meeting_id, set of internal meeting ids)}
+
+    def forget(self, pk, meeting_id, internal_ids):
+        """ Remove ids of a meeting from indexes, called under the lock. """
+        if self.by_meeting_id.get(meeting_id) == pk:
+            self.by_meeting_id.pop(meeting_id)
+        for internal_id in internal_ids:
+            if self.by_internal_id.get(internal_id) == pk:
+                self.by_internal_id.pop(internal_id)
+
+    def add(self, pk, meeting_id):
+        """ Cache pk of meeting_id, and forget least recently used meetings, called under the lock. """
+        if pk in self.by_pk:
+            self.forget(pk, *self.by_pk.pop(pk))
+        self.by_meeting_id[meeting_id] = pk
+        for evicted, (evicted_meeting_id, internal_ids) in self.by_pk.put(pk, (meeting_id, set())):
+            self.forget(evicted, evicted_meeting_id, internal_ids)
+
+    def invalidate(self, pk, meeting_id=None):
+        with self.lock:
+            meeting_id, internal_ids = self.by_pk.pop(pk, (meeting_id, ()))
+            self.forget(pk, meeting_id, internal_ids)
+
+    def lookup(self, meeting_id, internal_id):
+        """ Return cached pk of meeting, or None, called under the lock. """
+        pk = self.by_internal_id.get(internal_id) if meeting_id is None else self.by_meeting_id.get(meeting_id)
+        # Meeting is marked as recently used
+        return pk if self.by_pk.get(pk) is not None else None
+
+    def resolve(self, events):
+        """ Return list of Meeting pks of events (None if not found), with at
+        most one query for meetings which are not cached. """
+        keys = [(event_meeting_id(e), event_internal_meeting_id(e)) for e in events]
+        with self.lock:
+            pks = [self.lookup(meeting_id, internal_id) for meeting_id, internal_id in keys]
+
+        missing = {meeting_id for (meeting_id, internal_id), pk in zip(keys, pks) if pk is None} - {None}
+        if missing:
+            found = dict(Meeting.objects.filter(meeting_id__in=missing).values_list('meeting_id', 'id'))
+            with self.lock:
+                for meeting_id, pk in found.items():
+                    self.add(pk, meeting_id)
+            pks = [pk if pk is not None else found.get(meeting_id) for (meeting_id, internal_id), pk in zip(keys, pks)]
+
+        with self.lock:
+            for (meeting_id, internal_id), pk in zip(keys, pks):
+                entry = self.by_pk.get(pk)
+                if entry is not None and internal_id:
+                    self.by_internal_id[internal_id] = pk
+                    entry[1].add(internal_id)
+        return pks
+
+
+meeting_cache = MeetingCache()
+
+
+# Recording events after which recording is fetched again, or removed
+RECORDING_UPDATE_EVENTS = ('rap-publish-ended', 'rap-published', 'rap-unpublished')
+RECORDING_DELETE_EVENTS = ('rap-deleted', )
+
+
+def process_recording_events(events, meetings):
+    """ Save recordings of recording events, or delete them.
+
+    Last event of each recording wins. Recordings to update are fetched
+    with one getRecordings call per server, in parallel.
+
+    :param events:      list of recording events
+    :param meetings:    list of Meeting pks of events
+    :return:            number of saved or deleted records
+    """
+    actions = {}        # {record id: (action, meeting pk)}
+    for event, meeting in zip(events, meetings):
+        record_id = event_record_id(event)
+        if record_id and meeting is not None:
+            actions.pop(record_id, None)
+            actions[record_id] = ('delete' if event['id'] in RECORDING_DELETE_EVENTS else 'update', meeting)
+    if not actions:
+        return 0
+
+    deleted = [record_id for record_id, (action, meeting) in actions.items() if action == 'delete']
+    updated = {record_id: meeting for record_id, (action, meeting) in actions.items() if action == 'update'}
+    count = 0
+    if deleted:
+        count += MeetingRecord.objects.filter(record_id__in=deleted).delete()[0]
+    if not updated:
+        return count
+
+    rows = Meeting.objects.filter(pk__in=set(updated.values())).values_list('id', 'meeting_id', 'server')
+    by_server = {}      # {server: {meeting_id: pk}}
+    servers = {}        # {pk: server}
+    for pk, meeting_id, server in rows:
+        by_server.setdefault(server or None, {})[meeting_id] = pk
+        servers[pk] = server or None
+    calls = {}          # {server: [record ids]}
+    for record_id, meeting in updated.items():
+        if meeting in servers:
+            calls.setdefault(servers[meeting], []).append(record_id)
+
+    def fetch(call):
+        server, record_ids = call
+        bbb = BigBlueButton(server=server)
+        records = bbb.get_records(record_ids)
+        for meeting_id in {r.meeting_id for r in records}:
+            bbb.cache.invalidate(bbb.server, 'getRecordings', meeting_id)
+        return records
+
+    for (server, record_ids), records, error in Executor().imap(fetch, calls.items(), server=lambda call: call[0]):
+        if error is not None:
+            logging.error('[-] Unable to get records {}, {}'.format(', '.join(record_ids), str(error)))
+            continue
+        try:
+            # Savepoint, so a failed save doesn't break transaction of the events
+            with transaction.atomic():
+                created, changed = save_records([r for r in records if r.record_id in record_ids], by_server[server])
+            count += created + changed
+        except Exception as e:
+            logging.error('[-] Unable to save records {}, {}'.format(', '.join(record_ids), str(e)))
+    return count
+
+
+def apply_events(events, meetings, now):
+    """ Apply events in one transaction, see process_events.
+
+    :param meetings:    list of Meeting pks of events
+    :return:            (number of applied events, new logs, number of
+                        closed logs, number of saved or deleted records)
+    """
+    user_ids = {event_user(e)[0] for e in events if e['id'] in ('user-joined', 'user-left')} - {None}
+    users = get_user_model().objects.in_bulk(user_ids) if user_ids else {}
+
+    close_users = {}        # {meeting: {user id: time}}, whose existing open logs are closed
+    ended = {}              # {meeting: time}, whose all existing open logs are closed
+    new_logs = []
+    open_logs = {}          # {(meeting, user): new log which is still open}
+    recording_events = []   # [(event, meeting)]
+    processed = 0
+    for event, meeting in zip(events, meetings):
+        if meeting is None:
+            continue
+        at = event_time(event, now)
+
+        if event['id'] in ('user-joined', 'user-left'):
+            user_id, name = event_user(event)
+            if user_id not in users:
+                continue
+
+            # Each join or leave closes open logs of user first
+            if meeting not in ended:
+                close_users.setdefault(meeting, {}).setdefault(user_id, at)
+            log = open_logs.pop((meeting, user_id), None)
+            if log is not None:
+                log.left_date = max(at, log.join_date)
+
+            if event['id'] == 'user-joined':
+                log = MeetingLog(
+                    meeting_id=meeting, user_id=user_id, join_date=at,
+                    fullname=getattr(users[user_id], 'fullname', None) or name,
+                )
+                new_logs.append(log)
+                open_logs[(meeting, user_id)] = log
+            processed += 1
+
+        elif event['id'] == 'meeting-ended':
+            ended.setdefault(meeting, at)
+            for key in [k for k in open_logs if k[0] == meeting]:
+                log = open_logs.pop(key)
+                log.left_date = max(at, log.join_date)
+            processed += 1
+
+        elif event['id'] in RECORDING_UPDATE_EVENTS + RECORDING_DELETE_EVENTS:
+            recording_events.append((event, meeting))
+            processed += 1
+
+    closed = 0
+    with transaction.atomic():
+        for meeting, times in close_users.items():
+            closed += MeetingLog.objects.filter(
+                meeting_id=meeting, user_id__in=times, left_date__isnull=True
+            ).update(left_date=closed_at({('user_id', user_id): time for user_id, time in times.items()}))
+        if ended:
+            closed += MeetingLog.objects.filter(
+                meeting_id__in=ended, left_date__isnull=True
+            ).update(left_date=closed_at({('meeting_id', meeting): time for meeting, time in ended.items()}))
+        if new_logs:
+            MeetingLog.objects.bulk_create(new_logs)
+
+        records = 0
+        if recording_events:
+            records = process_recording_events(*zip(*recording_events))
+
+    return processed, new_logs, closed, records
+
+
+def process_events(events, now=None):
+    """ Apply events (list of decoded event data) on MeetingLogs.
+
+    user-joined opens a new log of user, user-left closes open logs
+    of user, and meeting-ended closes all open logs of meeting. Events
+    are applied in order, so a join followed by a leave in same batch
+    makes a closed log. Logs are stamped with time of their events
+    (`ts`), or `now` for events without one. Recording events are
+    passed to process_recording_events().
+
+    Events already processed are dropped first, by claiming their keys.
+    All changes, recordings too, are made in one transaction, and if it
+    fails the claims are released, so the batch can be retried as a
+    whole and no event is applied twice.
+
+    :return:    dict of stats, number of processed events, opened
+                and closed logs, saved or deleted records, and
+                dropped duplicates
+    """
+    now = now or timezone.now()
+    keys, duplicates = [], 0
+    if BBB_WEBHOOK_DEDUP:
+        events, keys, duplicates = deduplicator.filter(events)
+        if duplicates:
+            logging.debug('[+] Dropped {} duplicate webhook events'.format(duplicates))
+
+    for event in events:
+        metrics.count_event(event['id'])
+
+    try:
+        # Resolve meetings of all events at once
+        meetings = meeting_cache.resolve(events)
+        try:
+            processed, new_logs, closed, records = apply_events(events, meetings, now)
+        except IntegrityError:
+            # A cached meeting may be deleted by another process, resolve them again
+            for pk in set(meetings) - {None}:
+                meeting_cache.invalidate(pk)
+            meetings = meeting_cache.resolve(events)
+            processed, new_logs, closed, records = apply_events(events, meetings, now)
+    except Exception:
+        if keys:
+            deduplicator.release(keys)
+        raise
+
+    stats = {
+        'events': processed, 'opened_logs': len(new_logs), 'closed_logs': closed,
+        'records': records, 'duplicates': duplicates,
+    }
+    logging.debug('[+] Processed webhook events, {}'.format(stats))
+    return stats
@@ -1,5 +1,5 @@
 import os
-from setuptools import setup
+from setuptools import setup, find_packages
 
 here = os.path.abspath(os.path.dirname(__file__))
 README = open(os.path.join(here, 'README.md')).read()
@@ -7,7 +7,7 @@ README = open(os.path.join(here, 'README.md')).read()
 setup(
     name='django-bigbluebutton',
     version='0.5.9',
-    packages=['django_bigbluebutton'],
+    packages=find_packages(include=['django_bigbluebutton', 'django_bigbluebutton.*']),
     description='A Django APP to Integrate BigBlueButton APIs with your current Project',
     long_description=README,
     long_description_content_type='text/markdown',
@@ -20,5 +20,8 @@ setup(
         'requests>=2.0',
         'djangorestframework>=3.0.0'
     ],
+    extras_require={
+        'async': ['httpx>=0.18'],
+    },
     include_package_data=True,
 )